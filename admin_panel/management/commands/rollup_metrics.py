@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+
+from admin_panel.metrics import metrics_settings, rebuild_metrics, roll_up
+
+
+class Command(BaseCommand):
+    help = (
+        'Fold ride events since the last run into the per-minute and per-hour ops metrics. '
+        'Run every minute from cron, or keep it running with --loop.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Roll up every ADMIN_METRICS INTERVAL seconds')
+        parser.add_argument('--rebuild-since', help='Recount counters from this ISO 8601 time up to the high-water mark')
+
+    def handle(self, *args, **options):
+        if options['rebuild_since']:
+            since = parse_datetime(options['rebuild_since'])
+            if since is None:
+                raise CommandError('--rebuild-since must be an ISO 8601 datetime')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            buckets = rebuild_metrics(since)
+            self.stdout.write(self.style.SUCCESS(f'Recounted {buckets} minute buckets'))
+            return
+
+        while True:
+            mark = roll_up()
+            self.stdout.write(f'Rolled up to {mark.isoformat()}')
+            if not options['loop']:
+                return
+            close_old_connections()
+            time.sleep(metrics_settings()['INTERVAL'])
@@ -0,0 +1,198 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce, Trunc
+from django.utils import timezone
+
+from admin_panel.models import HourMetrics, MinuteMetrics, RollupState
+from rides.models import Ride
+from rideshare_backend.upsert import upsert
+from users.models import DriverProfile
+
+DEFAULTS = {
+    'LAG_SECONDS': 5.0,
+    'INTERVAL': 60.0,
+    'MINUTE_RETENTION_DAYS': 7,
+    'MAX_POINTS': 1440,
+}
+
+STATE = 'ride_metrics'
+# counter -> the Ride timestamp that marks the event
+EVENTS = {
+    'rides_requested': 'created_at',
+    'rides_started': 'started_at',
+    'rides_completed': 'completed_at',
+    'rides_cancelled': 'cancelled_at',
+}
+COUNTERS = tuple(EVENTS) + ('gmv',)
+GAUGES = ('open_rides', 'active_rides', 'online_drivers')
+RESOLUTIONS = {'minute': MinuteMetrics, 'hour': HourMetrics}
+CENT = Decimal('0.01')
+
+
+def metrics_settings():
+    return {**DEFAULTS, **getattr(settings, 'ADMIN_METRICS', {})}
+
+
+def minute_of(moment):
+    return timezone.localtime(moment).replace(second=0, microsecond=0)
+
+
+def hour_of(moment):
+    return timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def _new_counts():
+    return defaultdict(lambda: [0] * len(EVENTS) + [Decimal('0')])
+
+
+def event_counts(rides, since, until):
+    """``{minute: [requested, started, completed, cancelled, gmv]}`` for events of ``rides`` in ``(since, until]``."""
+    counts = _new_counts()
+    for position, (counter, field) in enumerate(EVENTS.items()):
+        aggregates = {'count': Count('id')}
+        if counter == 'rides_completed':
+            aggregates['gmv'] = Sum(Coalesce('actual_fare', 'estimated_fare'))
+        rows = (
+            rides.filter(**{f'{field}__gt': since, f'{field}__lte': until})
+            .annotate(minute=Trunc(field, 'minute')).order_by().values('minute').annotate(**aggregates)
+        )
+        for row in rows:
+            counts[row['minute']][position] += row['count']
+            if row.get('gmv') is not None:
+                counts[row['minute']][-1] += Decimal(str(row['gmv']))
+    return counts
+
+
+def _write_counts(minutes):
+    hours = _new_counts()
+    for minute, values in minutes.items():
+        total = hours[hour_of(minute)]
+        for position, value in enumerate(values):
+            total[position] += value
+    now = timezone.now()
+    for model, counts in ((MinuteMetrics, minutes), (HourMetrics, hours)):
+        upsert(
+            model, ('bucket',),
+            [(bucket, *values[:-1], values[-1].quantize(CENT), now) for bucket, values in counts.items()],
+            increment=COUNTERS, assign=('updated_at',),
+        )
+
+
+def sample_gauges():
+    # Each count is served by a partial index over the small live slice.
+    return (
+        Ride.objects.filter(status='requested').count(),
+        Ride.objects.filter(status__in=('accepted', 'started')).count(),
+        DriverProfile.objects.filter(is_online=True).count(),
+    )
+
+
+def roll_up(now=None):
+    """
+    Fold ride events past the high-water mark into minute and hour buckets.
+
+    Events are read for ``(high-water mark, now - LAG_SECONDS]``; the lag
+    lets transactions that took their timestamps earlier commit first.
+    Every event timestamp is written together with ``Ride.updated_at``,
+    so only rides updated after the mark are read, through its index,
+    and no event is counted twice. The gauges are sampled into the
+    current buckets and minute buckets past retention are dropped. The
+    first run only sets the mark; ``rebuild_metrics`` backfills history.
+    Returns the new high-water mark.
+    """
+    options = metrics_settings()
+    now = now or timezone.now()
+    until = now - timedelta(seconds=options['LAG_SECONDS'])
+    with transaction.atomic():
+        state, _ = RollupState.objects.select_for_update().get_or_create(
+            name=STATE, defaults={'high_water_mark': until},
+        )
+        since = state.high_water_mark
+        if until > since:
+            _write_counts(event_counts(Ride.objects.filter(updated_at__gt=since), since, until))
+            state.high_water_mark = until
+            state.save(update_fields=['high_water_mark', 'updated_at'])
+
+        gauges = sample_gauges()
+        for model, bucket in ((MinuteMetrics, minute_of(now)), (HourMetrics, hour_of(now))):
+            upsert(
+                model, ('bucket',), [(bucket, *[0] * len(COUNTERS), *gauges, now)],
+                increment=COUNTERS, assign=GAUGES + ('updated_at',),
+            )
+        MinuteMetrics.objects.filter(bucket__lt=now - timedelta(days=options['MINUTE_RETENTION_DAYS'])).delete()
+    return state.high_water_mark
+
+
+def rebuild_metrics(since):
+    """
+    Recount the counters of every bucket from the hour holding ``since`` up to the high-water mark.
+
+    This scans ``Ride`` over the range, so run it off-peak. Gauges cannot be
+    recovered from history and are kept as they are. Returns the number of
+    minute buckets with events.
+    """
+    start = hour_of(since)
+    with transaction.atomic():
+        state, _ = RollupState.objects.select_for_update().get_or_create(
+            name=STATE,
+            defaults={'high_water_mark': timezone.now() - timedelta(seconds=metrics_settings()['LAG_SECONDS'])},
+        )
+        for model in RESOLUTIONS.values():
+            model.objects.filter(bucket__gte=start).update(**{counter: 0 for counter in COUNTERS})
+        minutes = event_counts(Ride.objects.all(), start - timedelta(microseconds=1), state.high_water_mark)
+        _write_counts(minutes)
+    return len(minutes)
+
+
+def rates(completed, cancelled):
+    finished = completed + cancelled
+    if not finished:
+        return None, None
+    return round(completed / finished, 4), round(cancelled / finished, 4)
+
+
+def bucket_row(row):
+    completion_rate, cancellation_rate = rates(row['rides_completed'], row['rides_cancelled'])
+    return {
+        **row,
+        'gmv': Decimal(row['gmv']).quantize(CENT),
+        'completion_rate': completion_rate,
+        'cancellation_rate': cancellation_rate,
+    }
+
+
+def metrics_series(resolution, since, until):
+    """Buckets of ``resolution`` in ``[since, until)``, oldest first and at most ``MAX_POINTS`` of them."""
+    rows = (
+        RESOLUTIONS[resolution].objects.filter(bucket__gte=since, bucket__lt=until).order_by('bucket')
+        .values('bucket', *COUNTERS, *GAUGES)[:metrics_settings()['MAX_POINTS']]
+    )
+    return [bucket_row(row) for row in rows]
+
+
+def summarize(rows):
+    """Totals, rates and latest gauges over ``metrics_series`` rows."""
+    totals = {counter: sum(row[counter] for row in rows) for counter in COUNTERS}
+    totals['gmv'] = Decimal(totals['gmv']).quantize(CENT)
+    totals['completion_rate'], totals['cancellation_rate'] = rates(totals['rides_completed'], totals['rides_cancelled'])
+    sampled = [row for row in rows if row['online_drivers'] is not None]
+    for gauge in GAUGES:
+        totals[gauge] = sampled[-1][gauge] if sampled else None
+    return totals
+
+
+def dashboard(now=None):
+    """The last 60 minutes and the last 24 hours, read from at most 85 bucket rows."""
+    now = now or timezone.now()
+    state = RollupState.objects.filter(name=STATE).values_list('high_water_mark', flat=True).first()
+    minute, hour = minute_of(now), hour_of(now)
+    return {
+        'high_water_mark': state,
+        'last_hour': summarize(metrics_series('minute', minute - timedelta(minutes=59), minute + timedelta(minutes=1))),
+        'last_day': summarize(metrics_series('hour', hour - timedelta(hours=23), hour + timedelta(hours=1))),
+    }
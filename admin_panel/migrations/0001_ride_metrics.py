@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourMetrics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(help_text='Start of the minute or hour', unique=True)),
+                ('rides_requested', models.IntegerField(default=0)),
+                ('rides_started', models.IntegerField(default=0)),
+                ('rides_completed', models.IntegerField(default=0)),
+                ('rides_cancelled', models.IntegerField(default=0)),
+                ('gmv', models.DecimalField(decimal_places=2, default=0, help_text='Fares of rides completed', max_digits=14)),
+                ('open_rides', models.IntegerField(blank=True, help_text='Rides waiting for a driver', null=True)),
+                ('active_rides', models.IntegerField(blank=True, help_text='Rides accepted or under way', null=True)),
+                ('online_drivers', models.IntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'hour metrics',
+                'ordering': ['bucket'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='MinuteMetrics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(help_text='Start of the minute or hour', unique=True)),
+                ('rides_requested', models.IntegerField(default=0)),
+                ('rides_started', models.IntegerField(default=0)),
+                ('rides_completed', models.IntegerField(default=0)),
+                ('rides_cancelled', models.IntegerField(default=0)),
+                ('gmv', models.DecimalField(decimal_places=2, default=0, help_text='Fares of rides completed', max_digits=14)),
+                ('open_rides', models.IntegerField(blank=True, help_text='Rides waiting for a driver', null=True)),
+                ('active_rides', models.IntegerField(blank=True, help_text='Rides accepted or under way', null=True)),
+                ('online_drivers', models.IntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'minute metrics',
+                'ordering': ['bucket'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('high_water_mark', models.DateTimeField(help_text='Events up to and including this time are rolled up')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -1,3 +1,52 @@
 from django.db import models
 
-# Create your models here.
+
+class RideMetrics(models.Model):
+    """
+    Ride activity in one time bucket, kept by ``admin_panel.metrics``.
+
+    Counters hold the events whose timestamp falls in the bucket; gauges
+    hold the last sample taken while the bucket was current and stay null
+    for buckets no rollup ran in.
+    """
+    
+    bucket = models.DateTimeField(unique=True, help_text="Start of the minute or hour")
+    
+    rides_requested = models.IntegerField(default=0)
+    rides_started = models.IntegerField(default=0)
+    rides_completed = models.IntegerField(default=0)
+    rides_cancelled = models.IntegerField(default=0)
+    gmv = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Fares of rides completed")
+    
+    open_rides = models.IntegerField(null=True, blank=True, help_text="Rides waiting for a driver")
+    active_rides = models.IntegerField(null=True, blank=True, help_text="Rides accepted or under way")
+    online_drivers = models.IntegerField(null=True, blank=True)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        abstract = True
+        ordering = ['bucket']
+    
+    def __str__(self):
+        return f"{type(self).__name__} {self.bucket:%Y-%m-%d %H:%M}"
+
+
+class MinuteMetrics(RideMetrics):
+    class Meta(RideMetrics.Meta):
+        verbose_name_plural = 'minute metrics'
+
+
+class HourMetrics(RideMetrics):
+    class Meta(RideMetrics.Meta):
+        verbose_name_plural = 'hour metrics'
+
+
+class RollupState(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    high_water_mark = models.DateTimeField(help_text="Events up to and including this time are rolled up")
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} rolled up to {self.high_water_mark}"
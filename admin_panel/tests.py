@@ -1,3 +1,90 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from admin_panel.metrics import COUNTERS, rebuild_metrics, roll_up
+from admin_panel.models import HourMetrics, MinuteMetrics
+from rides.models import Ride
+from rides.tests import create_driver, create_passenger, create_ride
+from users.models import User
+
+
+def totals(model):
+    rows = model.objects.values_list(*COUNTERS)
+    return [sum(row[position] for row in rows) for position in range(len(COUNTERS))]
+
+
+def finish(ride, status, fare=None):
+    moment = timezone.now()
+    field = 'completed_at' if status == 'completed' else 'cancelled_at'
+    Ride.objects.filter(pk=ride.pk).update(status=status, actual_fare=fare, updated_at=moment, **{field: moment})
+
+
+class MetricsRollupTests(APITestCase):
+    def setUp(self):
+        self.passenger = create_passenger()
+        self.driver = create_driver(is_online=True)
+        roll_up(now=timezone.now())  # the first run only sets the high-water mark
+
+    def seed(self):
+        rides = [create_ride(self.passenger) for _ in range(4)]
+        finish(rides[0], 'completed', '12.50')
+        finish(rides[1], 'completed', '7.25')
+        finish(rides[2], 'cancelled')
+        return rides
+
+    def test_events_are_counted_once_into_minutes_and_hours(self):
+        self.seed()
+        later = timezone.now() + timedelta(seconds=10)
+        roll_up(now=later)
+        roll_up(now=later + timedelta(seconds=30))
+
+        expected = [4, 0, 2, 1, Decimal('19.75')]
+        self.assertEqual(totals(MinuteMetrics), expected)
+        self.assertEqual(totals(HourMetrics), expected)
+        current = MinuteMetrics.objects.latest('bucket')
+        self.assertEqual((current.open_rides, current.active_rides, current.online_drivers), (1, 0, 1))
+
+    def test_events_behind_the_lag_wait_for_the_next_run(self):
+        self.seed()
+        roll_up(now=timezone.now())  # everything is younger than LAG_SECONDS
+        self.assertEqual(totals(MinuteMetrics)[0], 0)
+        roll_up(now=timezone.now() + timedelta(seconds=10))
+        self.assertEqual(totals(MinuteMetrics)[0], 4)
+
+    def test_rebuild_recounts_the_same_buckets(self):
+        self.seed()
+        roll_up(now=timezone.now() + timedelta(seconds=10))
+        minutes = sorted(MinuteMetrics.objects.values_list('bucket', *COUNTERS))
+        MinuteMetrics.objects.update(rides_requested=99, gmv=0)
+        HourMetrics.objects.all().delete()
+
+        rebuild_metrics(timezone.now() - timedelta(hours=1))
+        self.assertEqual(sorted(MinuteMetrics.objects.values_list('bucket', *COUNTERS)), minutes)
+        self.assertEqual(totals(HourMetrics), [4, 0, 2, 1, Decimal('19.75')])
+
+    def test_dashboard_reads_only_the_rollups(self):
+        self.seed()
+        roll_up(now=timezone.now() + timedelta(seconds=10))
+        staff = User.objects.create_user(username='ops', password='secret', phone_number='+256ops', is_staff=True)
+        self.client.force_authenticate(staff)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/metrics/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'rides_ride' in query['sql'] or 'driverprofile' in query['sql']])
+        last_hour = response.data['last_hour']
+        self.assertEqual((last_hour['rides_completed'], last_hour['gmv']), (2, Decimal('19.75')))
+        self.assertEqual(last_hour['completion_rate'], round(2 / 3, 4))
+        self.assertEqual(response.data['last_day']['rides_requested'], 4)
+
+        response = self.client.get('/api/metrics/', {'resolution': 'hour'})
+        self.assertEqual(response.data['summary']['rides_cancelled'], 1)
+        self.assertEqual(self.client.get('/api/metrics/', {'resolution': 'day'}).status_code, 400)
+
+        self.client.force_authenticate(self.driver.user)
+        self.assertEqual(self.client.get('/api/metrics/summary/').status_code, 403)
@@ -1,3 +1,51 @@
-from django.shortcuts import render
+from datetime import timedelta
 
-# Create your views here.
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from admin_panel.metrics import RESOLUTIONS, dashboard, hour_of, metrics_series, minute_of, summarize
+from admin_panel.models import MinuteMetrics
+
+# resolution -> (bucket width, buckets returned when no range is given)
+WIDTHS = {'minute': (timedelta(minutes=1), 60), 'hour': (timedelta(hours=1), 24)}
+
+class MetricsViewSet(viewsets.GenericViewSet):
+    """Ops metrics, answered from the rollup buckets only; never from ``Ride`` or ``DriverProfile``."""
+    queryset = MinuteMetrics.objects.all()
+    permission_classes = [IsAdminUser]
+    pagination_class = None
+    
+    def list(self, request):
+        resolution = request.query_params.get('resolution', 'minute')
+        if resolution not in RESOLUTIONS:
+            return Response({'error': f"resolution must be one of {', '.join(RESOLUTIONS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        bounds = {}
+        for param in ('since', 'until'):
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            moment = parse_datetime(value)
+            if moment is None:
+                return Response({'error': f'{param} must be an ISO 8601 datetime'}, status=status.HTTP_400_BAD_REQUEST)
+            bounds[param] = moment if timezone.is_aware(moment) else timezone.make_aware(moment)
+        width, count = WIDTHS[resolution]
+        current = (minute_of if resolution == 'minute' else hour_of)(timezone.now())
+        until = bounds.get('until', current + width)
+        since = bounds.get('since', until - width * count)
+        
+        buckets = metrics_series(resolution, since, until)
+        return Response({
+            'resolution': resolution,
+            'since': since,
+            'until': until,
+            'summary': summarize(buckets),
+            'buckets': buckets,
+        })
+    
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        return Response(dashboard())
@@ -0,0 +1,201 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, Count, DateField, DecimalField, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Trunc
+from django.utils import timezone
+
+from drivers.models import EarningsRollup
+from payments.models import Transaction
+from rides.models import Ride
+from rideshare_backend.upsert import upsert
+from users.models import DriverProfile, PassengerProfile
+
+PERIODS = ('day', 'week', 'month')
+CENT = Decimal('0.01')
+ZERO = Decimal('0')
+
+
+def period_starts(day):
+    """``{period: first day}`` for the day, week (from Monday) and month containing ``day``."""
+    return {'day': day, 'week': day - timedelta(days=day.weekday()), 'month': day.replace(day=1)}
+
+
+def _new_deltas():
+    return defaultdict(lambda: [0, ZERO, ZERO])
+
+
+def _add(deltas, driver_id, moment, rides=0, fares=ZERO, earnings=ZERO):
+    for period, start in period_starts(timezone.localdate(moment)).items():
+        bucket = deltas[(driver_id, period, start)]
+        bucket[0] += rides
+        bucket[1] += fares
+        bucket[2] += earnings
+
+
+def _upsert(deltas):
+    now = timezone.now()
+    upsert(
+        EarningsRollup, ('driver', 'period', 'period_start'),
+        [(*key, rides, fares, earnings, now) for key, (rides, fares, earnings) in deltas.items()],
+        increment=('rides', 'fares', 'earnings'), assign=('updated_at',),
+    )
+
+
+def record_completed_ride(ride):
+    """
+    Count ``ride`` in its driver's rollups and both profiles' ``total_rides``.
+
+    Call once, in the same transaction as the ``complete`` transition;
+    rides are bucketed by the local date they were completed.
+    """
+    fare = Decimal(str(ride.actual_fare if ride.actual_fare is not None else ride.estimated_fare)).quantize(CENT)
+    now = timezone.now()
+    with transaction.atomic():
+        if ride.driver_id:
+            deltas = _new_deltas()
+            _add(deltas, ride.driver_id, ride.completed_at, rides=1, fares=fare)
+            _upsert(deltas)
+            DriverProfile.objects.filter(pk=ride.driver_id).update(total_rides=F('total_rides') + 1, updated_at=now)
+        PassengerProfile.objects.filter(pk=ride.passenger_id).update(total_rides=F('total_rides') + 1, updated_at=now)
+
+
+def record_settled_payments(payments):
+    """
+    Credit settled ride payments to the drivers' rollups and ``total_earnings``.
+
+    ``payments`` are ``Transaction``s that just completed. Earnings land in
+    the buckets of the ride's completion date, not the settlement date, so
+    a retried charge still counts towards the day the ride happened. Costs
+    three queries however many drivers the batch touches.
+    """
+    amounts = defaultdict(Decimal)
+    for payment in payments:
+        if payment.ride_id and payment.transaction_type == 'payment':
+            amounts[payment.ride_id] += payment.amount
+    if not amounts:
+        return
+
+    deltas = _new_deltas()
+    totals = defaultdict(Decimal)
+    rides = Ride.objects.filter(pk__in=amounts, driver__isnull=False, completed_at__isnull=False)
+    for ride_id, driver_id, completed_at in rides.values_list('pk', 'driver_id', 'completed_at'):
+        _add(deltas, driver_id, completed_at, earnings=amounts[ride_id])
+        totals[driver_id] += amounts[ride_id]
+    if not totals:
+        return
+    with transaction.atomic():
+        _upsert(deltas)
+        DriverProfile.objects.filter(pk__in=totals).update(
+            total_earnings=F('total_earnings') + Case(
+                *(When(pk=driver_id, then=Value(amount)) for driver_id, amount in totals.items()),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ),
+            updated_at=timezone.now(),
+        )
+
+
+def _summarize(row, period, start):
+    return {
+        'period': period,
+        'start': start,
+        'rides': row.rides if row else 0,
+        'fares': Decimal(row.fares).quantize(CENT) if row else ZERO.quantize(CENT),
+        'earnings': Decimal(row.earnings).quantize(CENT) if row else ZERO.quantize(CENT),
+    }
+
+
+def earnings_summary(driver_id, today=None):
+    """Today's, this week's and this month's rollups for a driver, read in one indexed query."""
+    starts = period_starts(today or timezone.localdate())
+    rows = {
+        row.period: row
+        for row in EarningsRollup.objects.filter(driver_id=driver_id).filter(
+            reduce(or_, (Q(period=period, period_start=start) for period, start in starts.items()))
+        )
+    }
+    return {period: _summarize(rows.get(period), period, start) for period, start in starts.items()}
+
+
+def earnings_history(driver_id, period, limit=30):
+    """The driver's latest ``limit`` rollups of ``period``, newest first; periods with no rides are absent."""
+    rows = EarningsRollup.objects.filter(driver_id=driver_id, period=period).order_by('-period_start')[:limit]
+    return [_summarize(row, period, row.period_start) for row in rows]
+
+
+def _rebuilt_rollups(driver_ids):
+    rollups = {}
+    for period in PERIODS:
+        completed = Ride.objects.filter(driver_id__in=driver_ids, status='completed', completed_at__isnull=False)
+        rides = (
+            completed.annotate(start=Trunc('completed_at', period, output_field=DateField()))
+            .order_by().values('driver_id', 'start')
+            .annotate(rides=Count('id'), fares=Sum(Coalesce('actual_fare', 'estimated_fare')))
+        )
+        for row in rides:
+            rollups[(row['driver_id'], period, row['start'])] = EarningsRollup(
+                driver_id=row['driver_id'], period=period, period_start=row['start'],
+                rides=row['rides'], fares=Decimal(row['fares']).quantize(CENT),
+            )
+        payments = (
+            Transaction.objects.filter(
+                ride__in=completed, transaction_type='payment', status='completed',
+            )
+            .annotate(start=Trunc('ride__completed_at', period, output_field=DateField()))
+            .order_by().values('ride__driver_id', 'start').annotate(earnings=Sum('amount'))
+        )
+        for row in payments:
+            key = (row['ride__driver_id'], period, row['start'])
+            rollup = rollups.setdefault(key, EarningsRollup(driver_id=key[0], period=period, period_start=key[2]))
+            rollup.earnings = Decimal(row['earnings']).quantize(CENT)
+    return rollups.values()
+
+
+def rebuild_earnings(batch_size=500):
+    """
+    Recompute every rollup and profile ride/earnings total from ``Ride`` and ``Transaction``.
+
+    Drivers are rebuilt ``batch_size`` at a time with their profile rows
+    locked, so increments committed meanwhile wait and land on top of the
+    rebuilt rows instead of being overwritten. Returns the number of
+    rollup rows written.
+    """
+    written = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            driver_ids = list(
+                DriverProfile.objects.select_for_update().filter(pk__gt=last_id)
+                .order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not driver_ids:
+                break
+            last_id = driver_ids[-1]
+            rollups = list(_rebuilt_rollups(driver_ids))
+            EarningsRollup.objects.filter(driver_id__in=driver_ids).delete()
+            EarningsRollup.objects.bulk_create(rollups, batch_size=1000)
+            totals = {driver_id: (0, ZERO) for driver_id in driver_ids}
+            for rollup in rollups:
+                if rollup.period == 'month':
+                    rides, earnings = totals[rollup.driver_id]
+                    totals[rollup.driver_id] = (rides + rollup.rides, earnings + rollup.earnings)
+            now = timezone.now()
+            DriverProfile.objects.bulk_update(
+                [
+                    DriverProfile(pk=driver_id, total_rides=rides, total_earnings=earnings, updated_at=now)
+                    for driver_id, (rides, earnings) in totals.items()
+                ],
+                ['total_rides', 'total_earnings', 'updated_at'],
+            )
+            written += len(rollups)
+
+    completed = (
+        Ride.objects.filter(passenger_id=OuterRef('pk'), status='completed')
+        .order_by().values('passenger_id').annotate(count=Count('id')).values('count')
+    )
+    PassengerProfile.objects.update(total_rides=Coalesce(Subquery(completed), 0), updated_at=timezone.now())
+    return written
@@ -0,0 +1,85 @@
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from drivers.spatial import DriverSpatialIndex, haversine_km
+
+VEHICLE_TYPES = ['economy', 'comfort', 'premium']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark nearest-driver lookups on the spatial index against a naive full scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=50000)
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--radius-km', type=float, default=5.0)
+        parser.add_argument('--span-km', type=float, default=40.0, help='Side of the square city area')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        center_lat, center_lng = 0.3476, 32.5825
+        span_deg = options['span_km'] / 111.0
+
+        def random_point():
+            return (
+                center_lat + rng.uniform(-span_deg / 2, span_deg / 2),
+                center_lng + rng.uniform(-span_deg / 2, span_deg / 2),
+            )
+
+        index = DriverSpatialIndex()
+        # What a scan over DriverProfile(is_online=True) has to chew through:
+        # one JSON document per row, parsed and measured in Python.
+        rows = []
+        started = time.perf_counter()
+        for driver_id in range(1, options['drivers'] + 1):
+            lat, lng = random_point()
+            vehicle_type = rng.choice(VEHICLE_TYPES)
+            index.update(driver_id, lat, lng, vehicle_type)
+            rows.append((driver_id, json.dumps({'lat': lat, 'lng': lng}), vehicle_type))
+        build_seconds = time.perf_counter() - started
+
+        k, radius_km = options['k'], options['radius_km']
+        queries = [random_point() for _ in range(options['queries'])]
+
+        def naive(lat, lng):
+            hits = []
+            for driver_id, location, _ in rows:
+                position = json.loads(location)
+                distance = haversine_km(lat, lng, position['lat'], position['lng'])
+                if distance <= radius_km:
+                    hits.append((distance, driver_id))
+            hits.sort()
+            return [(driver_id, distance) for distance, driver_id in hits[:k]]
+
+        indexed_timings = []
+        for lat, lng in queries:
+            started = time.perf_counter()
+            index.nearest_drivers(lat, lng, k=k, radius_km=radius_km)
+            indexed_timings.append(time.perf_counter() - started)
+
+        naive_timings = []
+        for lat, lng in queries[:max(1, len(queries) // 100)]:
+            started = time.perf_counter()
+            expected = naive(lat, lng)
+            naive_timings.append(time.perf_counter() - started)
+            got = index.nearest_drivers(lat, lng, k=k, radius_km=radius_km)
+            if [driver_id for driver_id, _ in got] != [driver_id for driver_id, _ in expected]:
+                self.stderr.write(self.style.ERROR(f'Mismatch at ({lat}, {lng})'))
+
+        self.stdout.write(f"{options['drivers']} drivers indexed in {build_seconds * 1000:.1f} ms")
+        self._report('spatial index', indexed_timings)
+        self._report('naive scan', naive_timings)
+        speedup = statistics.median(naive_timings) / statistics.median(indexed_timings)
+        self.stdout.write(self.style.SUCCESS(f'Median speedup: {speedup:.0f}x'))
+
+    def _report(self, label, timings):
+        timings = sorted(timings)
+        p50 = timings[len(timings) // 2] * 1000
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000
+        self.stdout.write(f'{label:>14}: n={len(timings)} p50={p50:.3f} ms p99={p99:.3f} ms')
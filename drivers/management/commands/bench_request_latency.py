@@ -0,0 +1,106 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.test import Client
+from rest_framework_simplejwt.tokens import AccessToken
+
+from rides.models import Ride
+from users.models import DriverProfile, PassengerProfile, User
+
+PATHS = ('/api/drivers/go_online/', '/api/locations/update_location/')
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure p50/p99 latency of go_online and update_location under each DB_POOL mode. '
+        'Each mode runs in its own process against the configured database and creates '
+        'a bench_latency driver, passenger and ride if they are missing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default='off,persistent',
+                            help='Comma-separated DB_POOL modes to compare (off, persistent, psycopg, pgbouncer)')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--worker', action='store_true', help='Run one measurement in this process and print JSON')
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            self.stdout.write(json.dumps(self.measure(options['requests'], options['warmup'])))
+            return
+
+        results = {}
+        for mode in options['modes'].split(','):
+            completed = subprocess.run(
+                [sys.executable, '-m', 'django', 'bench_request_latency', '--worker',
+                 '--requests', str(options['requests']), '--warmup', str(options['warmup'])],
+                cwd=settings.BASE_DIR,
+                env={**os.environ, 'DB_POOL': mode},
+                capture_output=True,
+                text=True,
+            )
+            if completed.returncode:
+                raise CommandError(f'DB_POOL={mode} failed:\n{completed.stderr}')
+            results[mode] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+        for path in PATHS:
+            self.stdout.write(path)
+            for mode, timings in results.items():
+                p50, p99 = timings[path]
+                self.stdout.write(f'  {mode:<10} p50 {p50:7.2f} ms   p99 {p99:7.2f} ms')
+
+    def fixtures(self):
+        user, _ = User.objects.get_or_create(
+            username='bench_latency_driver',
+            defaults={'user_type': 'driver', 'phone_number': '+000bench_latency_driver'},
+        )
+        driver, _ = DriverProfile.objects.get_or_create(
+            user=user,
+            defaults={'license_number': 'BENCH-LATENCY', 'license_expiry': '2099-01-01',
+                      'current_location': {'lat': 0.3476, 'lng': 32.5825}},
+        )
+        rider, _ = User.objects.get_or_create(
+            username='bench_latency_passenger',
+            defaults={'user_type': 'passenger', 'phone_number': '+000bench_latency_passenger'},
+        )
+        passenger, _ = PassengerProfile.objects.get_or_create(user=rider)
+        ride = Ride.objects.filter(driver=driver, status='started').first() or Ride.objects.create(
+            passenger=passenger, driver=driver, status='started',
+            pickup_location={'lat': 0.3476, 'lng': 32.5825}, dropoff_location={'lat': 0.3136, 'lng': 32.5811},
+            estimated_distance=4.2, estimated_duration=15, estimated_fare='12.00',
+        )
+        return user, ride
+
+    def measure(self, requests, warmup):
+        user, ride = self.fixtures()
+        client = Client(headers={'Authorization': f'Bearer {AccessToken.for_user(user)}'})
+        payloads = {
+            PATHS[0]: {},
+            PATHS[1]: {'ride_id': ride.id, 'latitude': 0.3476, 'longitude': 32.5825},
+        }
+        connections.close_all()
+
+        results = {}
+        for path, payload in payloads.items():
+            timings = []
+            for i in range(warmup + requests):
+                started = time.perf_counter()
+                response = client.post(path, payload, content_type='application/json')
+                # The test client unhooks this from request_finished; calling it
+                # here gives each request the connection lifecycle it has in
+                # production for the active DB_POOL mode.
+                close_old_connections()
+                elapsed = time.perf_counter() - started
+                if response.status_code >= 400:
+                    raise CommandError(f'{path} returned {response.status_code}: {response.content[:200]}')
+                if i >= warmup:
+                    timings.append(elapsed * 1000)
+            results[path] = [float(np.percentile(timings, 50)), float(np.percentile(timings, 99))]
+        return results
@@ -0,0 +1,84 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from rides.models import Ride, RideLocation
+from users.models import DriverProfile, PassengerProfile, User, Vehicle
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare repeat fetches of the profile and finished-ride endpoints with the response cache '
+        'off, served from the payload cache, and revalidated to a 304. Creates bench_response '
+        'fixtures in the configured database if they are missing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300)
+        parser.add_argument('--vehicles', type=int, default=3)
+        parser.add_argument('--pings', type=int, default=500, help='GPS points embedded in the finished ride')
+
+    def fixtures(self, vehicles, pings):
+        user, _ = User.objects.get_or_create(
+            username='bench_response_driver',
+            defaults={'user_type': 'driver', 'phone_number': '+000bench_response_driver'},
+        )
+        driver, _ = DriverProfile.objects.get_or_create(
+            user=user, defaults={'license_number': 'BENCH-RESPONSE', 'license_expiry': '2099-01-01'},
+        )
+        for i in range(driver.vehicles.count(), vehicles):
+            Vehicle.objects.create(
+                driver=driver, make='Toyota', model='Premio', year=2015, license_plate=f'BENCH {i}', color='white',
+                vehicle_type='economy', registration_number=f'BENCH-REG-{i}', insurance_expiry='2099-01-01',
+            )
+        rider, _ = User.objects.get_or_create(
+            username='bench_response_passenger',
+            defaults={'user_type': 'passenger', 'phone_number': '+000bench_response_passenger'},
+        )
+        passenger, _ = PassengerProfile.objects.get_or_create(user=rider)
+        ride = Ride.objects.filter(driver=driver, status='completed').first()
+        if ride is None:
+            ride = Ride.objects.create(
+                passenger=passenger, driver=driver, status='completed', completed_at=timezone.now(),
+                pickup_location={'lat': 0.3476, 'lng': 32.5825}, dropoff_location={'lat': 0.3136, 'lng': 32.5811},
+                estimated_distance=4.2, estimated_duration=15, estimated_fare='12000.00',
+            )
+            RideLocation.objects.bulk_create(
+                RideLocation(ride=ride, latitude=0.3476 - i * 0.00007, longitude=32.5825) for i in range(pings)
+            )
+        return user, driver, ride
+
+    def run(self, client, path, requests, **headers):
+        timings, queries = [], 0
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(path, headers=headers)
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code not in (200, 304):
+                raise CommandError(f'{path} returned {response.status_code}: {response.content[:200]}')
+            queries += len(captured)
+        return float(np.percentile(timings, 50)), float(np.percentile(timings, 99)), queries / requests
+
+    def handle(self, *args, **options):
+        user, driver, ride = self.fixtures(options['vehicles'], options['pings'])
+        client = Client(headers={'Authorization': f'Bearer {AccessToken.for_user(user)}'})
+        requests = options['requests']
+        paths = ('/api/users/profile/', f'/api/drivers/{driver.pk}/', '/api/drivers/', f'/api/rides/{ride.pk}/')
+
+        for path in paths:
+            with override_settings(RESPONSE_CACHE={'ENABLED': False}):
+                client.get(path)
+                off = self.run(client, path, requests)
+            etag = client.get(path)['ETag']
+            cached = self.run(client, path, requests)
+            revalidated = self.run(client, path, requests, if_none_match=etag)
+            self.stdout.write(path)
+            for label, (p50, p99, queries) in (('off', off), ('cached', cached), ('304', revalidated)):
+                self.stdout.write(f'  {label:<7} p50 {p50:7.2f} ms   p99 {p99:7.2f} ms   {queries:.1f} queries')
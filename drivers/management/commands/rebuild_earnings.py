@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from drivers.earnings import rebuild_earnings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild driver earnings rollups and profile ride/earnings totals from rides and settled payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Drivers rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        written = rebuild_earnings(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} earnings rollups'))
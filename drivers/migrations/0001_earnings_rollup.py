@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('users', '0002_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EarningsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week'), ('month', 'Month')], max_length=5)),
+                ('period_start', models.DateField(help_text='First local day of the period; weeks start on Monday')),
+                ('rides', models.IntegerField(default=0)),
+                ('fares', models.DecimalField(decimal_places=2, default=0, help_text='Fares of completed rides', max_digits=12)),
+                ('earnings', models.DecimalField(decimal_places=2, default=0, help_text='Settled ride payments', max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='earnings_rollups', to='users.driverprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('driver', 'period', 'period_start'), name='earnings_rollup_bucket')],
+            },
+        ),
+    ]
@@ -1,3 +1,28 @@
 from django.db import models
 
-# Create your models here.
+from users.models import DriverProfile
+
+
+class EarningsRollup(models.Model):
+    PERIOD_CHOICES = (
+        ('day', 'Day'),
+        ('week', 'Week'),
+        ('month', 'Month'),
+    )
+    
+    driver = models.ForeignKey(DriverProfile, on_delete=models.CASCADE, related_name='earnings_rollups')
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField(help_text="First local day of the period; weeks start on Monday")
+    rides = models.IntegerField(default=0)
+    fares = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Fares of completed rides")
+    earnings = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Settled ride payments")
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['driver', 'period', 'period_start'], name='earnings_rollup_bucket'),
+        ]
+    
+    def __str__(self):
+        return f"Driver {self.driver_id} {self.period} of {self.period_start}: {self.earnings}"
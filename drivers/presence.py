@@ -0,0 +1,313 @@
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from drivers.spatial import driver_index, location_coords
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'HEARTBEAT_TTL': 90.0,
+    'FLUSH_INTERVAL': 5.0,
+    'WRITE_BATCH_SIZE': 500,
+}
+
+
+def presence_settings():
+    return {**DEFAULTS, **getattr(settings, 'DRIVER_PRESENCE', {})}
+
+
+def seen_key(driver_id):
+    return f'presence:seen:{driver_id}'
+
+
+class PresenceEntry:
+    __slots__ = ('last_seen', 'location', 'vehicle_type', 'busy')
+
+    def __init__(self, last_seen, location=None, vehicle_type=None, busy=False):
+        self.last_seen = last_seen
+        self.location = location
+        self.vehicle_type = vehicle_type
+        self.busy = busy
+
+
+class DriverPresence:
+    """
+    In-memory liveness and last position of online drivers.
+
+    Drivers stay online while heartbeats (location updates) keep arriving;
+    one silent for ``HEARTBEAT_TTL`` seconds is expired. Entries are kept in
+    last-seen order, so a sweep only looks at the drivers it expires.
+
+    Presence owns the dispatch ``index``: a driver is in it while online,
+    not on a trip and with a known position. ``DriverProfile.is_online`` and
+    ``current_location`` are written back in batches by ``flush``, touching
+    only those two columns.
+
+    State is per process. So that a process a driver's heartbeats do not
+    reach does not expire them (and write ``is_online=False``), every
+    heartbeat, including those for drivers online in another process, is
+    also stamped in ``CACHES`` at most every third of the TTL and checked
+    before expiring; with several processes that cache must be shared.
+    """
+
+    def __init__(self, index=driver_index, options=None, clock=time.time, autostart=True):
+        self.index = index
+        self.options = {**presence_settings(), **(options or {})}
+        self.clock = clock
+        self.autostart = autostart
+        self._online = OrderedDict()
+        self._lock = threading.RLock()
+        self._pending_online = {}
+        self._pending_locations = {}
+        self._shared_at = OrderedDict()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._online)
+
+    def _place(self, driver_id, entry):
+        coords = location_coords(entry.location)
+        if entry.busy or coords is None:
+            self.index.remove(driver_id)
+        else:
+            self.index.update(driver_id, coords[0], coords[1], entry.vehicle_type)
+
+    def go_online(self, driver_id, location=None, vehicle_type=None):
+        if self.autostart:
+            self.start()
+        with self._lock:
+            entry = self._online.get(driver_id)
+            if entry is None:
+                entry = self._online[driver_id] = PresenceEntry(self.clock())
+                self._pending_online[driver_id] = True
+            else:
+                entry.last_seen = self.clock()
+                self._online.move_to_end(driver_id)
+            if location is not None:
+                entry.location = location
+                self._pending_locations[driver_id] = location
+            if vehicle_type is not None:
+                entry.vehicle_type = vehicle_type
+            self._place(driver_id, entry)
+        self._share(driver_id, entry.last_seen)
+
+    def go_offline(self, driver_id):
+        if self.autostart:
+            self.start()
+        with self._lock:
+            if self._online.pop(driver_id, None) is not None:
+                self._pending_online[driver_id] = False
+            self.index.remove(driver_id)
+            self._shared_at.pop(driver_id, None)
+        cache.delete(seen_key(driver_id))
+
+    def _share(self, driver_id, now):
+        # Throttled so the shared cache sees a fraction of the heartbeats;
+        # stamps older than the TTL are dropped from the front as they age.
+        ttl = self.options['HEARTBEAT_TTL']
+        with self._lock:
+            while self._shared_at:
+                oldest = next(iter(self._shared_at.values()))
+                if oldest > now - ttl:
+                    break
+                self._shared_at.popitem(last=False)
+            shared_at = self._shared_at.get(driver_id)
+            if shared_at is not None and now - shared_at < ttl / 3:
+                return
+            self._shared_at.pop(driver_id, None)
+            self._shared_at[driver_id] = now
+        cache.set(seen_key(driver_id), now, ttl)
+
+    def heartbeat(self, driver_id, location=None):
+        """Record that ``driver_id`` is alive; returns whether they are online here."""
+        if self.autostart:
+            self.start()
+        now = self.clock()
+        # Stamped even when the driver went online in another process,
+        # which would otherwise expire them.
+        self._share(driver_id, now)
+        with self._lock:
+            entry = self._online.get(driver_id)
+            if entry is None:
+                return False
+            entry.last_seen = now
+            self._online.move_to_end(driver_id)
+            if location is not None:
+                entry.location = location
+                self._pending_locations[driver_id] = location
+                if not entry.busy:
+                    self._place(driver_id, entry)
+        return True
+
+    def set_busy(self, driver_id, busy, location=None):
+        """Take a driver out of the dispatch pool for a trip, or put them back after it."""
+        with self._lock:
+            entry = self._online.get(driver_id)
+            if entry is None:
+                self.index.remove(driver_id)
+                return False
+            entry.busy = busy
+            if location is not None:
+                entry.location = location
+                self._pending_locations[driver_id] = location
+            self._place(driver_id, entry)
+            return True
+
+    def is_online(self, driver_id):
+        return driver_id in self._online
+
+    def location(self, driver_id):
+        entry = self._online.get(driver_id)
+        return None if entry is None else entry.location
+
+    def knows(self, driver_id):
+        entry = self._online.get(driver_id)
+        return entry is not None and entry.vehicle_type is not None and entry.location is not None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                driver_id: {
+                    'location': entry.location,
+                    'vehicle_type': entry.vehicle_type,
+                    'busy': entry.busy,
+                    'last_seen': entry.last_seen,
+                }
+                for driver_id, entry in self._online.items()
+            }
+
+    def expire(self):
+        """Take drivers whose last heartbeat is older than ``HEARTBEAT_TTL`` offline."""
+        cutoff = self.clock() - self.options['HEARTBEAT_TTL']
+        with self._lock:
+            silent = []
+            for driver_id, entry in self._online.items():
+                if entry.last_seen > cutoff:
+                    break
+                silent.append(driver_id)
+        if not silent:
+            return []
+        # Heartbeats another process received keep the driver online here too.
+        stamps = cache.get_many([seen_key(driver_id) for driver_id in silent])
+        expired = []
+        with self._lock:
+            for driver_id in silent:
+                entry = self._online.get(driver_id)
+                if entry is None or entry.last_seen > cutoff:
+                    continue
+                stamp = stamps.get(seen_key(driver_id))
+                if stamp is not None and stamp > cutoff:
+                    entry.last_seen = stamp
+                    self._online.move_to_end(driver_id)
+                    continue
+                expired.append(driver_id)
+                self.go_offline(driver_id)
+        return expired
+
+    def flush(self):
+        """Write pending online flags and positions back to ``DriverProfile``."""
+        from users.models import DriverProfile
+
+        with self._lock:
+            flags, self._pending_online = self._pending_online, {}
+            locations, self._pending_locations = self._pending_locations, {}
+        now = timezone.now()
+        try:
+            for value in (True, False):
+                ids = [driver_id for driver_id, online in flags.items() if online is value]
+                if ids:
+                    DriverProfile.objects.filter(pk__in=ids).update(is_online=value, updated_at=now)
+            if locations:
+                DriverProfile.objects.bulk_update(
+                    [
+                        DriverProfile(pk=driver_id, current_location=location, updated_at=now)
+                        for driver_id, location in locations.items()
+                    ],
+                    ['current_location', 'updated_at'],
+                    batch_size=self.options['WRITE_BATCH_SIZE'],
+                )
+        except Exception:
+            # Put the batch back for the next flush, behind anything newer.
+            with self._lock:
+                self._pending_online = {**flags, **self._pending_online}
+                self._pending_locations = {**locations, **self._pending_locations}
+            raise
+        return len(flags), len(locations)
+
+    def reset(self):
+        with self._lock:
+            for driver_id in list(self._online):
+                self.index.remove(driver_id)
+            self._online.clear()
+            self._pending_online.clear()
+            self._pending_locations.clear()
+            self._shared_at.clear()
+
+    def rebuild_from_db(self):
+        """Load drivers flagged online at startup; they get one TTL to send a heartbeat."""
+        from rides.models import Ride
+        from users.models import DriverProfile, Vehicle
+
+        vehicle_types = dict(
+            Vehicle.objects.filter(is_active=True, driver__is_online=True).values_list('driver_id', 'vehicle_type')
+        )
+        busy = set(
+            Ride.objects.filter(status__in=('accepted', 'started'), driver__is_online=True)
+            .order_by().values_list('driver_id', flat=True)
+        )
+        with self._lock:
+            self.reset()
+            for driver_id, location in DriverProfile.objects.filter(is_online=True).values_list('id', 'current_location'):
+                entry = self._online[driver_id] = PresenceEntry(
+                    self.clock(), location or None, vehicle_types.get(driver_id), driver_id in busy,
+                )
+                self._place(driver_id, entry)
+        return len(self)
+
+    def run_forever(self):
+        interval = self.options['FLUSH_INTERVAL']
+        while not self._stop.wait(interval):
+            try:
+                expired = self.expire()
+                if expired:
+                    logger.info('Expired %d silent drivers', len(expired))
+                self.flush()
+            except Exception:
+                logger.exception('Driver presence sweep failed')
+            finally:
+                close_old_connections()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self.run_forever, name='driver-presence', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+driver_presence = DriverPresence()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        driver_presence.stop()
+    except Exception:
+        logger.exception('Could not flush driver presence on exit')
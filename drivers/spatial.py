@@ -0,0 +1,200 @@
+import heapq
+import math
+import threading
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class DriverSpatialIndex:
+    """
+    Grid index of available drivers keyed by fixed-size lat/lng cells.
+
+    A nearest-driver query walks rings of cells outwards from the pickup
+    cell and stops as soon as no unvisited ring can hold a closer driver,
+    so the cost depends on local density rather than fleet size.
+
+    Listeners registered with ``add_listener`` get ``driver_moved(id, lat,
+    lng)`` and ``driver_removed(id)`` calls after each change, which lets
+    other in-memory views of supply follow the index without polling.
+    """
+
+    def __init__(self, cell_size_deg=0.005):
+        self.cell_size_deg = cell_size_deg
+        self._cells = {}
+        self._drivers = {}
+        self._lock = threading.RLock()
+        self._listeners = []
+
+    def __len__(self):
+        return len(self._drivers)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._drivers
+
+    def add_listener(self, listener):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def cell_for(self, lat, lng):
+        size = self.cell_size_deg
+        return (math.floor(lat / size), math.floor(lng / size))
+
+    def update(self, driver_id, lat, lng, vehicle_type=None):
+        lat, lng = float(lat), float(lng)
+        cell = self.cell_for(lat, lng)
+        with self._lock:
+            previous = self._drivers.get(driver_id)
+            if previous is not None:
+                if vehicle_type is None:
+                    vehicle_type = previous[2]
+                if previous[3] != cell:
+                    self._discard_from_cell(driver_id, previous[3])
+            if previous is None or previous[3] != cell:
+                self._cells.setdefault(cell, set()).add(driver_id)
+            self._drivers[driver_id] = (lat, lng, vehicle_type, cell)
+        for listener in self._listeners:
+            listener.driver_moved(driver_id, lat, lng)
+
+    def remove(self, driver_id):
+        with self._lock:
+            previous = self._drivers.pop(driver_id, None)
+            if previous is not None:
+                self._discard_from_cell(driver_id, previous[3])
+        if previous is not None:
+            for listener in self._listeners:
+                listener.driver_removed(driver_id)
+        return previous is not None
+
+    def clear(self):
+        with self._lock:
+            removed = list(self._drivers)
+            self._cells.clear()
+            self._drivers.clear()
+        for listener in self._listeners:
+            for driver_id in removed:
+                listener.driver_removed(driver_id)
+
+    def position(self, driver_id):
+        entry = self._drivers.get(driver_id)
+        if entry is None:
+            return None
+        return entry[0], entry[1]
+
+    def drivers(self):
+        with self._lock:
+            return {driver_id: entry[:3] for driver_id, entry in self._drivers.items()}
+
+    def _discard_from_cell(self, driver_id, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(driver_id)
+            if not members:
+                del self._cells[cell]
+
+    def _ring(self, center, radius):
+        row, col = center
+        if radius == 0:
+            yield center
+            return
+        for dc in range(-radius, radius + 1):
+            yield (row - radius, col + dc)
+            yield (row + radius, col + dc)
+        for dr in range(-radius + 1, radius):
+            yield (row + dr, col - radius)
+            yield (row + dr, col + radius)
+
+    def nearest_drivers(self, lat, lng, k=10, radius_km=5.0, vehicle_type=None):
+        """Return up to ``k`` ``(driver_id, distance_km)`` pairs, closest first."""
+        lat, lng = float(lat), float(lng)
+        center = self.cell_for(lat, lng)
+        size = self.cell_size_deg
+        # Candidates are ranked on an equirectangular projection in degrees
+        # (exact enough at city scale and far cheaper than haversine); only
+        # the winners get a great-circle distance.
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        radius_deg = radius_km / KM_PER_DEGREE
+        radius_sq = radius_deg * radius_deg
+        # Width of one ring in projected degrees, using the narrower
+        # longitude side so the early exit never skips a closer driver.
+        ring_deg = size * min(1.0, cos_lat)
+        max_ring = int(math.ceil(radius_deg / ring_deg)) + 1
+
+        best = []
+        with self._lock:
+            cells = self._cells
+            drivers = self._drivers
+            for ring in range(max_ring + 1):
+                # Anything in this ring or beyond is at least (ring - 1)
+                # ring widths away from the query point.
+                if len(best) == k:
+                    bound = (ring - 1) * ring_deg
+                    if bound > 0 and -best[0][0] <= bound * bound:
+                        break
+                for cell in self._ring(center, ring):
+                    members = cells.get(cell)
+                    if not members:
+                        continue
+                    for driver_id in members:
+                        d_lat, d_lng, d_type, _ = drivers[driver_id]
+                        if vehicle_type is not None and d_type != vehicle_type:
+                            continue
+                        dy = d_lat - lat
+                        dx = (d_lng - lng) * cos_lat
+                        distance_sq = dx * dx + dy * dy
+                        if distance_sq > radius_sq:
+                            continue
+                        if len(best) < k:
+                            heapq.heappush(best, (-distance_sq, driver_id))
+                        elif distance_sq < -best[0][0]:
+                            heapq.heapreplace(best, (-distance_sq, driver_id))
+            winners = [(driver_id, drivers[driver_id]) for _, driver_id in sorted(best, reverse=True)]
+        return [
+            (driver_id, haversine_km(lat, lng, entry[0], entry[1]))
+            for driver_id, entry in winners
+        ]
+
+    def rebuild_from_db(self):
+        from users.models import DriverProfile, Vehicle
+
+        vehicle_types = dict(
+            Vehicle.objects.filter(is_active=True, driver__is_online=True)
+            .values_list('driver_id', 'vehicle_type')
+        )
+        rows = DriverProfile.objects.filter(is_online=True).values_list('id', 'current_location')
+        with self._lock:
+            self.clear()
+            for driver_id, location in rows:
+                coords = location_coords(location)
+                if coords is not None:
+                    self.update(driver_id, coords[0], coords[1], vehicle_types.get(driver_id))
+        return len(self)
+
+
+def location_coords(location):
+    if not location:
+        return None
+    try:
+        return float(location['lat']), float(location['lng'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+driver_index = DriverSpatialIndex()
+
+
+def nearest_drivers(lat, lng, k=10, radius_km=5.0, vehicle_type=None):
+    return driver_index.nearest_drivers(lat, lng, k=k, radius_km=radius_km, vehicle_type=vehicle_type)
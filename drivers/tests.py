@@ -1,3 +1,276 @@
-from django.test import TestCase
+import datetime
+import random
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from drivers.earnings import earnings_summary, rebuild_earnings, record_completed_ride, record_settled_payments
+from drivers.models import EarningsRollup
+from drivers.presence import DriverPresence, driver_presence
+from drivers.spatial import DriverSpatialIndex, driver_index, haversine_km
+from payments.models import PaymentMethod, Transaction
+from payments.processors import FakeProcessor
+from payments.settlement import SettlementWorker, settlement_worker
+from users.models import DriverProfile, PassengerProfile, User
+
+
+class DriverSpatialIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = DriverSpatialIndex()
+
+    def test_nearest_matches_brute_force(self):
+        rng = random.Random(7)
+        positions = {}
+        for driver_id in range(500):
+            lat, lng = 0.30 + rng.random() * 0.1, 32.55 + rng.random() * 0.1
+            positions[driver_id] = (lat, lng)
+            self.index.update(driver_id, lat, lng, 'economy')
+
+        for _ in range(20):
+            lat, lng = 0.30 + rng.random() * 0.1, 32.55 + rng.random() * 0.1
+            expected = sorted(
+                (haversine_km(lat, lng, *position), driver_id)
+                for driver_id, position in positions.items()
+            )
+            expected = [driver_id for distance, driver_id in expected if distance <= 3][:5]
+            got = [driver_id for driver_id, _ in self.index.nearest_drivers(lat, lng, k=5, radius_km=3)]
+            self.assertEqual(got, expected)
+
+    def test_radius_and_vehicle_type_filters(self):
+        self.index.update(1, 0.3476, 32.5825, 'economy')
+        self.index.update(2, 0.3480, 32.5830, 'premium')
+        self.index.update(3, 0.5000, 32.5825, 'economy')
+
+        self.assertEqual([d for d, _ in self.index.nearest_drivers(0.3476, 32.5825, k=5, radius_km=1)], [1, 2])
+        self.assertEqual([d for d, _ in self.index.nearest_drivers(0.3476, 32.5825, vehicle_type='premium')], [2])
+
+    def test_move_and_remove(self):
+        self.index.update(1, 0.3476, 32.5825, 'comfort')
+        self.index.update(1, 0.4476, 32.5825)
+        self.assertEqual(self.index.nearest_drivers(0.3476, 32.5825, radius_km=1), [])
+        self.assertEqual([d for d, _ in self.index.nearest_drivers(0.4476, 32.5825, vehicle_type='comfort')], [1])
+
+        self.assertTrue(self.index.remove(1))
+        self.assertFalse(self.index.remove(1))
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.nearest_drivers(0.4476, 32.5825), [])
+
+
+def create_driver(username, **fields):
+    user = User.objects.create_user(
+        username=username, password='secret', user_type='driver', phone_number=f'+256{username}',
+    )
+    return DriverProfile.objects.create(
+        user=user, license_number=f'LIC-{username}', license_expiry=datetime.date(2030, 1, 1), **fields
+    )
+
+
+class DriverPresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1000.0
+        self.index = DriverSpatialIndex()
+        self.presence = DriverPresence(
+            self.index, {'HEARTBEAT_TTL': 60}, clock=lambda: self.now, autostart=False,
+        )
+
+    def test_silent_drivers_expire(self):
+        self.presence.go_online(1, {'lat': 0.30, 'lng': 32.50}, 'economy')
+        self.presence.go_online(2, {'lat': 0.31, 'lng': 32.51}, 'economy')
+        self.now += 45
+        self.assertTrue(self.presence.heartbeat(2, {'lat': 0.32, 'lng': 32.52}))
+        self.now += 30
+
+        self.assertEqual(self.presence.expire(), [1])
+        self.assertFalse(self.presence.is_online(1))
+        self.assertNotIn(1, self.index)
+        self.assertEqual(self.index.position(2), (0.32, 32.52))
+        self.assertFalse(self.presence.heartbeat(1))
+
+    def test_heartbeats_received_by_another_process_keep_the_driver_online(self):
+        other = DriverPresence(DriverSpatialIndex(), {'HEARTBEAT_TTL': 60}, clock=lambda: self.now, autostart=False)
+        self.presence.go_online(1, {'lat': 0.30, 'lng': 32.50}, 'economy')
+        other.go_online(1, {'lat': 0.30, 'lng': 32.50}, 'economy')
+        self.now += 45
+        other.heartbeat(1, {'lat': 0.32, 'lng': 32.52})
+        self.now += 30
+
+        self.assertEqual(self.presence.expire(), [])
+        self.assertTrue(self.presence.is_online(1))
+        self.now += 60
+        self.assertEqual(self.presence.expire(), [1])
+
+    def test_heartbeats_to_a_process_the_driver_is_not_online_in_keep_them_online(self):
+        other = DriverPresence(DriverSpatialIndex(), {'HEARTBEAT_TTL': 60}, clock=lambda: self.now, autostart=False)
+        self.presence.go_online(1, {'lat': 0.30, 'lng': 32.50}, 'economy')
+        for _ in range(4):
+            self.now += 30
+            self.assertFalse(other.heartbeat(1, {'lat': 0.32, 'lng': 32.52}))
+            self.assertEqual(self.presence.expire(), [])
+        self.assertTrue(self.presence.is_online(1))
+        self.assertEqual(other.flush(), (0, 0))  # nothing to write for a driver offline here
+
+        self.now += 61
+        self.assertEqual(self.presence.expire(), [1])
+
+    def test_busy_drivers_leave_the_pool_but_stay_online(self):
+        self.presence.go_online(1, {'lat': 0.30, 'lng': 32.50}, 'economy')
+        self.presence.set_busy(1, True)
+        self.presence.heartbeat(1, {'lat': 0.35, 'lng': 32.55})
+        self.assertNotIn(1, self.index)
+        self.assertTrue(self.presence.is_online(1))
+
+        self.presence.set_busy(1, False)
+        self.assertEqual(self.index.position(1), (0.35, 32.55))
+
+    def test_flush_writes_only_presence_columns_in_batches(self):
+        drivers = [create_driver(f'driver{i}', total_earnings=100) for i in range(3)]
+        for i, driver in enumerate(drivers):
+            self.presence.go_online(driver.pk, {'lat': 0.3 + i / 100, 'lng': 32.5}, 'economy')
+        self.presence.go_offline(drivers[2].pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.presence.flush(), (3, 3))
+        self.assertEqual(len(queries), 3)  # online, offline, positions
+        self.assertFalse(any('total_earnings' in query['sql'] for query in queries))
+
+        rows = dict(DriverProfile.objects.values_list('pk', 'is_online'))
+        self.assertEqual(rows, {drivers[0].pk: True, drivers[1].pk: True, drivers[2].pk: False})
+        self.assertEqual(DriverProfile.objects.get(pk=drivers[1].pk).current_location, {'lat': 0.31, 'lng': 32.5})
+        self.assertEqual(self.presence.flush(), (0, 0))
+
+
+@mock.patch.object(driver_presence, 'autostart', False)
+class DriverPresenceApiTests(APITestCase):
+    def setUp(self):
+        driver_presence.reset()
+        self.addCleanup(driver_presence.reset)
+        self.driver = create_driver('presence', current_location={'lat': 0.30, 'lng': 32.50})
+        self.client.force_authenticate(self.driver.user)
+
+    def test_online_heartbeat_offline(self):
+        self.client.post('/api/drivers/go_online/')
+        self.assertEqual(driver_index.position(self.driver.pk), (0.30, 32.50))
+
+        response = self.client.post('/api/drivers/update_location/', {'lat': 0.31, 'lng': 32.51}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(driver_index.position(self.driver.pk), (0.31, 32.51))
+        self.assertTrue(self.client.post('/api/drivers/heartbeat/').data['is_online'])
+        self.assertTrue(self.client.get(f'/api/drivers/{self.driver.pk}/').data['is_online'])
+
+        self.client.post('/api/drivers/go_offline/')
+        self.assertNotIn(self.driver.pk, driver_index)
+        driver_presence.flush()
+        self.driver.refresh_from_db()
+        self.assertFalse(self.driver.is_online)
+        self.assertEqual(self.driver.current_location, {'lat': 0.31, 'lng': 32.51})
+
+    def test_online_listing_is_for_staff(self):
+        self.client.post('/api/drivers/go_online/')
+        self.assertEqual(self.client.get('/api/drivers/online/').status_code, 403)
+
+        self.driver.user.is_staff = True
+        self.driver.user.save()
+        response = self.client.get('/api/drivers/online/')
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['drivers'][0]['id'], self.driver.pk)
+
+
+def rollups():
+    return sorted(
+        EarningsRollup.objects.values_list('driver_id', 'period', 'period_start', 'rides', 'fares', 'earnings')
+    )
+
+
+class EarningsRollupTests(APITestCase):
+    def setUp(self):
+        from rides.tests import create_driver, create_passenger
+        self.driver = create_driver()
+        self.passenger = create_passenger()
+        PaymentMethod.objects.create(user=self.passenger.user, method_type='card', is_default=True)
+
+    def complete(self, fare, completed_at):
+        from rides.tests import create_ride
+        ride = create_ride(
+            self.passenger, driver=self.driver, status='completed', actual_fare=fare, completed_at=completed_at,
+        )
+        record_completed_ride(ride)
+        payment = Transaction.objects.create(
+            user_id=self.passenger.user_id, ride=ride, transaction_type='payment', status='completed',
+            amount=Decimal(fare), reference_number=f'ride-{ride.pk}-fare',
+        )
+        record_settled_payments([payment])
+        return ride
+
+    def test_complete_ride_and_settlement_roll_up_incrementally(self):
+        from rides.tests import create_ride
+        ride = create_ride(self.passenger, driver=self.driver, status='started')
+        self.client.force_authenticate(self.driver.user)
+
+        with mock.patch.object(settlement_worker, 'autostart', False), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/rides/{ride.id}/complete_ride/', {'actual_fare': '14.50'})
+        day = timezone.localdate()
+        summary = earnings_summary(self.driver.pk)
+        self.assertEqual(
+            [(row['rides'], row['fares'], row['earnings']) for row in summary.values()],
+            [(1, Decimal('14.50'), Decimal('0.00'))] * 3,
+        )
+        self.assertEqual(summary['day']['start'], day)
+
+        SettlementWorker(FakeProcessor(), autostart=False).run_once()
+        summary = earnings_summary(self.driver.pk)
+        self.assertEqual({row['earnings'] for row in summary.values()}, {Decimal('14.50')})
+        driver = DriverProfile.objects.get(pk=self.driver.pk)
+        self.assertEqual((driver.total_rides, driver.total_earnings), (1, Decimal('14.50')))
+        self.assertEqual(PassengerProfile.objects.get(pk=self.passenger.pk).total_rides, 1)
+
+    def test_buckets_follow_local_day_week_and_month(self):
+        sunday = datetime.datetime(2026, 3, 1, 12, tzinfo=datetime.timezone.utc)
+        self.complete('10.00', sunday)
+        self.complete('5.00', sunday + datetime.timedelta(days=1))
+
+        self.assertEqual(
+            [row[1:5] for row in rollups()],
+            [
+                ('day', datetime.date(2026, 3, 1), 1, Decimal('10.00')),
+                ('day', datetime.date(2026, 3, 2), 1, Decimal('5.00')),
+                ('month', datetime.date(2026, 3, 1), 2, Decimal('15.00')),
+                ('week', datetime.date(2026, 2, 23), 1, Decimal('10.00')),
+                ('week', datetime.date(2026, 3, 2), 1, Decimal('5.00')),
+            ],
+        )
+
+    def test_rebuild_matches_incremental_rollups(self):
+        start = datetime.datetime(2026, 1, 30, 22, tzinfo=datetime.timezone.utc)
+        for n in range(6):
+            self.complete(f'{n + 7}.25', start + datetime.timedelta(hours=9 * n))
+        incremental = rollups()
+        totals = DriverProfile.objects.values_list('total_rides', 'total_earnings').get(pk=self.driver.pk)
+
+        EarningsRollup.objects.all().delete()
+        DriverProfile.objects.update(total_rides=0, total_earnings=0)
+        PassengerProfile.objects.update(total_rides=0)
+        self.assertEqual(rebuild_earnings(batch_size=1), len(incremental))
+        self.assertEqual(rollups(), incremental)
+        self.assertEqual(DriverProfile.objects.values_list('total_rides', 'total_earnings').get(pk=self.driver.pk), totals)
+        self.assertEqual(PassengerProfile.objects.get(pk=self.passenger.pk).total_rides, 6)
+
+    def test_dashboard_reads_rollups_only(self):
+        self.complete('12.00', timezone.now())
+        self.client.force_authenticate(self.driver.user)
+
+        self.client.get('/api/drivers/earnings/')  # warm the identity cache
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/drivers/earnings/', {'period': 'day', 'limit': 7})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('rides_ride', ' '.join(query['sql'] for query in queries))
+        self.assertEqual(response.data['month']['earnings'], Decimal('12.00'))
+        self.assertEqual([row['rides'] for row in response.data['history']], [1])
+        self.assertEqual(self.client.get('/api/drivers/earnings/', {'period': 'year'}).status_code, 400)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'payments'
+
+    def ready(self):
+        from drivers.spatial import driver_index
+        from payments.surge import surge_grid
+
+        driver_index.add_listener(surge_grid)
@@ -0,0 +1,147 @@
+import csv
+import io
+
+from django.db import transaction
+
+from payments.models import Invoice, Transaction
+from payments.pdf import paginate, stream_pdf
+from payments.pricing import quote_batch, quote_rows
+from rides.models import Ride
+
+RIDE_FIELDS = ('id', 'vehicle_type', 'estimated_distance', 'estimated_duration', 'surge_multiplier')
+EXPORT_FIELDS = (
+    'id', 'ride_id', 'transaction_id', 'issued_at', 'base_fare', 'distance_charge', 'time_charge',
+    'surge_multiplier', 'discount', 'tax', 'total_amount',
+)
+
+
+def uninvoiced_rides(since=None, until=None):
+    rides = Ride.objects.filter(status='completed', invoice__isnull=True)
+    if since is not None:
+        rides = rides.filter(completed_at__gte=since)
+    if until is not None:
+        rides = rides.filter(completed_at__lt=until)
+    return rides
+
+
+def ride_payments(ride_ids):
+    """``{ride_id: (transaction_id, amount)}`` for the first settled, uninvoiced payment of each ride."""
+    payments = {}
+    # Pending charges can still fail, so only completed ones are invoiced.
+    rows = (
+        Transaction.objects.filter(
+            ride_id__in=ride_ids, transaction_type='payment', status='completed', invoice__isnull=True,
+        )
+        .order_by('ride_id', 'id').values_list('ride_id', 'id', 'amount')
+    )
+    for ride_id, transaction_id, amount in rows:
+        payments.setdefault(ride_id, (transaction_id, amount))
+    return payments
+
+
+def price_invoices(rides, payments):
+    """Unsaved ``Invoice``s for ``rides`` (dicts of ``RIDE_FIELDS``), priced in one vectorised pass."""
+    rides = [ride for ride in rides if ride['id'] in payments]
+    if not rides:
+        return []
+    batch = quote_batch(
+        None, None,
+        [ride['vehicle_type'] for ride in rides],
+        surge=[ride['surge_multiplier'] for ride in rides],
+        distance_km=[ride['estimated_distance'] for ride in rides],
+        duration_min=[ride['estimated_duration'] for ride in rides],
+    )
+    invoices = []
+    for ride, row in zip(rides, quote_rows(batch)):
+        transaction_id, charged = payments[ride['id']]
+        invoices.append(Invoice(
+            ride_id=ride['id'],
+            transaction_id=transaction_id,
+            base_fare=row['base_fare'],
+            distance_charge=row['distance_charge'],
+            time_charge=row['time_charge'],
+            surge_multiplier=row['surge_multiplier'],
+            # Negative when the final fare came in above the quote.
+            discount=row['total_amount'] - charged,
+            tax=row['tax'],
+            total_amount=charged,
+        ))
+    return invoices
+
+
+def build_invoices(since=None, until=None, chunk_size=2000):
+    """
+    Create ``Invoice``s for completed rides that have a payment but no invoice yet.
+
+    Rides are walked in id order ``chunk_size`` at a time, so memory stays
+    flat however many there are. Each chunk costs five queries: rides,
+    their payments, a row lock on the rides being invoiced, a re-check for
+    invoices a concurrent run committed meanwhile, and one ``bulk_create``.
+    Components come from the pricing tables applied to the ride's
+    estimates and surge multiplier. ``total_amount`` is what the payment
+    charged, and ``discount`` absorbs any gap to the quote. Rides without a
+    completed payment are left for a later run. Returns ``(created,
+    skipped)``, counting only rows this run inserted as created.
+    """
+    rides = uninvoiced_rides(since, until)
+    created = skipped = 0
+    last_id = 0
+    while True:
+        chunk = list(rides.filter(id__gt=last_id).order_by('id').values(*RIDE_FIELDS)[:chunk_size])
+        if not chunk:
+            return created, skipped
+        last_id = chunk[-1]['id']
+        invoices = price_invoices(chunk, ride_payments([ride['id'] for ride in chunk]))
+        with transaction.atomic():
+            # Concurrent runs queue on the ride locks, then drop what the
+            # other one invoiced; the unique keys remain the last guard.
+            ride_ids = [invoice.ride_id for invoice in invoices]
+            list(Ride.objects.select_for_update().filter(pk__in=ride_ids).values_list('pk', flat=True))
+            invoiced = set(Invoice.objects.filter(ride_id__in=ride_ids).values_list('ride_id', flat=True))
+            invoices = [invoice for invoice in invoices if invoice.ride_id not in invoiced]
+            Invoice.objects.bulk_create(invoices, ignore_conflicts=True)
+        created += len(invoices)
+        skipped += len(chunk) - len(invoices)
+
+
+def iter_invoices(invoices, chunk_size=2000):
+    """Yield ``EXPORT_FIELDS`` tuples of ``invoices`` in id order, fetching ``chunk_size`` rows per query."""
+    # Seeking on the id keeps one chunk in memory; ``.iterator()`` would
+    # need a server-side cursor, which transaction pooling rules out.
+    last_id = 0
+    while True:
+        chunk = list(invoices.filter(id__gt=last_id).order_by('id').values_list(*EXPORT_FIELDS)[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        last_id = chunk[-1][0]
+
+
+def invoice_csv(rows, rows_per_part=500):
+    """CSV text for ``iter_invoices`` rows, yielded ``rows_per_part`` lines at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row[:3] + (row[3].isoformat(),) + row[4:])
+        if count % rows_per_part == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+PDF_HEADER = (
+    f'{"Invoice":>9} {"Ride":>9} {"Issued":<16} {"Base":>9} {"Distance":>9} {"Time":>9} '
+    f'{"Surge":>5} {"Discount":>9} {"Tax":>8} {"Total":>10}'
+)
+
+
+def invoice_pdf(rows, title='Invoices'):
+    """A PDF listing ``iter_invoices`` rows, written page by page."""
+    lines = (
+        f'{id_:>9} {ride_id:>9} {issued_at:%Y-%m-%d %H:%M} {base:>9} {distance:>9} {time:>9} '
+        f'{surge:>5.2f} {discount:>9} {tax:>8} {total:>10}'
+        for id_, ride_id, _, issued_at, base, distance, time, surge, discount, tax, total in rows
+    )
+    return stream_pdf(paginate(lines, header=(title, '', PDF_HEADER, '')))
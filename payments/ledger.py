@@ -0,0 +1,154 @@
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Max, OuterRef, Subquery, Sum, When
+from django.utils import timezone
+
+from payments.models import PaymentMethod, Transaction, WalletSnapshot
+
+DEFAULTS = {
+    'SNAPSHOT_LAG_SECONDS': 60.0,
+}
+
+CREDIT_TYPES = ('refund', 'wallet_topup')
+DEBIT_TYPES = ('payment', 'withdrawal')
+CENT = Decimal('0.01')
+
+
+def ledger_settings():
+    return {**DEFAULTS, **getattr(settings, 'WALLET_LEDGER', {})}
+
+
+class InsufficientFunds(Exception):
+    def __init__(self, wallet_id, amount):
+        self.wallet_id = wallet_id
+        self.amount = amount
+        super().__init__(f'Wallet {wallet_id} cannot cover {amount}')
+
+
+def signed_amount():
+    return Case(When(transaction_type__in=CREDIT_TYPES, then=F('amount')), default=-F('amount'))
+
+
+def ledger_entries(wallet_id):
+    return Transaction.objects.filter(payment_method_id=wallet_id, status='completed')
+
+
+def post_entry(wallet, transaction_type, amount, ride=None, description='', reference_number=None):
+    """
+    Append a completed ledger entry for ``wallet`` and move its running balance.
+
+    The entry is inserted first and the balance moved last with a single
+    ``UPDATE ... SET wallet_balance = wallet_balance + delta``, so the hot
+    wallet row is only locked for the tail of the transaction and no
+    balance is ever read back into Python. Debits carry a
+    ``wallet_balance >= amount`` guard on that UPDATE; when it matches
+    nothing the entry is rolled back and ``InsufficientFunds`` raised.
+    """
+    if wallet.method_type != 'wallet':
+        raise ValueError(f'Payment method {wallet.pk} is not a wallet')
+    if transaction_type not in CREDIT_TYPES + DEBIT_TYPES:
+        raise ValueError(f'Unknown ledger entry type: {transaction_type}')
+    amount = Decimal(amount).quantize(CENT)
+    if amount <= 0:
+        raise ValueError('Ledger amounts must be positive')
+    credit = transaction_type in CREDIT_TYPES
+
+    now = timezone.now()
+    with transaction.atomic():
+        entry = Transaction.objects.create(
+            user_id=wallet.user_id,
+            payment_method_id=wallet.pk,
+            ride=ride,
+            transaction_type=transaction_type,
+            status='completed',
+            amount=amount,
+            reference_number=reference_number or f'WL-{uuid.uuid4().hex}',
+            description=description,
+            completed_at=now,
+        )
+        wallets = PaymentMethod.objects.filter(pk=wallet.pk, method_type='wallet')
+        if not credit:
+            wallets = wallets.filter(wallet_balance__gte=amount)
+        if not wallets.update(wallet_balance=F('wallet_balance') + (amount if credit else -amount), updated_at=now):
+            raise InsufficientFunds(wallet.pk, amount)
+    return entry
+
+
+def credit(wallet, amount, transaction_type='wallet_topup', **fields):
+    return post_entry(wallet, transaction_type, amount, **fields)
+
+
+def debit(wallet, amount, transaction_type='payment', **fields):
+    return post_entry(wallet, transaction_type, amount, **fields)
+
+
+def latest_snapshot(wallet_id):
+    return WalletSnapshot.objects.filter(payment_method_id=wallet_id).order_by('-last_transaction_id').first()
+
+
+def ledger_balance(wallet_id):
+    """Balance derived from the ledger: the latest snapshot plus every entry after it."""
+    snapshot = latest_snapshot(wallet_id)
+    entries = ledger_entries(wallet_id)
+    balance = Decimal('0')
+    if snapshot is not None:
+        entries = entries.filter(id__gt=snapshot.last_transaction_id)
+        balance = snapshot.balance
+    return (balance + (entries.aggregate(total=Sum(signed_amount()))['total'] or 0)).quantize(CENT)
+
+
+def snapshot_wallets(now=None):
+    """
+    Roll every wallet with new entries forward to a fresh snapshot.
+
+    All snapshots of one run share a watermark, the newest entry older than
+    ``SNAPSHOT_LAG_SECONDS``. Ids are handed out before commit, so the lag
+    keeps an entry that is still in flight from landing below a watermark
+    and being skipped. Returns the number of snapshots written.
+    """
+    now = now or timezone.now()
+    settled = now - timedelta(seconds=ledger_settings()['SNAPSHOT_LAG_SECONDS'])
+    watermark = Transaction.objects.filter(created_at__lte=settled).aggregate(last=Max('id'))['last']
+    previous = WalletSnapshot.objects.aggregate(last=Max('last_transaction_id'))['last'] or 0
+    if watermark is None or watermark <= previous:
+        return 0
+
+    deltas = dict(
+        Transaction.objects.filter(
+            payment_method__method_type='wallet', status='completed', id__gt=previous, id__lte=watermark,
+        )
+        .order_by().values('payment_method_id').annotate(delta=Sum(signed_amount()))
+        .values_list('payment_method_id', 'delta')
+    )
+    newest = WalletSnapshot.objects.filter(payment_method_id=OuterRef('payment_method_id')).order_by('-last_transaction_id')
+    balances = dict(
+        WalletSnapshot.objects.filter(
+            payment_method_id__in=deltas, last_transaction_id=Subquery(newest.values('last_transaction_id')[:1]),
+        ).values_list('payment_method_id', 'balance')
+    )
+    WalletSnapshot.objects.bulk_create(
+        WalletSnapshot(
+            payment_method_id=wallet_id,
+            balance=(balances.get(wallet_id, Decimal('0')) + delta).quantize(CENT),
+            last_transaction_id=watermark,
+        )
+        for wallet_id, delta in deltas.items()
+    )
+    return len(deltas)
+
+
+def reconcile(wallet_ids=None):
+    """``{wallet_id: (running, ledger)}`` for wallets whose running balance drifted from the ledger."""
+    wallets = PaymentMethod.objects.filter(method_type='wallet')
+    if wallet_ids is not None:
+        wallets = wallets.filter(pk__in=wallet_ids)
+    drifted = {}
+    for wallet_id, running in wallets.values_list('id', 'wallet_balance').iterator():
+        derived = ledger_balance(wallet_id)
+        if derived != running:
+            drifted[wallet_id] = (running, derived)
+    return drifted
@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from payments.pricing import quote, quote_batch, vehicle_types
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark vectorised fare quoting against quoting trips one at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trips', type=int, default=100000)
+        parser.add_argument('--single-trips', type=int, default=2000,
+                            help='Sample size for the one-at-a-time baseline')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        count = options['trips']
+        center = np.array([0.3476, 32.5825])
+        pickups = center + rng.uniform(-0.15, 0.15, size=(count, 2))
+        dropoffs = center + rng.uniform(-0.15, 0.15, size=(count, 2))
+        types = rng.choice(vehicle_types(), size=count).tolist()
+
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            quote_batch(pickups, dropoffs, types)
+            timings.append(time.perf_counter() - started)
+        batch = min(timings)
+
+        sample = options['single_trips']
+        started = time.perf_counter()
+        for i in range(sample):
+            quote(
+                {'lat': pickups[i, 0], 'lng': pickups[i, 1]},
+                {'lat': dropoffs[i, 0], 'lng': dropoffs[i, 1]},
+                types[i],
+            )
+        single = (time.perf_counter() - started) / sample
+
+        self.stdout.write(f'batch : {count} quotes in {batch * 1000:.1f} ms ({batch / count * 1e6:.2f} us/quote)')
+        self.stdout.write(f'single: {single * 1e6:.1f} us/quote')
+        self.stdout.write(self.style.SUCCESS(f'speedup: {single / (batch / count):.0f}x'))
@@ -0,0 +1,74 @@
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from payments.invoicing import build_invoices, invoice_csv, invoice_pdf, iter_invoices
+from payments.models import Invoice, Transaction
+from rides.models import Ride
+from users.models import PassengerProfile, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed completed, paid rides for a bench_invoices passenger, build their invoices in bulk, then '
+        'stream CSV and PDF exports of increasing size and report time and peak Python memory.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help='Comma-separated export sizes')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        user, _ = User.objects.get_or_create(
+            username='bench_invoices', defaults={'user_type': 'passenger', 'phone_number': '+000bench_invoices'},
+        )
+        passenger, _ = PassengerProfile.objects.get_or_create(user=user)
+        self.seed(passenger, sizes[-1], options['batch_size'])
+
+        started = time.perf_counter()
+        created, _ = build_invoices(chunk_size=options['chunk_size'])
+        self.stdout.write(f'built {created} invoices in {time.perf_counter() - started:.2f} s')
+
+        invoices = Invoice.objects.filter(transaction__user=user)
+        for size in sizes:
+            last_id = invoices.order_by('id').values_list('id', flat=True)[size - 1]
+            subset = invoices.filter(id__lte=last_id)
+            for name, render in (('csv', invoice_csv), ('pdf', invoice_pdf)):
+                tracemalloc.start()
+                started = time.perf_counter()
+                written = sum(len(part) for part in render(iter_invoices(subset, options['chunk_size'])))
+                elapsed = time.perf_counter() - started
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.stdout.write(
+                    f'{name} {size:>8} invoices: {written / 2 ** 20:8.1f} MiB in {elapsed:6.2f} s, '
+                    f'peak {peak / 2 ** 20:6.2f} MiB'
+                )
+
+    def seed(self, passenger, count, batch_size):
+        missing = count - Invoice.objects.filter(transaction__user_id=passenger.user_id).count()
+        now = timezone.now()
+        while missing > 0:
+            batch = min(batch_size, missing)
+            rides = Ride.objects.bulk_create(
+                Ride(
+                    passenger=passenger, pickup_location={'lat': 0.0, 'lng': 0.0},
+                    dropoff_location={'lat': 0.0, 'lng': 0.05}, status='completed', estimated_distance=5.5,
+                    estimated_duration=11, estimated_fare=Decimal('12.00'), actual_fare=Decimal('12.00'),
+                    completed_at=now,
+                )
+                for _ in range(batch)
+            )
+            Transaction.objects.bulk_create(
+                Transaction(
+                    user_id=passenger.user_id, ride=ride, transaction_type='payment', status='completed',
+                    amount=Decimal('12.00'), reference_number=f'bench-invoice-{ride.pk}',
+                )
+                for ride in rides
+            )
+            missing -= batch
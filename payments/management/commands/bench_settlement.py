@@ -0,0 +1,64 @@
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from payments.models import Transaction
+from payments.processors import FakeProcessor
+from payments.settlement import SettlementWorker
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure settlement throughput against the fake processor at several concurrency levels. '
+        'Creates pending payments for a bench_settlement user in the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=2000)
+        parser.add_argument('--concurrency', default='1,10,50,100', help='Comma-separated in-flight call limits')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=0.05, help='Seconds per processor call')
+        parser.add_argument('--failure-rate', type=float, default=0.05, help='Share of calls failing transiently')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(
+            username='bench_settlement',
+            defaults={'user_type': 'passenger', 'phone_number': '+000bench_settlement'},
+        )
+        for concurrency in (int(value) for value in options['concurrency'].split(',')):
+            run = uuid.uuid4().hex[:8]
+            now = timezone.now()
+            Transaction.objects.bulk_create(
+                [
+                    Transaction(
+                        user=user, transaction_type='payment', amount=Decimal('12.00'),
+                        reference_number=f'bench-{run}-{n}', next_attempt_at=now,
+                    )
+                    for n in range(options['payments'])
+                ],
+                batch_size=1000,
+            )
+            processor = FakeProcessor(
+                latency=options['latency'], failure_rate=options['failure_rate'], seed=options['seed'],
+            )
+            # No backoff, so transient failures are retried within the run.
+            worker = SettlementWorker(
+                processor,
+                {'CONCURRENCY': concurrency, 'BATCH_SIZE': options['batch_size'], 'BACKOFF_BASE': 0.0,
+                 'MAX_ATTEMPTS': 100},
+                autostart=False,
+            )
+
+            started = time.perf_counter()
+            totals = worker.drain()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'concurrency {concurrency:>4}: {totals["completed"]} settled in {elapsed:6.2f} s '
+                f'({totals["completed"] / elapsed:7.0f}/s), {processor.calls} processor calls, '
+                f'{totals["retry"]} retries'
+            )
@@ -0,0 +1,98 @@
+import random
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+
+from payments import ledger
+from payments.models import PaymentMethod, Transaction
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Hammer a few hot wallets with concurrent ledger credits and debits from many threads, '
+        'report throughput and check that no update was lost. Uses bench_wallet users in the '
+        'configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--operations', type=int, default=200, help='Entries posted per thread')
+        parser.add_argument('--wallets', type=int, default=4, help='Wallets shared by all threads')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def wallets(self, count):
+        wallets = []
+        for i in range(count):
+            user, _ = User.objects.get_or_create(
+                username=f'bench_wallet_{i}',
+                defaults={'user_type': 'passenger', 'phone_number': f'+000bench_wallet_{i}'},
+            )
+            wallet = PaymentMethod.objects.filter(user=user, method_type='wallet').first()
+            wallets.append(wallet or PaymentMethod.objects.create(user=user, method_type='wallet'))
+        return wallets
+
+    def handle(self, *args, **options):
+        wallets = self.wallets(options['wallets'])
+        for wallet in wallets:
+            ledger.credit(wallet, '500.00')
+        before = {wallet.pk: PaymentMethod.objects.get(pk=wallet.pk).wallet_balance for wallet in wallets}
+        first_entry = Transaction.objects.order_by('-id').values_list('id', flat=True).first()
+
+        barrier = threading.Barrier(options['threads'] + 1)
+        rejected, errors = [0], []
+        lock = threading.Lock()
+
+        def work(seed):
+            rng = random.Random(seed)
+            try:
+                barrier.wait()
+                for _ in range(options['operations']):
+                    wallet = rng.choice(wallets)
+                    try:
+                        if rng.random() < 0.6:
+                            ledger.debit(wallet, Decimal(rng.randint(100, 2000)) / 100)
+                        else:
+                            ledger.credit(wallet, Decimal(rng.randint(100, 2000)) / 100)
+                    except ledger.InsufficientFunds:
+                        with lock:
+                            rejected[0] += 1
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=work, args=(options['seed'] + n,)) for n in range(options['threads'])
+        ]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        if errors:
+            raise CommandError(f'{len(errors)} threads failed, first: {errors[0]!r}')
+
+        attempted = options['threads'] * options['operations']
+        self.stdout.write(
+            f'{attempted} entries from {options["threads"]} threads on {len(wallets)} wallets in {elapsed:.2f} s '
+            f'({attempted / elapsed:.0f}/s), {rejected[0]} debits rejected for funds'
+        )
+
+        entries = Transaction.objects.filter(payment_method__in=wallets, id__gt=first_entry or 0)
+        lost = []
+        for wallet in wallets:
+            delta = entries.filter(payment_method=wallet).aggregate(total=Sum(ledger.signed_amount()))['total']
+            running = PaymentMethod.objects.get(pk=wallet.pk).wallet_balance
+            if running != (before[wallet.pk] + (delta or 0)).quantize(ledger.CENT) or running < 0:
+                lost.append(wallet.pk)
+        drifted = ledger.reconcile([wallet.pk for wallet in wallets])
+        if lost or drifted:
+            raise CommandError(f'Balances diverged from the ledger for wallets {sorted(set(lost) | set(drifted))}')
+        self.stdout.write('Running balances match the ledger')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from payments.invoicing import build_invoices
+
+
+def aware_datetime(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        raise CommandError(f'Expected an ISO 8601 datetime, got {value!r}')
+    return moment if timezone.is_aware(moment) else timezone.make_aware(moment)
+
+
+class Command(BaseCommand):
+    help = 'Create invoices for completed, paid rides that have none yet; safe to re-run, e.g. at month end'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=aware_datetime, help='Only rides completed at or after this time')
+        parser.add_argument('--until', type=aware_datetime, help='Only rides completed before this time')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        created, skipped = build_invoices(options['since'], options['until'], options['chunk_size'])
+        self.stdout.write(f'Created {created} invoices; {skipped} completed rides have no payment yet')
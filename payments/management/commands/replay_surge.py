@@ -0,0 +1,42 @@
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
+
+from payments.surge import SimulatedClock, SurgeGrid, replay, ride_events
+from rides.models import Ride
+
+
+class Command(BaseCommand):
+    help = 'Replay historic rides through the surge grid on a simulated clock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='ISO datetime; only rides requested from then on')
+        parser.add_argument('--until', help='ISO datetime; only rides requested before then')
+        parser.add_argument('--tick', type=float, help='Tick interval in seconds (defaults to SURGE)')
+        parser.add_argument('--top', type=int, default=10, help='How many surging ticks to list')
+
+    def handle(self, *args, **options):
+        rides = Ride.objects.all()
+        if options['since']:
+            rides = rides.filter(created_at__gte=parse_datetime(options['since']))
+        if options['until']:
+            rides = rides.filter(created_at__lt=parse_datetime(options['until']))
+
+        overrides = {'TICK_SECONDS': options['tick']} if options['tick'] else {}
+        clock = SimulatedClock()
+        grid = SurgeGrid(overrides, clock=clock)
+        ticks = []
+
+        def on_tick(timestamp, multipliers):
+            peak = max(multipliers.values(), default=1.0)
+            ticks.append((peak, len(multipliers), timestamp))
+
+        events = ride_events(rides)
+        replay(events, grid, clock, on_tick=on_tick)
+
+        surging = [tick for tick in ticks if tick[1]]
+        self.stdout.write(f'{len(events)} events, {len(ticks)} ticks, {len(surging)} with surge')
+        for peak, cells, timestamp in sorted(surging, reverse=True)[:options['top']]:
+            when = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+            self.stdout.write(f'{when:%Y-%m-%d %H:%M:%S}  peak x{peak:.1f} in {cells} cell(s)')
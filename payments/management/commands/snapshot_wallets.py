@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.ledger import reconcile, snapshot_wallets
+
+
+class Command(BaseCommand):
+    help = 'Snapshot wallet balances from the Transaction ledger; run periodically, e.g. from cron'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reconcile', action='store_true',
+                            help='Also check every running wallet balance against the ledger')
+
+    def handle(self, *args, **options):
+        written = snapshot_wallets()
+        self.stdout.write(f'Wrote {written} wallet snapshots')
+        if not options['reconcile']:
+            return
+
+        drifted = reconcile()
+        for wallet_id, (running, derived) in sorted(drifted.items()):
+            self.stdout.write(f'  wallet {wallet_id}: running {running} != ledger {derived}')
+        if drifted:
+            raise CommandError(f'{len(drifted)} wallets drifted from the ledger')
+        self.stdout.write('All wallet balances match the ledger')
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def open_ledger(apps, schema_editor):
+    PaymentMethod = apps.get_model('payments', 'PaymentMethod')
+    Transaction = apps.get_model('payments', 'Transaction')
+    WalletSnapshot = apps.get_model('payments', 'WalletSnapshot')
+
+    # Blank ids collide under the unique constraint once many rows have none.
+    Transaction.objects.filter(stripe_transaction_id='').update(stripe_transaction_id=None)
+
+    # Balances from before the ledger become each wallet's opening snapshot,
+    # empty ones included: older rows must not count towards the ledger.
+    watermark = Transaction.objects.aggregate(last=Max('id'))['last'] or 0
+    WalletSnapshot.objects.bulk_create(
+        WalletSnapshot(payment_method_id=wallet_id, balance=balance, last_transaction_id=watermark)
+        for wallet_id, balance in PaymentMethod.objects.filter(method_type='wallet')
+        .values_list('id', 'wallet_balance')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_transaction_history_index'),
+        ('rides', '0009_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('last_transaction_id', models.BigIntegerField(help_text='Ledger entries up to this id are included')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='stripe_transaction_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['payment_method', 'id'], name='transaction_ledger_idx'),
+        ),
+        migrations.AddField(
+            model_name='walletsnapshot',
+            name='payment_method',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='payments.paymentmethod'),
+        ),
+        migrations.AddIndex(
+            model_name='walletsnapshot',
+            index=models.Index(fields=['payment_method', '-last_transaction_id'], name='walletsnapshot_latest_idx'),
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
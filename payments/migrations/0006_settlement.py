@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:37
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def schedule_pending(apps, schema_editor):
+    Transaction = apps.get_model('payments', 'Transaction')
+    Transaction.objects.filter(status='pending', next_attempt_at=None).update(next_attempt_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_wallet_ledger'),
+        ('rides', '0009_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='failure_reason',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, help_text='Retry backoff or claim lease', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt_at', 'id'], name='transaction_pending_idx'),
+        ),
+        migrations.RunPython(schedule_pending, migrations.RunPython.noop),
+    ]
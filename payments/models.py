@@ -17,7 +17,7 @@ class PaymentMethod(models.Model):
     card_last_four = models.CharField(max_length=4, blank=True)
     card_brand = models.CharField(max_length=50, blank=True)
     
-    # Wallet
+    # Wallet: running balance of the ledger, only ever moved by payments.ledger
     wallet_balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     
     is_default = models.BooleanField(default=False)
@@ -54,21 +54,47 @@ class Transaction(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     payment_method = models.ForeignKey(PaymentMethod, on_delete=models.SET_NULL, null=True, blank=True)
     
-    stripe_transaction_id = models.CharField(max_length=255, blank=True, unique=True)
+    stripe_transaction_id = models.CharField(max_length=255, null=True, blank=True, unique=True)
     reference_number = models.CharField(max_length=100, unique=True)
     
     description = models.TextField(blank=True)
     
+    # Settlement: pending rows are charged by payments.settlement
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True, help_text="Retry backoff or claim lease")
+    failure_reason = models.CharField(max_length=255, blank=True)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['next_attempt_at', 'id'], condition=models.Q(status='pending'), name='transaction_pending_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='transaction_user_history_idx'),
+            models.Index(fields=['payment_method', 'id'], name='transaction_ledger_idx'),
+        ]
     
     def __str__(self):
         return f"Transaction #{self.reference_number} - {self.amount}"
 
 
+class WalletSnapshot(models.Model):
+    payment_method = models.ForeignKey(PaymentMethod, on_delete=models.CASCADE, related_name='snapshots')
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    last_transaction_id = models.BigIntegerField(help_text="Ledger entries up to this id are included")
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['payment_method', '-last_transaction_id'], name='walletsnapshot_latest_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Wallet {self.payment_method_id} at #{self.last_transaction_id}: {self.balance}"
+
+
 class Invoice(models.Model):
     ride = models.OneToOneField(Ride, on_delete=models.CASCADE, related_name='invoice')
     transaction = models.OneToOneField(Transaction, on_delete=models.CASCADE, related_name='invoice')
@@ -83,5 +109,10 @@ class Invoice(models.Model):
     
     issued_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['-issued_at', '-id'], name='invoice_issued_idx'),
+        ]
+    
     def __str__(self):
         return f"Invoice for Ride #{self.ride.id}"
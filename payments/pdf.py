@@ -0,0 +1,75 @@
+PAGE_WIDTH = 595  # A4, in points
+PAGE_HEIGHT = 842
+MARGIN = 40
+FONT_SIZE = 8
+LEADING = 11
+LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+
+
+def escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def page_stream(lines):
+    commands = [f'BT /F1 {FONT_SIZE} Tf {LEADING} TL {MARGIN} {PAGE_HEIGHT - MARGIN} Td']
+    commands.extend(f'({escape(line)}) Tj T*' for line in lines)
+    commands.append('ET')
+    return '\n'.join(commands).encode('latin-1', 'replace')
+
+
+def stream_pdf(pages):
+    """
+    Write a PDF one page at a time; ``pages`` yields lists of text lines.
+
+    Each page is emitted as soon as it is built, so only the current page
+    and the byte offset of every object are held while writing. The page
+    tree is written last, which PDF allows since objects are found through
+    the cross-reference table rather than by position.
+    """
+    offsets = {}
+    position = 0
+
+    def emit(number, body):
+        nonlocal position
+        offsets[number] = position
+        data = f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+        position += len(data)
+        return data
+
+    header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    position = len(header)
+    yield header
+    yield emit(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+    yield emit(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>')
+
+    kids = []
+    number = 4
+    for lines in pages:
+        content = page_stream(lines)
+        yield emit(number, f'<< /Length {len(content)} >>\nstream\n'.encode() + content + b'\nendstream')
+        yield emit(number + 1, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {number} 0 R >>'
+        ).encode())
+        kids.append(number + 1)
+        number += 2
+    yield emit(2, f'<< /Type /Pages /Kids [{" ".join(f"{kid} 0 R" for kid in kids)}] /Count {len(kids)} >>'.encode())
+
+    xref = [f'xref\n0 {number}\n', '0000000000 65535 f \n']
+    xref.extend(f'{offsets[n]:010d} 00000 n \n' for n in range(1, number))
+    yield ''.join(xref).encode()
+    yield f'trailer\n<< /Size {number} /Root 1 0 R >>\nstartxref\n{position}\n%%EOF\n'.encode()
+
+
+def paginate(lines, header=(), per_page=LINES_PER_PAGE):
+    """Group ``lines`` into pages, repeating ``header`` at the top of each; always at least one page."""
+    page = list(header)
+    emitted = False
+    for line in lines:
+        page.append(line)
+        if len(page) == per_page:
+            yield page
+            page = list(header)
+            emitted = True
+    if len(page) > len(header) or not emitted:
+        yield page
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import threading
+import time
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+
+from drivers.spatial import EARTH_RADIUS_KM
+from rides.eta import eta_service
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VEHICLE_TYPES = {
+    'economy': {'base_fare': 2.50, 'per_km': 1.10, 'per_minute': 0.20, 'minimum_fare': 5.00},
+    'comfort': {'base_fare': 3.50, 'per_km': 1.45, 'per_minute': 0.28, 'minimum_fare': 7.00},
+    'premium': {'base_fare': 5.00, 'per_km': 2.10, 'per_minute': 0.40, 'minimum_fare': 10.00},
+}
+
+DEFAULTS = {
+    'VEHICLE_TYPES': DEFAULT_VEHICLE_TYPES,
+    'TAX_RATE': 0.0,
+    'ROAD_FACTOR': 1.3,
+    'AVERAGE_SPEED_KMH': 28.0,
+    'TABLE_FILE': None,
+    'RELOAD_INTERVAL': 5.0,
+    'MAX_FARE_MULTIPLE': 3.0,
+}
+
+RATE_FIELDS = ('base_fare', 'per_km', 'per_minute', 'minimum_fare')
+CENT = Decimal('0.01')
+
+
+def pricing_settings():
+    return {**DEFAULTS, **getattr(settings, 'PRICING', {})}
+
+
+class PricingTables:
+    """
+    Per-vehicle-type rate arrays, hot-reloaded from ``PRICING['TABLE_FILE']``.
+
+    The JSON file has the same shape as ``PRICING`` (``VEHICLE_TYPES``,
+    ``TAX_RATE``, ...) and overrides it. Its mtime is checked at most every
+    ``RELOAD_INTERVAL`` seconds, so edits apply without a restart while
+    quotes in between cost no I/O. A file that fails to load, or that
+    leaves out a vehicle type rides can be booked with, is logged and the
+    last good table kept (``PRICING`` alone if none loaded yet) until the
+    file changes again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._mtime = None
+        self._config = None
+
+    @staticmethod
+    def _file_mtime(path):
+        return os.path.getmtime(path) if path and os.path.exists(path) else None
+
+    def _load(self, use_file=True):
+        from rides.models import Ride
+
+        config = pricing_settings()
+        path = config['TABLE_FILE']
+        mtime = None
+        if use_file and path and os.path.exists(path):
+            mtime = os.path.getmtime(path)
+            with open(path) as handle:
+                config = {**config, **json.load(handle)}
+
+        types = list(config['VEHICLE_TYPES'])
+        missing = [name for name, _ in Ride.VEHICLE_TYPE_CHOICES if name not in config['VEHICLE_TYPES']]
+        if missing:
+            raise ValueError(f'Pricing table has no rates for {", ".join(missing)}')
+        rates = np.array(
+            [[float(config['VEHICLE_TYPES'][name][field]) for field in RATE_FIELDS] for name in types],
+            dtype=np.float64,
+        )
+        return mtime, {
+            'types': {name: position for position, name in enumerate(types)},
+            'rates': rates,
+            'tax_rate': float(config['TAX_RATE']),
+            'road_factor': float(config['ROAD_FACTOR']),
+            'speed_kmh': float(config['AVERAGE_SPEED_KMH']),
+            'reload_interval': float(config['RELOAD_INTERVAL']),
+            'path': config['TABLE_FILE'],
+        }
+
+    def current(self):
+        now = time.monotonic()
+        config = self._config
+        if config is not None and now - self._checked_at < config['reload_interval']:
+            return config
+        with self._lock:
+            if self._config is None or now - self._checked_at >= self._config['reload_interval']:
+                mtime = self._file_mtime(self._config['path'] if self._config else None)
+                if self._config is None or mtime != self._mtime:
+                    try:
+                        self._mtime, self._config = self._load()
+                    except (OSError, ValueError, LookupError, TypeError):
+                        logger.exception('Could not load the pricing table; keeping the last good one')
+                        if self._config is None:
+                            self._config = self._load(use_file=False)[1]
+                        self._mtime = self._file_mtime(self._config['path'])
+                self._checked_at = now
+            return self._config
+
+    def reset(self):
+        with self._lock:
+            self._config = None
+            self._mtime = None
+
+
+pricing_tables = PricingTables()
+
+
+def vehicle_types():
+    return list(pricing_tables.current()['types'])
+
+
+def route_estimates(pickups, dropoffs, config=None):
+    """
+    Road distance (km) and duration (minutes) estimates for ``(n, 2)`` lat/lng arrays.
+
+    Taken from the road graph when ``ROUTING['GRAPH_FILE']`` is set, otherwise
+    the great-circle distance times ``ROAD_FACTOR`` at ``AVERAGE_SPEED_KMH``.
+    """
+    config = config or pricing_tables.current()
+    pickup_points = np.asarray(pickups, dtype=np.float64).reshape(-1, 2)
+    dropoff_points = np.asarray(dropoffs, dtype=np.float64).reshape(-1, 2)
+    pickups, dropoffs = np.radians(pickup_points), np.radians(dropoff_points)
+    dlat = dropoffs[:, 0] - pickups[:, 0]
+    dlng = dropoffs[:, 1] - pickups[:, 1]
+    a = np.sin(dlat / 2) ** 2 + np.cos(pickups[:, 0]) * np.cos(dropoffs[:, 0]) * np.sin(dlng / 2) ** 2
+    straight_km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    distance_km = straight_km * config['road_factor']
+    duration_min = np.ceil(distance_km / config['speed_kmh'] * 60)
+    if eta_service.available:
+        # Trips the road graph cannot route keep the straight-line estimate.
+        seconds, metres = eta_service.pairs(pickup_points, dropoff_points)
+        routed = ~np.isnan(seconds)
+        distance_km = np.where(routed, metres / 1000, distance_km)
+        duration_min = np.where(routed, np.ceil(seconds / 60), duration_min)
+    return distance_km, duration_min
+
+
+def quote_batch(pickups, dropoffs, vehicle_types, surge=None, distance_km=None, duration_min=None):
+    """
+    Price many trips in one vectorised pass.
+
+    Returns a dict of arrays aligned with the inputs, holding the ``Invoice``
+    components (``base_fare``, ``distance_charge``, ``time_charge``,
+    ``surge_multiplier``, ``tax``, ``total_amount``) plus the distance and
+    duration estimates they were priced on. Unknown vehicle types raise
+    ``KeyError``.
+    """
+    config = pricing_tables.current()
+    if distance_km is None or duration_min is None:
+        distance_km, duration_min = route_estimates(pickups, dropoffs, config)
+    distance_km = np.asarray(distance_km, dtype=np.float64)
+    duration_min = np.asarray(duration_min, dtype=np.float64)
+
+    type_index = np.fromiter(
+        (config['types'][name] for name in vehicle_types), dtype=np.int64, count=len(distance_km)
+    )
+    rates = config['rates'][type_index]
+    base_fare = rates[:, 0]
+    distance_charge = np.round(distance_km * rates[:, 1], 2)
+    time_charge = np.round(duration_min * rates[:, 2], 2)
+    # Short trips are topped up to the minimum fare through the base fare,
+    # so the components always add up to what the rider pays.
+    base_fare = np.round(np.maximum(base_fare, rates[:, 3] - distance_charge - time_charge), 2)
+
+    surge = np.ones(len(distance_km)) if surge is None else np.asarray(surge, dtype=np.float64)
+    subtotal = np.round((base_fare + distance_charge + time_charge) * surge, 2)
+    tax = np.round(subtotal * config['tax_rate'], 2)
+    return {
+        'distance_km': np.round(distance_km, 2),
+        'duration_min': duration_min.astype(np.int64),
+        'base_fare': base_fare,
+        'distance_charge': distance_charge,
+        'time_charge': time_charge,
+        'surge_multiplier': surge,
+        'tax': tax,
+        'total_amount': subtotal + tax,
+    }
+
+
+def _decimal(value):
+    return Decimal(repr(float(value))).quantize(CENT)
+
+
+def quote_rows(batch):
+    """Turn a ``quote_batch`` result into one dict per trip with ``Decimal`` money fields."""
+    money = ('base_fare', 'distance_charge', 'time_charge', 'tax', 'total_amount')
+    rows = []
+    for i in range(len(batch['total_amount'])):
+        row = {field: _decimal(batch[field][i]) for field in money}
+        row['distance_km'] = float(batch['distance_km'][i])
+        row['duration_min'] = int(batch['duration_min'][i])
+        row['surge_multiplier'] = float(batch['surge_multiplier'][i])
+        rows.append(row)
+    return rows
+
+
+def quote(pickup, dropoff, vehicle_type='economy', surge=None):
+    """Price a single trip; ``pickup``/``dropoff`` are ``{'lat', 'lng'}`` dicts."""
+    batch = quote_batch(
+        [(pickup['lat'], pickup['lng'])],
+        [(dropoff['lat'], dropoff['lng'])],
+        [vehicle_type],
+        surge=None if surge is None else [surge],
+    )
+    return quote_rows(batch)[0]
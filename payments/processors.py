@@ -0,0 +1,63 @@
+import asyncio
+import random
+import uuid
+from collections import namedtuple
+
+ChargeResult = namedtuple('ChargeResult', ('processor_id',))
+
+
+class ProcessorError(Exception):
+    """A charge that may succeed if retried: timeouts, 5xx, rate limits."""
+
+
+class PaymentDeclined(Exception):
+    """A charge the processor refused; retrying will not help."""
+
+
+class PaymentProcessor:
+    """
+    Interface the settlement worker charges through.
+
+    ``charge`` must be idempotent on ``idempotency_key``: a repeated key
+    returns the original result instead of charging again, which is what
+    makes it safe to retry after a timeout or a worker crash.
+    """
+
+    async def charge(self, idempotency_key, amount, payment_method_id=None, description=''):
+        raise NotImplementedError
+
+
+class FakeProcessor(PaymentProcessor):
+    """
+    In-memory processor for tests, development and benchmarks.
+
+    Each call sleeps ``latency`` seconds, then fails transiently with
+    probability ``failure_rate`` or declines with ``decline_rate``. Keys in
+    ``fail_keys`` / ``decline_keys`` always do. ``calls`` counts every call
+    and ``charges`` holds one entry per idempotency key actually charged.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, decline_rate=0.0, seed=None,
+                 fail_keys=(), decline_keys=()):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.decline_rate = decline_rate
+        self.fail_keys = set(fail_keys)
+        self.decline_keys = set(decline_keys)
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.charges = {}
+
+    async def charge(self, idempotency_key, amount, payment_method_id=None, description=''):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if idempotency_key in self.charges:
+            return ChargeResult(self.charges[idempotency_key][0])
+        if idempotency_key in self.fail_keys or self.random.random() < self.failure_rate:
+            raise ProcessorError(f'Processor unavailable for {idempotency_key}')
+        if idempotency_key in self.decline_keys or self.random.random() < self.decline_rate:
+            raise PaymentDeclined('Card declined')
+        processor_id = f'fake_{uuid.uuid4().hex}'
+        self.charges[idempotency_key] = (processor_id, amount)
+        return ChargeResult(processor_id)
@@ -0,0 +1,11 @@
+from rest_framework import serializers
+from payments.models import Invoice
+
+
+class InvoiceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Invoice
+        fields = [
+            'id', 'ride', 'transaction', 'base_fare', 'distance_charge', 'time_charge',
+            'surge_multiplier', 'discount', 'tax', 'total_amount', 'issued_at'
+        ]
@@ -0,0 +1,259 @@
+import asyncio
+import atexit
+import logging
+import random
+import threading
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from drivers.earnings import record_settled_payments
+from payments import ledger
+from payments.models import PaymentMethod, Transaction
+from payments.processors import PaymentDeclined
+from users.models import PassengerProfile
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'PROCESSOR': None,
+    'PROCESSOR_OPTIONS': {},
+    'BATCH_SIZE': 100,
+    'CONCURRENCY': 20,
+    'CALL_TIMEOUT': 10.0,
+    'MAX_ATTEMPTS': 6,
+    'BACKOFF_BASE': 2.0,
+    'BACKOFF_MAX': 300.0,
+    'LEASE_SECONDS': 120.0,
+    'POLL_INTERVAL': 2.0,
+}
+
+CENT = Decimal('0.01')
+
+
+def settlement_settings():
+    return {**DEFAULTS, **getattr(settings, 'SETTLEMENT', {})}
+
+
+def load_processor(options=None):
+    options = options or settlement_settings()
+    if not options['PROCESSOR']:
+        raise ImproperlyConfigured('SETTLEMENT["PROCESSOR"] must name a payment processor (PAYMENT_PROCESSOR)')
+    return import_string(options['PROCESSOR'])(**options['PROCESSOR_OPTIONS'])
+
+
+def ride_reference(ride_id):
+    return f'ride-{ride_id}-fare'
+
+
+def enqueue_ride_payment(ride):
+    """
+    Charge the fare of a completed ``ride``: from the wallet now, or later through the processor.
+
+    The reference number doubles as the ledger reference and the processor
+    idempotency key and is derived from the ride, so a retried completion
+    finds the same row and the passenger is charged once. When the
+    passenger's preferred method is a wallet that covers the fare, it is
+    debited through ``payments.ledger`` in the caller's transaction.
+    Otherwise the first other method is queued as a pending payment for the
+    worker; with none on file the payment is recorded as failed.
+    """
+    reference = ride_reference(ride.pk)
+    existing = Transaction.objects.filter(reference_number=reference).first()
+    if existing is not None:
+        return existing
+    user_id = PassengerProfile.objects.values_list('user_id', flat=True).get(pk=ride.passenger_id)
+    amount = Decimal(str(ride.actual_fare if ride.actual_fare is not None else ride.estimated_fare)).quantize(CENT)
+    description = f'Fare for ride #{ride.pk}'
+    methods = list(PaymentMethod.objects.filter(user_id=user_id, is_active=True).order_by('-is_default', 'id'))
+    if methods and methods[0].method_type == 'wallet':
+        try:
+            payment = ledger.debit(methods[0], amount, ride=ride, description=description, reference_number=reference)
+        except ledger.InsufficientFunds:
+            pass
+        else:
+            record_settled_payments([payment])
+            return payment
+
+    payment_method = next((method for method in methods if method.method_type != 'wallet'), None)
+    if payment_method is None:
+        outcome = {'status': 'failed', 'failure_reason': 'No payment method can cover the fare'}
+    else:
+        outcome = {'next_attempt_at': timezone.now()}
+        transaction.on_commit(settlement_worker.notify)
+    return Transaction.objects.create(
+        reference_number=reference,
+        user_id=user_id,
+        ride_id=ride.pk,
+        transaction_type='payment',
+        amount=amount,
+        payment_method=payment_method,
+        description=description,
+        **outcome,
+    )
+
+
+class SettlementWorker:
+    """
+    Settles pending payments in the background.
+
+    Each round claims up to ``BATCH_SIZE`` due payments by pushing their
+    ``next_attempt_at`` ``LEASE_SECONDS`` ahead (rows locked by another
+    worker are skipped), charges them concurrently on an asyncio loop with
+    at most ``CONCURRENCY`` calls in flight, and writes every outcome back
+    with one bulk update. Transient failures are retried with exponential
+    backoff and jitter up to ``MAX_ATTEMPTS``; declines fail at once. A
+    worker that dies mid-round leaves its lease to expire, and the retry
+    reuses the payment's idempotency key.
+    """
+
+    def __init__(self, processor=None, options=None, clock=timezone.now, autostart=True):
+        self.options = {**settlement_settings(), **(options or {})}
+        self.processor = processor
+        self.clock = clock
+        self.autostart = autostart
+        self.random = random.Random()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def configured(self):
+        return self.processor is not None or bool(self.options['PROCESSOR'])
+
+    def get_processor(self):
+        if self.processor is None:
+            self.processor = load_processor(self.options)
+        return self.processor
+
+    def due(self, now):
+        """Ids of payments due at ``now``, oldest first."""
+        return (
+            Transaction.objects.filter(status='pending', transaction_type='payment', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id').values_list('id', flat=True)
+        )
+
+    def claim(self):
+        now = self.clock()
+        with transaction.atomic():
+            ids = list(self.due(now).select_for_update(skip_locked=True)[:self.options['BATCH_SIZE']])
+            if not ids:
+                return []
+            Transaction.objects.filter(pk__in=ids).update(
+                next_attempt_at=now + timedelta(seconds=self.options['LEASE_SECONDS']),
+                attempts=F('attempts') + 1,
+            )
+            return list(Transaction.objects.filter(pk__in=ids).order_by('id'))
+
+    def backoff(self, attempts):
+        delay = min(self.options['BACKOFF_MAX'], self.options['BACKOFF_BASE'] * 2 ** (attempts - 1))
+        return delay * self.random.uniform(0.5, 1.0)
+
+    async def _charge(self, payment, limit):
+        async with limit:
+            return await asyncio.wait_for(
+                self.get_processor().charge(
+                    payment.reference_number, payment.amount, payment.payment_method_id, payment.description,
+                ),
+                self.options['CALL_TIMEOUT'],
+            )
+
+    async def _charge_all(self, payments):
+        limit = asyncio.Semaphore(self.options['CONCURRENCY'])
+        return await asyncio.gather(*(self._charge(payment, limit) for payment in payments), return_exceptions=True)
+
+    def settle(self, payments):
+        outcomes = asyncio.run(self._charge_all(payments))
+        now = self.clock()
+        counts = {'completed': 0, 'failed': 0, 'retry': 0}
+        for payment, outcome in zip(payments, outcomes):
+            if not isinstance(outcome, BaseException):
+                payment.status = 'completed'
+                payment.stripe_transaction_id = outcome.processor_id
+                payment.completed_at = now
+                payment.next_attempt_at = None
+                payment.failure_reason = ''
+                counts['completed'] += 1
+                continue
+            payment.failure_reason = (str(outcome) or type(outcome).__name__)[:255]
+            if isinstance(outcome, PaymentDeclined) or payment.attempts >= self.options['MAX_ATTEMPTS']:
+                payment.status = 'failed'
+                payment.next_attempt_at = None
+                counts['failed'] += 1
+            else:
+                payment.next_attempt_at = now + timedelta(seconds=self.backoff(payment.attempts))
+                counts['retry'] += 1
+        with transaction.atomic():
+            Transaction.objects.bulk_update(
+                payments, ['status', 'stripe_transaction_id', 'completed_at', 'next_attempt_at', 'failure_reason'],
+            )
+            record_settled_payments([payment for payment in payments if payment.status == 'completed'])
+        return counts
+
+    def run_once(self):
+        """Claim and settle one batch; returns counts of completed, failed and retried payments."""
+        self.get_processor()  # fail before claiming anything
+        payments = self.claim()
+        if not payments:
+            return {'completed': 0, 'failed': 0, 'retry': 0}
+        return self.settle(payments)
+
+    def drain(self):
+        """Settle batches until nothing is due; mostly for tests and benchmarks."""
+        totals = {'completed': 0, 'failed': 0, 'retry': 0}
+        while True:
+            counts = self.run_once()
+            if not any(counts.values()):
+                return totals
+            for key, value in counts.items():
+                totals[key] += value
+
+    def notify(self):
+        if self.autostart and self.configured:
+            self.start()
+        self._wakeup.set()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.options['POLL_INTERVAL'])
+            self._wakeup.clear()
+            try:
+                while not self._stop.is_set() and any(self.run_once().values()):
+                    pass
+            except Exception:
+                logger.exception('Settlement round failed')
+            finally:
+                close_old_connections()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self.run_forever, name='payment-settlement', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+settlement_worker = SettlementWorker()
+
+
+@atexit.register
+def _stop_on_exit():
+    try:
+        settlement_worker.stop()
+    except Exception:
+        logger.exception('Could not stop the settlement worker')
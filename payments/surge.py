@@ -0,0 +1,247 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CELL_SIZE_DEG': 0.02,
+    'TICK_SECONDS': 10.0,
+    'DEMAND_RATIO_THRESHOLD': 1.0,
+    'SENSITIVITY': 0.5,
+    'SMOOTHING': 0.5,
+    'STEP': 0.1,
+    'MAX_MULTIPLIER': 3.0,
+}
+
+
+def surge_settings():
+    return {**DEFAULTS, **getattr(settings, 'SURGE', {})}
+
+
+class SimulatedClock:
+    """Deterministic stand-in for ``time.monotonic`` in tests and replays."""
+
+    def __init__(self, start=0.0):
+        self.now = float(start)
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+        return self.now
+
+    def set(self, now):
+        self.now = float(now)
+
+
+class SurgeGrid:
+    """
+    Per-cell surge multipliers driven by live supply and demand counters.
+
+    Open ride requests and available drivers are counted per grid cell as
+    they come and go, so a tick never touches the database: it only revisits
+    cells whose counters changed or whose multiplier is still above 1.0.
+    Reads are a dict lookup on the last published multipliers, ticking
+    first if the tick interval has passed on ``clock``.
+    """
+
+    def __init__(self, options=None, clock=time.monotonic):
+        self.options = {**surge_settings(), **(options or {})}
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._demand = {}
+        self._supply = {}
+        self._ride_cells = {}
+        self._driver_cells = {}
+        self._dirty = set()
+        self._multipliers = {}
+        self._last_tick = None
+
+    def cell_for(self, lat, lng):
+        size = self.options['CELL_SIZE_DEG']
+        return (math.floor(float(lat) / size), math.floor(float(lng) / size))
+
+    def _move(self, counts, members, key, cell):
+        previous = members.get(key)
+        if previous == cell:
+            return
+        if previous is not None:
+            counts[previous] -= 1
+            if not counts[previous]:
+                del counts[previous]
+            self._dirty.add(previous)
+        if cell is None:
+            members.pop(key, None)
+        else:
+            members[key] = cell
+            counts[cell] = counts.get(cell, 0) + 1
+            self._dirty.add(cell)
+
+    def ride_opened(self, ride_id, lat, lng):
+        with self._lock:
+            self._move(self._demand, self._ride_cells, ride_id, self.cell_for(lat, lng))
+
+    def ride_closed(self, ride_id):
+        with self._lock:
+            self._move(self._demand, self._ride_cells, ride_id, None)
+
+    def driver_moved(self, driver_id, lat, lng):
+        with self._lock:
+            self._move(self._supply, self._driver_cells, driver_id, self.cell_for(lat, lng))
+
+    def driver_removed(self, driver_id):
+        with self._lock:
+            self._move(self._supply, self._driver_cells, driver_id, None)
+
+    def target_multiplier(self, demand, supply):
+        options = self.options
+        ratio = demand / max(supply, 1)
+        excess = ratio - options['DEMAND_RATIO_THRESHOLD']
+        if excess <= 0:
+            return 1.0
+        return min(options['MAX_MULTIPLIER'], 1.0 + options['SENSITIVITY'] * excess)
+
+    def tick(self):
+        options = self.options
+        step = options['STEP']
+        alpha = options['SMOOTHING']
+        with self._lock:
+            cells = self._dirty | set(self._multipliers)
+            self._dirty = set()
+            multipliers = dict(self._multipliers)
+            for cell in cells:
+                target = self.target_multiplier(self._demand.get(cell, 0), self._supply.get(cell, 0))
+                current = multipliers.get(cell, 1.0)
+                # Ease towards the target so one burst does not flap prices.
+                value = current + alpha * (target - current)
+                if abs(target - value) < step:
+                    value = target
+                value = round(round(value / step) * step, 2)
+                if value <= 1.0:
+                    multipliers.pop(cell, None)
+                else:
+                    multipliers[cell] = value
+            self._multipliers = multipliers
+            self._last_tick = self.clock()
+        return multipliers
+
+    def maybe_tick(self):
+        if self._last_tick is None or self.clock() - self._last_tick >= self.options['TICK_SECONDS']:
+            self.tick()
+
+    def multiplier_at(self, lat, lng):
+        if not self.options['ENABLED']:
+            return 1.0
+        self.maybe_tick()
+        return self._multipliers.get(self.cell_for(lat, lng), 1.0)
+
+    def multipliers_for(self, points):
+        if not self.options['ENABLED']:
+            return [1.0] * len(points)
+        self.maybe_tick()
+        multipliers = self._multipliers
+        return [multipliers.get(self.cell_for(lat, lng), 1.0) for lat, lng in points]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'multipliers': dict(self._multipliers),
+                'demand': dict(self._demand),
+                'supply': dict(self._supply),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._demand.clear()
+            self._supply.clear()
+            self._ride_cells.clear()
+            self._driver_cells.clear()
+            self._dirty.clear()
+            self._multipliers = {}
+            self._last_tick = None
+
+    def rebuild_from_db(self, index=None):
+        """Seed demand from open rides and supply from the driver index at startup."""
+        from drivers.spatial import driver_index, location_coords
+        from rides.models import Ride
+
+        self.reset()
+        for ride_id, pickup in Ride.objects.filter(status='requested').values_list('id', 'pickup_location'):
+            coords = location_coords(pickup)
+            if coords is not None:
+                self.ride_opened(ride_id, *coords)
+        for driver_id, (lat, lng, _) in (index or driver_index).drivers().items():
+            self.driver_moved(driver_id, lat, lng)
+        self.tick()
+
+
+surge_grid = SurgeGrid()
+
+
+def ride_events(rides):
+    """
+    Turn historic rides into a time-ordered event stream for ``replay``.
+
+    A request opens demand at ``created_at`` and closes it when the ride
+    started or was cancelled. A driver counts as supply at the pickup of their
+    first ride from its request time, is busy from start to completion and
+    is free again at the dropoff.
+    """
+    events = []
+    seen_drivers = set()
+    for ride in rides.order_by('created_at').only(
+        'id', 'driver_id', 'pickup_location', 'dropoff_location',
+        'created_at', 'started_at', 'completed_at', 'cancelled_at',
+    ):
+        pickup, dropoff = ride.pickup_location or {}, ride.dropoff_location or {}
+        if 'lat' not in pickup or 'lng' not in pickup:
+            continue
+        events.append((ride.created_at.timestamp(), 'ride_opened', ride.id, pickup['lat'], pickup['lng']))
+        closed_at = ride.started_at or ride.cancelled_at
+        if closed_at:
+            events.append((closed_at.timestamp(), 'ride_closed', ride.id, None, None))
+        if ride.driver_id is None:
+            continue
+        if ride.driver_id not in seen_drivers:
+            seen_drivers.add(ride.driver_id)
+            events.append((ride.created_at.timestamp(), 'driver_moved', ride.driver_id, pickup['lat'], pickup['lng']))
+        if ride.started_at:
+            events.append((ride.started_at.timestamp(), 'driver_removed', ride.driver_id, None, None))
+        if ride.completed_at and 'lat' in dropoff:
+            events.append((ride.completed_at.timestamp(), 'driver_moved', ride.driver_id, dropoff['lat'], dropoff['lng']))
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def replay(events, grid, clock, on_tick=None):
+    """
+    Feed ``(timestamp, kind, id, lat, lng)`` events through ``grid`` on ``clock``.
+
+    Ticks fire at every ``TICK_SECONDS`` boundary crossed between events;
+    ``on_tick(timestamp, multipliers)`` observes each one.
+    """
+    interval = grid.options['TICK_SECONDS']
+    next_tick = None
+    for timestamp, kind, key, lat, lng in events:
+        if next_tick is None:
+            next_tick = timestamp + interval
+        while timestamp >= next_tick:
+            clock.set(next_tick)
+            multipliers = grid.tick()
+            if on_tick is not None:
+                on_tick(next_tick, multipliers)
+            next_tick += interval
+        clock.set(timestamp)
+        if kind in ('ride_opened', 'driver_moved'):
+            getattr(grid, kind)(key, lat, lng)
+        else:
+            getattr(grid, kind)(key)
+    if next_tick is not None:
+        clock.set(next_tick)
+        multipliers = grid.tick()
+        if on_tick is not None:
+            on_tick(next_tick, multipliers)
+    return grid
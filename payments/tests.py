@@ -1,3 +1,642 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from drivers.spatial import DriverSpatialIndex
+from payments import invoicing, ledger
+from payments.invoicing import build_invoices
+from payments.models import Invoice, PaymentMethod, Transaction
+from payments.pdf import paginate, stream_pdf
+from payments.pricing import pricing_tables, quote, quote_batch, vehicle_types
+from payments.processors import FakeProcessor
+from payments.settlement import SettlementWorker, enqueue_ride_payment, settlement_worker
+from payments.surge import SimulatedClock, SurgeGrid, replay, ride_events, surge_grid
+from rides.models import Ride
+from rides.tests import DROPOFF, PICKUP, create_driver, create_passenger, create_ride
+
+SURGE = {'CELL_SIZE_DEG': 0.01, 'TICK_SECONDS': 10, 'SENSITIVITY': 0.5, 'SMOOTHING': 1, 'STEP': 0.1}
+
+RATES = {
+    'economy': {'base_fare': 2.0, 'per_km': 1.0, 'per_minute': 0.5, 'minimum_fare': 5.0},
+    'comfort': {'base_fare': 3.0, 'per_km': 1.5, 'per_minute': 0.75, 'minimum_fare': 7.0},
+    'premium': {'base_fare': 4.0, 'per_km': 2.0, 'per_minute': 1.0, 'minimum_fare': 10.0},
+}
+
+
+@override_settings(PRICING={'VEHICLE_TYPES': RATES, 'TAX_RATE': 0.1, 'ROAD_FACTOR': 1.0, 'AVERAGE_SPEED_KMH': 60.0})
+class PricingTests(SimpleTestCase):
+    def setUp(self):
+        pricing_tables.reset()
+        self.addCleanup(pricing_tables.reset)
+
+    def test_components_add_up_to_total(self):
+        fare = quote({'lat': 0.0, 'lng': 0.0}, {'lat': 0.0, 'lng': 0.1}, 'premium')
+
+        self.assertAlmostEqual(fare['distance_km'], 11.12, places=2)
+        self.assertEqual(fare['duration_min'], 12)
+        self.assertEqual(fare['base_fare'], Decimal('4.00'))
+        self.assertEqual(fare['distance_charge'], Decimal('22.24'))
+        self.assertEqual(fare['time_charge'], Decimal('12.00'))
+        self.assertEqual(fare['tax'], Decimal('3.82'))
+        self.assertEqual(fare['total_amount'], Decimal('42.06'))
+
+    def test_short_trips_are_topped_up_to_minimum_fare(self):
+        fare = quote({'lat': 0.0, 'lng': 0.0}, {'lat': 0.0, 'lng': 0.001}, 'economy')
+        self.assertEqual(fare['base_fare'] + fare['distance_charge'] + fare['time_charge'], Decimal('5.00'))
+
+    def test_batch_matches_single_quotes_and_applies_surge(self):
+        pickups = [(0.0, 0.0), (0.1, 0.1)]
+        dropoffs = [(0.05, 0.0), (0.2, 0.2)]
+        batch = quote_batch(pickups, dropoffs, ['economy', 'premium'], surge=[1.0, 1.5])
+        single = quote({'lat': 0.1, 'lng': 0.1}, {'lat': 0.2, 'lng': 0.2}, 'premium', surge=1.5)
+        self.assertAlmostEqual(batch['total_amount'][1], float(single['total_amount']), places=2)
+        self.assertEqual(batch['surge_multiplier'].tolist(), [1.0, 1.5])
+
+    def test_table_file_is_hot_reloaded(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'pricing.json')
+            with open(path, 'w') as handle:
+                json.dump({'VEHICLE_TYPES': RATES, 'TAX_RATE': 0}, handle)
+            with self.settings(PRICING={'TABLE_FILE': path, 'RELOAD_INTERVAL': 0}):
+                pricing_tables.reset()
+                before = quote({'lat': 0.0, 'lng': 0.0}, {'lat': 0.0, 'lng': 0.1})
+
+                doubled = {name: {k: v * 2 for k, v in rates.items()} for name, rates in RATES.items()}
+                with open(path, 'w') as handle:
+                    json.dump({'VEHICLE_TYPES': doubled, 'TAX_RATE': 0}, handle)
+                os.utime(path, (1, os.path.getmtime(path) + 10))
+                after = quote({'lat': 0.0, 'lng': 0.0}, {'lat': 0.0, 'lng': 0.1})
+
+        self.assertEqual(after['base_fare'], before['base_fare'] * 2)
+        self.assertAlmostEqual(float(after['total_amount']), float(before['total_amount']) * 2, delta=0.02)
+
+    def test_malformed_table_file_keeps_the_last_good_table(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'pricing.json')
+            with open(path, 'w') as handle:
+                json.dump({'VEHICLE_TYPES': RATES, 'TAX_RATE': 0}, handle)
+            with self.settings(PRICING={'TABLE_FILE': path, 'RELOAD_INTERVAL': 0}):
+                pricing_tables.reset()
+                before = quote({'lat': 0.0, 'lng': 0.0}, {'lat': 0.0, 'lng': 0.1})
+                comfort = quote({'lat': 0.0, 'lng': 0.0}, {'lat': 0.0, 'lng': 0.1}, 'comfort')
+
+                with open(path, 'w') as handle:
+                    handle.write('{"VEHICLE_TYPES": {"economy": ')
+                os.utime(path, (1, os.path.getmtime(path) + 10))
+                with self.assertLogs('payments.pricing', 'ERROR'):
+                    after = quote({'lat': 0.0, 'lng': 0.0}, {'lat': 0.0, 'lng': 0.1})
+                self.assertEqual(after, before)
+
+                # A table that drops a bookable type is refused the same way.
+                with open(path, 'w') as handle:
+                    json.dump({'VEHICLE_TYPES': {'economy': RATES['economy']}, 'TAX_RATE': 0}, handle)
+                os.utime(path, (1, os.path.getmtime(path) + 20))
+                with self.assertLogs('payments.pricing', 'ERROR'):
+                    self.assertEqual(vehicle_types(), ['economy', 'comfort', 'premium'])
+                self.assertEqual(quote({'lat': 0.0, 'lng': 0.0}, {'lat': 0.0, 'lng': 0.1}, 'comfort'), comfort)
+
+                # Broken from the start: PRICING alone, without the file.
+                pricing_tables.reset()
+                with self.assertLogs('payments.pricing', 'ERROR'):
+                    self.assertEqual(vehicle_types(), ['economy', 'comfort', 'premium'])
+        pricing_tables.reset()
+
+
+class SurgeGridTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = SimulatedClock()
+        self.grid = SurgeGrid(SURGE, clock=self.clock)
+
+    def test_multiplier_follows_demand_over_supply_on_ticks(self):
+        self.grid.driver_moved(1, 0.005, 0.005)
+        for ride_id in range(5):
+            self.grid.ride_opened(ride_id, 0.005, 0.005)
+
+        self.assertEqual(self.grid.multiplier_at(0.005, 0.005), 3.0)
+        self.assertEqual(self.grid.multiplier_at(0.015, 0.005), 1.0)
+
+        for ride_id in range(3):
+            self.grid.ride_closed(ride_id)
+        self.assertEqual(self.grid.multiplier_at(0.005, 0.005), 3.0)
+        self.clock.advance(10)
+        self.assertEqual(self.grid.multiplier_at(0.005, 0.005), 1.5)
+
+        self.grid.driver_moved(2, 0.006, 0.006)
+        self.clock.advance(10)
+        self.assertEqual(self.grid.multiplier_at(0.005, 0.005), 1.0)
+        self.assertEqual(self.grid.snapshot()['multipliers'], {})
+
+    def test_smoothing_eases_towards_target(self):
+        grid = SurgeGrid({**SURGE, 'SMOOTHING': 0.5}, clock=self.clock)
+        for ride_id in range(5):
+            grid.ride_opened(ride_id, 0.0, 0.0)
+        values = []
+        for _ in range(6):
+            values.append(grid.multiplier_at(0.0, 0.0))
+            self.clock.advance(10)
+        self.assertEqual(values, [2.0, 2.5, 2.8, 2.9, 3.0, 3.0])
+
+    def test_supply_follows_driver_index(self):
+        index = DriverSpatialIndex()
+        index.add_listener(self.grid)
+        index.update(7, 0.005, 0.005)
+        index.update(7, 0.025, 0.005)
+        self.assertEqual(self.grid.snapshot()['supply'], {(2, 0): 1})
+        index.remove(7)
+        self.assertEqual(self.grid.snapshot()['supply'], {})
+
+
+class SurgeReplayTests(TestCase):
+    def test_replay_of_historic_rides_is_deterministic(self):
+        passenger = create_passenger()
+        driver = create_driver('replay_driver')
+        start = timezone.now().replace(microsecond=0)
+        for minute in range(4):
+            ride = create_ride(passenger, pickup_location={'lat': 0.005, 'lng': 0.005})
+            Ride.objects.filter(pk=ride.pk).update(
+                created_at=start + timedelta(minutes=minute),
+                started_at=start + timedelta(minutes=minute + 3),
+                driver=driver if minute == 0 else None,
+            )
+
+        def run():
+            clock = SimulatedClock()
+            grid = SurgeGrid({**SURGE, 'TICK_SECONDS': 60}, clock=clock)
+            peaks = []
+            replay(ride_events(Ride.objects.all()), grid, clock,
+                   on_tick=lambda at, multipliers: peaks.append(max(multipliers.values(), default=1.0)))
+            return peaks
+
+        peaks = run()
+        self.assertEqual(peaks, run())
+        self.assertEqual(max(peaks), 2.0)
+        self.assertEqual(peaks[-1], 1.0)
+
+
+class FareApiTests(APITestCase):
+    def setUp(self):
+        pricing_tables.reset()
+        surge_grid.reset()
+        self.addCleanup(surge_grid.reset)
+        self.passenger = create_passenger()
+        self.client.force_authenticate(self.passenger.user)
+
+    def test_request_ride_ignores_client_estimates(self):
+        response = self.client.post('/api/rides/request_ride/', {
+            'pickup_location': PICKUP,
+            'dropoff_location': DROPOFF,
+            'vehicle_type': 'comfort',
+            'estimated_fare': '0.01',
+            'estimated_distance': 0,
+            'estimated_duration': 0,
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        ride = Ride.objects.get()
+        expected = quote(PICKUP, DROPOFF, 'comfort')
+        self.assertEqual(ride.estimated_fare, expected['total_amount'])
+        self.assertEqual(ride.estimated_duration, expected['duration_min'])
+
+    def test_request_ride_prices_in_live_surge(self):
+        for ride_id in range(-4, 0):
+            surge_grid.ride_opened(ride_id, PICKUP['lat'], PICKUP['lng'])
+        surge_grid.tick()
+
+        response = self.client.post('/api/rides/request_ride/', {
+            'pickup_location': PICKUP,
+            'dropoff_location': DROPOFF,
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        ride = Ride.objects.get()
+        self.assertGreater(ride.surge_multiplier, 1.0)
+        expected = quote(PICKUP, DROPOFF, surge=ride.surge_multiplier)
+        self.assertEqual(ride.estimated_fare, expected['total_amount'])
+        self.assertEqual(surge_grid.snapshot()['demand'][surge_grid.cell_for(PICKUP['lat'], PICKUP['lng'])], 5)
+
+    def test_request_ride_rejects_missing_coordinates(self):
+        response = self.client.post('/api/rides/request_ride/', {
+            'pickup_location': {'address': 'somewhere'},
+            'dropoff_location': DROPOFF,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pickup_location', response.data)
+
+    def test_estimate_fares_quotes_a_batch(self):
+        trips = [{'pickup': PICKUP, 'dropoff': DROPOFF, 'vehicle_type': kind} for kind in ('economy', 'premium')]
+        response = self.client.post('/api/rides/estimate_fares/', {'trips': trips}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        economy, premium = response.data['quotes']
+        self.assertLess(economy['total_amount'], premium['total_amount'])
+
+        trips[0]['vehicle_type'] = 'helicopter'
+        response = self.client.post('/api/rides/estimate_fares/', {'trips': trips}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_estimate_fares_rejects_bad_coordinates_and_types(self):
+        for pickup, kind in (
+            ({'lat': 'nan', 'lng': 32.58}, 'economy'),
+            ({'lat': 0.35, 'lng': 'inf'}, 'economy'),
+            ({'lat': 91, 'lng': 32.58}, 'economy'),
+            (PICKUP, ['economy']),
+            (PICKUP, None),
+        ):
+            trips = [{'pickup': pickup, 'dropoff': DROPOFF, 'vehicle_type': kind}]
+            response = self.client.post('/api/rides/estimate_fares/', {'trips': trips}, format='json')
+            self.assertEqual(response.status_code, 400, (pickup, kind))
+        response = self.client.post('/api/rides/estimate_fares/', {'trips': ['not a trip']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+def create_wallet(user, balance='0'):
+    return PaymentMethod.objects.create(user=user, method_type='wallet', wallet_balance=balance)
+
+
+@override_settings(WALLET_LEDGER={'SNAPSHOT_LAG_SECONDS': 0})
+class WalletLedgerTests(TestCase):
+    def setUp(self):
+        self.wallet = create_wallet(create_passenger().user)
+
+    def balance(self):
+        return PaymentMethod.objects.get(pk=self.wallet.pk).wallet_balance
+
+    def test_entries_move_the_running_balance(self):
+        ledger.credit(self.wallet, '50.00')
+        ledger.debit(self.wallet, '12.50')
+        ledger.credit(self.wallet, '2.50', transaction_type='refund')
+
+        self.assertEqual(self.balance(), Decimal('40.00'))
+        self.assertEqual(ledger.ledger_balance(self.wallet.pk), Decimal('40.00'))
+        self.assertEqual(Transaction.objects.filter(payment_method=self.wallet, status='completed').count(), 3)
+        self.assertEqual(ledger.reconcile(), {})
+
+    def test_overdraft_is_rejected_without_an_entry(self):
+        ledger.credit(self.wallet, '10.00')
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.debit(self.wallet, '10.01')
+
+        self.assertEqual(self.balance(), Decimal('10.00'))
+        self.assertEqual(Transaction.objects.filter(payment_method=self.wallet).count(), 1)
+
+    def test_snapshots_roll_forward_and_bound_the_ledger_read(self):
+        ledger.credit(self.wallet, '30.00')
+        ledger.debit(self.wallet, '5.00')
+        self.assertEqual(ledger.snapshot_wallets(), 1)
+        self.assertEqual(ledger.snapshot_wallets(), 0)  # nothing new
+
+        ledger.debit(self.wallet, '5.00')
+        self.assertEqual(ledger.snapshot_wallets(), 1)
+        snapshot = ledger.latest_snapshot(self.wallet.pk)
+        self.assertEqual(snapshot.balance, Decimal('20.00'))
+
+        ledger.credit(self.wallet, '1.00')
+        with self.assertNumQueries(2):
+            self.assertEqual(ledger.ledger_balance(self.wallet.pk), Decimal('21.00'))
+
+    def test_only_wallets_take_ledger_entries(self):
+        card = PaymentMethod.objects.create(user=self.wallet.user, method_type='card')
+        with self.assertRaises(ValueError):
+            ledger.credit(card, '10.00')
+        self.assertFalse(Transaction.objects.filter(payment_method=card).exists())
+
+    def test_opening_snapshot_covers_empty_wallets(self):
+        migration = importlib.import_module('payments.migrations.0005_wallet_ledger')
+        # An older top-up that was spent down to zero before the ledger existed.
+        Transaction.objects.create(
+            user=self.wallet.user, payment_method=self.wallet, transaction_type='wallet_topup',
+            status='completed', amount='15.00', reference_number='LEGACY-1',
+        )
+        migration.open_ledger(apps, None)
+
+        self.assertEqual(ledger.ledger_balance(self.wallet.pk), Decimal('0.00'))
+        self.assertEqual(ledger.reconcile(), {})
+
+    def test_reconcile_reports_drift(self):
+        ledger.credit(self.wallet, '10.00')
+        PaymentMethod.objects.filter(pk=self.wallet.pk).update(wallet_balance='11.00')
+        self.assertEqual(ledger.reconcile(), {self.wallet.pk: (Decimal('11.00'), Decimal('10.00'))})
+
+
+@skipIf(connection.vendor == 'sqlite', 'the in-memory SQLite test database fails concurrent writers outright')
+class WalletLedgerConcurrencyTests(TransactionTestCase):
+    def test_concurrent_credits_and_debits_lose_no_update(self):
+        wallet = create_wallet(create_passenger().user, balance='100.00')
+        threads, rounds = 8, 50
+        barrier = threading.Barrier(threads)
+        rejected, errors = [], []
+
+        def work(n):
+            try:
+                barrier.wait()
+                for i in range(rounds):
+                    try:
+                        if (n + i) % 3:
+                            ledger.debit(wallet, '7.00')
+                        else:
+                            ledger.credit(wallet, '5.00')
+                    except ledger.InsufficientFunds:
+                        rejected.append(n)
+            except Exception as exc:  # pragma: no cover - surfaced below
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=work, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        entries = Transaction.objects.filter(payment_method=wallet)
+        self.assertEqual(entries.count() + len(rejected), threads * rounds)
+        credits = entries.filter(transaction_type='wallet_topup').count()
+        debits = entries.filter(transaction_type='payment').count()
+        running = PaymentMethod.objects.get(pk=wallet.pk).wallet_balance
+        self.assertEqual(running, Decimal('100.00') + 5 * credits - 7 * debits)
+        self.assertGreaterEqual(running, 0)
+        self.assertEqual(ledger.reconcile([wallet.pk]), {})
+
+
+class SettlementTests(APITestCase):
+    def setUp(self):
+        # A second ahead, so payments enqueued during the test are already due.
+        self.clock = SimulatedClock(timezone.now().timestamp() + 1)
+        self.passenger = create_passenger()
+        self.card = PaymentMethod.objects.create(user=self.passenger.user, method_type='card', is_default=True)
+        create_wallet(self.passenger.user, balance='100.00')
+
+    def worker(self, processor, **options):
+        clock = lambda: datetime.fromtimestamp(self.clock(), tz=dt_timezone.utc)  # noqa: E731
+        return SettlementWorker(processor, {'BACKOFF_BASE': 1.0, **options}, clock=clock, autostart=False)
+
+    def pending(self, count):
+        return [
+            enqueue_ride_payment(create_ride(self.passenger, status='completed', actual_fare='10.00'))
+            for _ in range(count)
+        ]
+
+    def test_complete_ride_enqueues_one_pending_payment(self):
+        driver = create_driver()
+        ride = create_ride(self.passenger, driver=driver, status='started')
+        self.client.force_authenticate(driver.user)
+
+        with mock.patch.object(settlement_worker, 'autostart', False), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/rides/{ride.id}/complete_ride/', {'actual_fare': '14.50'})
+        self.assertEqual(response.status_code, 200)
+        payment = Transaction.objects.get(ride=ride)
+        self.assertEqual(
+            (payment.status, payment.amount, payment.payment_method_id, payment.user_id),
+            ('pending', Decimal('14.50'), self.card.pk, self.passenger.user_id),
+        )
+        ride.refresh_from_db()
+        self.assertEqual(enqueue_ride_payment(ride).pk, payment.pk)  # a retried completion reuses it
+
+    def test_failed_enqueue_rolls_back_the_completion(self):
+        driver = create_driver()
+        ride = create_ride(self.passenger, driver=driver, status='started')
+        self.client.force_authenticate(driver.user)
+        self.client.raise_request_exception = False
+
+        with mock.patch('rides.views.enqueue_ride_payment', side_effect=RuntimeError('database went away')), \
+                mock.patch('rides.state.publish_ride_status') as publish, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(f'/api/rides/{ride.id}/complete_ride/').status_code, 500)
+        publish.assert_not_called()  # subscribers never hear of the rolled-back completion
+        ride.refresh_from_db()
+        self.assertEqual(ride.status, 'started')
+        self.assertFalse(Transaction.objects.filter(ride=ride).exists())
+
+    def test_complete_ride_rejects_fares_outside_the_quote(self):
+        driver = create_driver()
+        ride = create_ride(self.passenger, driver=driver, status='started')
+        self.client.force_authenticate(driver.user)
+
+        for fare in ('0', '-5.00', 'abc', 'NaN', '36000.01'):
+            response = self.client.post(f'/api/rides/{ride.id}/complete_ride/', {'actual_fare': fare})
+            self.assertEqual(response.status_code, 400, fare)
+            self.assertIn('actual_fare', response.data)
+        ride.refresh_from_db()
+        self.assertEqual(ride.status, 'started')
+        self.assertFalse(Transaction.objects.filter(ride=ride).exists())
+
+    def test_wallet_only_passenger_pays_from_the_ledger(self):
+        rider = create_passenger('walletrider')
+        wallet = create_wallet(rider.user)
+        ledger.credit(wallet, '20.00')
+        driver = create_driver()
+        ride = create_ride(rider, driver=driver, status='completed', completed_at=timezone.now(), actual_fare='14.50')
+
+        payment = enqueue_ride_payment(ride)
+        self.assertEqual(
+            (payment.status, payment.amount, payment.payment_method_id, payment.reference_number),
+            ('completed', Decimal('14.50'), wallet.pk, f'ride-{ride.pk}-fare'),
+        )
+        self.assertEqual(PaymentMethod.objects.get(pk=wallet.pk).wallet_balance, Decimal('5.50'))
+        self.assertEqual(ledger.reconcile([wallet.pk]), {})
+        driver.refresh_from_db()
+        self.assertEqual(driver.total_earnings, Decimal('14.50'))
+        self.assertEqual(enqueue_ride_payment(ride).pk, payment.pk)  # no second debit
+        self.assertEqual(PaymentMethod.objects.get(pk=wallet.pk).wallet_balance, Decimal('5.50'))
+        self.assertEqual(self.worker(FakeProcessor()).run_once(), {'completed': 0, 'failed': 0, 'retry': 0})
+
+        # Short on funds with nothing else on file: recorded, never sent to the processor.
+        unpaid = enqueue_ride_payment(create_ride(rider, status='completed', actual_fare='10.00'))
+        self.assertEqual((unpaid.status, unpaid.payment_method_id), ('failed', None))
+        self.assertEqual(PaymentMethod.objects.get(pk=wallet.pk).wallet_balance, Decimal('5.50'))
+
+    def test_default_wallet_falls_back_to_a_card_when_short(self):
+        PaymentMethod.objects.filter(user=self.passenger.user).update(is_default=False)
+        PaymentMethod.objects.filter(user=self.passenger.user, method_type='wallet').update(is_default=True)
+        paid, short = (
+            enqueue_ride_payment(create_ride(self.passenger, status='completed', actual_fare=fare))
+            for fare in ('60.00', '60.00')
+        )
+        self.assertEqual((paid.status, paid.payment_method.method_type), ('completed', 'wallet'))
+        self.assertEqual((short.status, short.payment_method_id), ('pending', self.card.pk))
+
+    def test_worker_needs_a_configured_processor(self):
+        worker = SettlementWorker(options={'PROCESSOR': None})
+        self.assertFalse(worker.configured)
+        worker.notify()
+        self.assertIsNone(worker._thread)
+        payment, = self.pending(1)
+        with self.assertRaises(ImproperlyConfigured):
+            worker.run_once()
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.attempts), ('pending', 0))
+
+    def test_batch_is_charged_concurrently_and_completed(self):
+        payments = self.pending(5)
+        processor = FakeProcessor(latency=0.05)
+        worker = self.worker(processor, CONCURRENCY=5)
+
+        started = time.perf_counter()
+        self.assertEqual(worker.run_once(), {'completed': 5, 'failed': 0, 'retry': 0})
+        self.assertLess(time.perf_counter() - started, 0.2)
+
+        settled = Transaction.objects.filter(pk__in=[payment.pk for payment in payments])
+        self.assertEqual(set(settled.values_list('status', flat=True)), {'completed'})
+        self.assertEqual(
+            set(settled.values_list('stripe_transaction_id', flat=True)),
+            {charge[0] for charge in processor.charges.values()},
+        )
+        self.assertEqual(worker.run_once(), {'completed': 0, 'failed': 0, 'retry': 0})
+
+    def test_transient_failures_back_off_then_succeed(self):
+        payment, = self.pending(1)
+        processor = FakeProcessor(fail_keys=[payment.reference_number])
+        worker = self.worker(processor)
+
+        self.assertEqual(worker.run_once()['retry'], 1)
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.attempts), ('pending', 1))
+        self.assertEqual(worker.run_once()['retry'], 0)  # not due yet
+
+        processor.fail_keys.clear()
+        self.clock.advance(2)
+        self.assertEqual(worker.run_once()['completed'], 1)
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.attempts, payment.failure_reason), ('completed', 2, ''))
+
+    def test_declines_and_exhausted_retries_fail(self):
+        declined, flaky = self.pending(2)
+        processor = FakeProcessor(decline_keys=[declined.reference_number], fail_keys=[flaky.reference_number])
+        worker = self.worker(processor, MAX_ATTEMPTS=2)
+
+        self.assertEqual(worker.run_once(), {'completed': 0, 'failed': 1, 'retry': 1})
+        self.clock.advance(10)
+        self.assertEqual(worker.run_once(), {'completed': 0, 'failed': 1, 'retry': 0})
+        self.assertEqual(
+            dict(Transaction.objects.filter(pk__in=[declined.pk, flaky.pk]).values_list('pk', 'status')),
+            {declined.pk: 'failed', flaky.pk: 'failed'},
+        )
+        self.assertEqual(processor.calls, 3)
+
+    def test_expired_lease_is_retried_with_the_same_idempotency_key(self):
+        payment, = self.pending(1)
+        processor = FakeProcessor()
+        crashed = self.worker(processor, LEASE_SECONDS=30)
+        claimed = crashed.claim()
+        # The charge went through but the worker died before recording it.
+        asyncio.run(processor.charge(payment.reference_number, payment.amount))
+        self.assertEqual(self.worker(processor).run_once()['completed'], 0)  # still leased
+
+        self.clock.advance(31)
+        self.assertEqual(self.worker(processor).run_once()['completed'], 1)
+        payment.refresh_from_db()
+        self.assertEqual(len(processor.charges), 1)
+        self.assertEqual(payment.stripe_transaction_id, processor.charges[claimed[0].reference_number][0])
+
+
+def paid_ride(passenger, amount='15.07', status='completed', **fields):
+    ride = create_ride(passenger, status='completed', completed_at=timezone.now(), **fields)
+    Transaction.objects.create(
+        user_id=passenger.user_id, ride=ride, transaction_type='payment', status=status, amount=amount,
+        reference_number=f'ride-{ride.pk}-fare',
+    )
+    return ride
+
+
+@override_settings(PRICING={'VEHICLE_TYPES': RATES, 'TAX_RATE': 0.1, 'ROAD_FACTOR': 1.0, 'AVERAGE_SPEED_KMH': 60.0})
+class InvoiceTests(APITestCase):
+    def setUp(self):
+        pricing_tables.reset()
+        self.addCleanup(pricing_tables.reset)
+        self.passenger = create_passenger()
+
+    def test_builds_invoices_in_chunks_once(self):
+        rides = [paid_ride(self.passenger) for _ in range(5)]
+        create_ride(self.passenger, status='completed')  # not paid yet
+        paid_ride(self.passenger, status='failed')
+        create_ride(self.passenger, status='started')
+
+        self.assertEqual(build_invoices(chunk_size=2), (5, 2))
+        self.assertEqual(set(Invoice.objects.values_list('ride_id', flat=True)), {ride.pk for ride in rides})
+        self.assertEqual(build_invoices(chunk_size=2), (0, 2))
+
+    def test_pending_payments_and_concurrent_runs_are_not_counted(self):
+        pending = paid_ride(self.passenger, status='pending')
+        rides = [paid_ride(self.passenger) for _ in range(3)]
+        real = invoicing.price_invoices
+
+        def raced(chunk, payments):
+            # Another run invoices the same rides between pricing and insert.
+            Invoice.objects.bulk_create(real(chunk, payments))
+            return real(chunk, payments)
+
+        with mock.patch.object(invoicing, 'price_invoices', raced):
+            self.assertEqual(build_invoices(), (0, 4))
+        self.assertEqual(set(Invoice.objects.values_list('ride_id', flat=True)), {ride.pk for ride in rides})
+        self.assertFalse(Invoice.objects.filter(ride=pending).exists())
+
+    def test_components_follow_pricing_and_total_follows_charge(self):
+        ride = paid_ride(self.passenger, amount='30.00', surge_multiplier=2.0)
+        build_invoices()
+
+        invoice = Invoice.objects.get(ride=ride)
+        self.assertEqual(
+            (invoice.base_fare, invoice.distance_charge, invoice.time_charge, invoice.surge_multiplier, invoice.tax),
+            (Decimal('2.00'), Decimal('4.20'), Decimal('7.50'), 2.0, Decimal('2.74')),
+        )
+        self.assertEqual((invoice.discount, invoice.total_amount), (Decimal('0.14'), Decimal('30.00')))
+        self.assertEqual(invoice.transaction.ride_id, ride.pk)
+
+    def test_csv_export_streams_own_invoices(self):
+        for _ in range(3):
+            paid_ride(self.passenger)
+        paid_ride(create_passenger('other'))
+        build_invoices()
+        self.client.force_authenticate(self.passenger.user)
+
+        response = self.client.get('/api/invoices/csv/')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'ride_id', 'transaction_id'])
+        self.assertEqual(len(lines), 4)
+
+        response = self.client.get('/api/invoices/csv/', {'since': timezone.now() + timedelta(minutes=1)})
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 1)
+        self.assertEqual(self.client.get('/api/invoices/csv/', {'since': 'yesterday'}).status_code, 400)
+
+    def test_pdf_export_is_well_formed(self):
+        paid_ride(self.passenger)
+        build_invoices()
+        self.client.force_authenticate(self.passenger.user)
+
+        response = self.client.get('/api/invoices/pdf/')
+        body = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(body.startswith(b'%PDF-1.4'))
+        self.assertTrue(body.endswith(b'%%EOF\n'))
+        self.assertIn(b'/Count 1', body)
+
+    def test_pdf_pages_and_cross_references(self):
+        pages = list(paginate((f'line {n}' for n in range(160)), header=('title',), per_page=51))
+        self.assertEqual([len(page) for page in pages], [51, 51, 51, 11])
+        self.assertEqual(list(paginate([], header=('title',))), [['title']])
+
+        body = b''.join(stream_pdf(pages))
+        self.assertIn(b'/Count 4', body)
+        startxref = int(body.rsplit(b'startxref\n', 1)[1].split()[0])
+        self.assertTrue(body[startxref:].startswith(b'xref'))
+        for entry in body[startxref:].split(b'\n')[3:]:
+            if not entry.endswith(b' n '):
+                break
+            offset = int(entry[:10])
+            self.assertRegex(body[offset:offset + 12].decode(), r'^\d+ 0 obj')
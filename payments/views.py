@@ -1,3 +1,49 @@
-from django.shortcuts import render
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from payments.invoicing import invoice_csv, invoice_pdf, iter_invoices
+from payments.models import Invoice
+from payments.serializers import InvoiceSerializer
+from rideshare_backend.pagination import KeysetPagination
+from rideshare_backend.streaming import streaming_response
+from users.identity import request_identity
 
-# Create your views here.
+class InvoiceViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Invoice.objects.all()
+    serializer_class = InvoiceSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-issued_at', '-id')
+    
+    def get_queryset(self):
+        identity = request_identity(self.request)
+        if identity.is_staff:
+            return Invoice.objects.all()
+        return Invoice.objects.filter(transaction__user_id=identity.user_id)
+    
+    def export_queryset(self):
+        invoices = self.get_queryset()
+        for param, lookup in (('since', 'issued_at__gte'), ('until', 'issued_at__lt')):
+            value = self.request.query_params.get(param)
+            if not value:
+                continue
+            moment = parse_datetime(value)
+            if moment is None:
+                raise ValidationError({param: 'Expected an ISO 8601 datetime'})
+            if timezone.is_naive(moment):
+                moment = timezone.make_aware(moment)
+            invoices = invoices.filter(**{lookup: moment})
+        return invoices
+    
+    @action(detail=False, methods=['get'])
+    def csv(self, request):
+        rows = iter_invoices(self.export_queryset())
+        return streaming_response(request, invoice_csv(rows), 'text/csv', 'invoices.csv')
+    
+    @action(detail=False, methods=['get'])
+    def pdf(self, request):
+        rows = iter_invoices(self.export_queryset())
+        return streaming_response(request, invoice_pdf(rows), 'application/pdf', 'invoices.pdf')
@@ -0,0 +1,90 @@
+import asyncio
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.db.models import Q
+
+from rides.ingestion import ACTIVE_RIDE_STATUSES
+from rides.models import Ride
+from rides.realtime import driver_topic, get_broker, ride_status_payload, ride_topic
+from users.models import DriverProfile
+
+
+class RealtimeConsumer(AsyncJsonWebsocketConsumer):
+    """Base consumer: subscribes to one broker topic and forwards its messages."""
+
+    topic = None
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.topic, snapshot = await self.authorize(user)
+        if self.topic is None:
+            await self.close(code=4403)
+            return
+        self._tasks = set()
+        await get_broker().subscribe(self.topic, self)
+        await self.accept()
+        if snapshot is not None:
+            await self.send_json(snapshot)
+
+    async def disconnect(self, code):
+        if self.topic is not None:
+            await get_broker().unsubscribe(self.topic, self)
+
+    async def authorize(self, user):
+        raise NotImplementedError
+
+    def deliver_soon(self, message):
+        task = asyncio.ensure_future(self.send_json(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def realtime_message(self, event):
+        await self.send_json(event['message'])
+
+    async def receive_json(self, content, **kwargs):
+        if content.get('type') == 'ping':
+            await self.send_json({'type': 'pong'})
+
+
+class RideConsumer(RealtimeConsumer):
+    """``ws/rides/<ride_id>/``: status transitions and location deltas for one ride."""
+
+    async def authorize(self, user):
+        ride_id = self.scope['url_route']['kwargs']['ride_id']
+        ride = await database_sync_to_async(self._get_ride)(user, ride_id)
+        if ride is None:
+            return None, None
+        return ride_topic(ride.id), ride_status_payload(ride)
+
+    def _get_ride(self, user, ride_id):
+        return (
+            Ride.objects.filter(Q(passenger__user=user) | Q(driver__user=user), pk=ride_id)
+            .only('id', 'status', 'driver_id', 'vehicle_id', 'updated_at')
+            .first()
+        )
+
+
+class DriverConsumer(RealtimeConsumer):
+    """
+    ``ws/drivers/<driver_id>/``: assignments and position of one driver.
+
+    Open to the driver themself and to passengers with an active ride with them.
+    """
+
+    async def authorize(self, user):
+        driver_id = self.scope['url_route']['kwargs']['driver_id']
+        allowed = await database_sync_to_async(self._can_follow)(user, driver_id)
+        if not allowed:
+            return None, None
+        return driver_topic(driver_id), None
+
+    def _can_follow(self, user, driver_id):
+        if DriverProfile.objects.filter(pk=driver_id, user=user).exists():
+            return True
+        return Ride.objects.filter(
+            driver_id=driver_id, passenger__user=user, status__in=ACTIVE_RIDE_STATUSES,
+        ).exists()
@@ -0,0 +1,203 @@
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from drivers.spatial import KM_PER_DEGREE
+from rides.roadgraph import RoadGraph
+from users.identity import LocalLRU
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'GRAPH_FILE': None,
+    'CELL_SIZE_DEG': 0.001,
+    'MAX_SNAP_KM': 0.5,
+    'ACCESS_SPEED_KMH': 15.0,
+    'CACHE_SIZE': 200000,
+}
+
+
+def routing_settings():
+    return {**DEFAULTS, **getattr(settings, 'ROUTING', {})}
+
+
+class EtaService:
+    """
+    Road ETAs and distances between lat/lng points from a precomputed graph.
+
+    Points are snapped to grid cells of ``CELL_SIZE_DEG`` and each cell to
+    the road junction nearest its centre, so nearby points share one graph
+    query. Results between cells are kept in an LRU keyed on the ``(origin
+    cell, destination cell)`` pair; the straight walk from each point to
+    its cell's junction is added on top at ``ACCESS_SPEED_KMH``. Points
+    more than ``MAX_SNAP_KM`` from any junction, or with no route between
+    them, come back as NaN so callers can fall back to their own estimate.
+    The graph is read from ``GRAPH_FILE`` on first use; without one the
+    service is unavailable and every result is NaN.
+    """
+
+    def __init__(self, options=None, graph=None):
+        self.options = {**routing_settings(), **(options or {})}
+        self.cache = LocalLRU(self.options['CACHE_SIZE'], math.inf)
+        self._lock = threading.Lock()
+        self._graph = graph
+        self._loaded = graph is not None
+        self._grid = None
+        self._cells = {}
+        if graph is not None:
+            self._index(graph)
+
+    @property
+    def graph(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    path = self.options['GRAPH_FILE']
+                    if path and os.path.exists(path):
+                        self._index(RoadGraph.load(path))
+                        logger.info('Loaded road graph %s: %d junctions', path, len(self._graph))
+                    elif path:
+                        logger.warning('Road graph %s not found; using straight-line estimates', path)
+                    self._loaded = True
+        return self._graph
+
+    @property
+    def available(self):
+        return self.graph is not None
+
+    def _index(self, graph):
+        # Junctions bucketed into squares one snap radius wide, so a snap
+        # only looks at the 3x3 squares around the cell centre.
+        size = self.options['MAX_SNAP_KM'] / KM_PER_DEGREE
+        keys = np.floor(np.column_stack((graph.lat, graph.lng)) / size).astype(np.int64)
+        order = np.lexsort((keys[:, 1], keys[:, 0]))
+        squares, starts, counts = np.unique(keys[order], axis=0, return_index=True, return_counts=True)
+        self._grid = (size, {
+            (int(row), int(col)): order[start:start + count]
+            for (row, col), start, count in zip(squares, starts, counts)
+        })
+        self._cells = {}
+        self._graph = graph
+        self.cache.clear()
+
+    def cell_for(self, lat, lng):
+        size = self.options['CELL_SIZE_DEG']
+        return (math.floor(lat / size), math.floor(lng / size))
+
+    def _nearest(self, lat, lng):
+        size, squares = self._grid
+        row, col = math.floor(lat / size), math.floor(lng / size)
+        candidates = [
+            squares[square]
+            for square in ((row + dr, col + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1))
+            if square in squares
+        ]
+        if not candidates:
+            return None
+        candidates = np.concatenate(candidates)
+        dy = self._graph.lat[candidates] - lat
+        dx = (self._graph.lng[candidates] - lng) * math.cos(math.radians(lat))
+        km_sq = dy * dy + dx * dx
+        best = int(np.argmin(km_sq))
+        if math.sqrt(km_sq[best]) * KM_PER_DEGREE > self.options['MAX_SNAP_KM']:
+            return None
+        return int(candidates[best])
+
+    def snap(self, lat, lng):
+        """``(cell, junction, access seconds, access metres)`` for a point, or ``None`` off the network."""
+        if self.graph is None:
+            return None
+        cell = self.cell_for(lat, lng)
+        node = self._cells.get(cell, -1)
+        if node == -1:
+            size = self.options['CELL_SIZE_DEG']
+            node = self._cells[cell] = self._nearest((cell[0] + 0.5) * size, (cell[1] + 0.5) * size)
+        if node is None:
+            return None
+        dy = self._graph.lat[node] - lat
+        dx = (self._graph.lng[node] - lng) * math.cos(math.radians(lat))
+        metres = math.hypot(dy, dx) * KM_PER_DEGREE * 1000
+        return cell, node, metres / (self.options['ACCESS_SPEED_KMH'] / 3.6), metres
+
+    def _snap_all(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        return [self.snap(lat, lng) for lat, lng in points.tolist()]
+
+    def _lookup(self, pairs, solve):
+        # ``pairs`` are (origin snap, destination snap); misses are solved
+        # in one call and cached before the access legs are added.
+        seconds = np.full(len(pairs), np.nan)
+        metres = np.full(len(pairs), np.nan)
+        missing = {}
+        for position, (origin, destination) in enumerate(pairs):
+            if origin is None or destination is None:
+                continue
+            key = (origin[0], destination[0])
+            hit = self.cache.get(key)
+            if hit is None:
+                missing.setdefault(key, (origin[1], destination[1]))
+            else:
+                seconds[position], metres[position] = hit
+        if missing:
+            solved = dict(zip(missing, solve(list(missing.values()))))
+            for key, hit in solved.items():
+                self.cache.set(key, hit)
+            for position, (origin, destination) in enumerate(pairs):
+                hit = origin and destination and solved.get((origin[0], destination[0]))
+                if hit:
+                    seconds[position], metres[position] = hit
+        for position, (origin, destination) in enumerate(pairs):
+            if origin is not None and destination is not None:
+                seconds[position] += origin[2] + destination[2]
+                metres[position] += origin[3] + destination[3]
+        seconds[np.isinf(seconds)] = np.nan
+        metres[np.isinf(metres)] = np.nan
+        return seconds, metres
+
+    def _solve_pairs(self, nodes):
+        seconds, metres = self.graph.pairs([source for source, _ in nodes], [target for _, target in nodes])
+        return list(zip(seconds.tolist(), metres.tolist()))
+
+    def pairs(self, origins, destinations):
+        """``(seconds, metres)`` arrays for each ``origins[i] -> destinations[i]`` (``(n, 2)`` lat/lng)."""
+        return self._lookup(list(zip(self._snap_all(origins), self._snap_all(destinations))), self._solve_pairs)
+
+    def table(self, origins, destinations):
+        """
+        ``(seconds, metres)`` matrices from every origin to every destination.
+
+        Uncached cell pairs are solved with one many-to-many search over the
+        distinct junctions involved, which is what the dispatch path wants
+        for many drivers against many pickups.
+        """
+        origins, destinations = self._snap_all(origins), self._snap_all(destinations)
+
+        def solve(nodes):
+            sources = sorted({source for source, _ in nodes})
+            targets = sorted({target for _, target in nodes})
+            seconds, metres = self.graph.table(sources, targets)
+            rows = {source: row for row, source in enumerate(sources)}
+            columns = {target: column for column, target in enumerate(targets)}
+            return [
+                (float(seconds[rows[source], columns[target]]), float(metres[rows[source], columns[target]]))
+                for source, target in nodes
+            ]
+
+        pairs = [(origin, destination) for origin in origins for destination in destinations]
+        seconds, metres = self._lookup(pairs, solve)
+        shape = (len(origins), len(destinations))
+        return seconds.reshape(shape), metres.reshape(shape)
+
+    def eta(self, origin, destination):
+        """``(seconds, metres)`` between two ``(lat, lng)`` points, or ``None`` if either is off the network."""
+        seconds, metres = self.pairs([origin], [destination])
+        if np.isnan(seconds[0]):
+            return None
+        return float(seconds[0]), float(metres[0])
+
+
+eta_service = EtaService()
@@ -0,0 +1,198 @@
+import atexit
+import io
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from rides.models import Ride, RideLocation
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BUFFERED': True,
+    'MAX_BATCH': 2000,
+    'FLUSH_INTERVAL': 0.5,
+    'MAX_PENDING': 100000,
+    'RIDE_CACHE_TTL': 30.0,
+}
+
+ACTIVE_RIDE_STATUSES = ('requested', 'accepted', 'started')
+
+
+def ingestion_settings():
+    return {**DEFAULTS, **getattr(settings, 'GPS_INGESTION', {})}
+
+
+class IngestionBackpressure(Exception):
+    pass
+
+
+class LocationIngestor:
+    """
+    Buffers GPS pings in memory and writes them to ``RideLocation`` in batches.
+
+    Pings are flushed by a background thread whenever ``MAX_BATCH`` rows are
+    pending or ``FLUSH_INTERVAL`` seconds have passed. When ``MAX_PENDING``
+    rows are waiting, ``submit`` raises ``IngestionBackpressure`` so the API
+    can shed load instead of growing the buffer without bound. Pending rows
+    are written out on ``stop()`` and at interpreter exit.
+    """
+
+    def __init__(self, options=None, autostart=True):
+        self.options = {**ingestion_settings(), **(options or {})}
+        self.autostart = autostart
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._rides = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def active_ride(self, ride_id):
+        """Return ``(exists, driver_id)`` for an active ride, cached briefly."""
+        now = time.monotonic()
+        cached = self._rides.get(ride_id)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        row = Ride.objects.filter(pk=ride_id, status__in=ACTIVE_RIDE_STATUSES).values_list('driver_id').first()
+        result = (row is not None, row[0] if row else None)
+        if len(self._rides) > 100000:
+            self._rides.clear()
+        self._rides[ride_id] = (now + self.options['RIDE_CACHE_TTL'], result)
+        return result
+
+    def forget_ride(self, ride_id):
+        self._rides.pop(ride_id, None)
+
+    def submit(self, ride_id, latitude, longitude, timestamp=None):
+        row = (ride_id, float(latitude), float(longitude), timestamp or timezone.now())
+        with self._lock:
+            if len(self._pending) >= self.options['MAX_PENDING']:
+                raise IngestionBackpressure()
+            self._pending.append(row)
+            pending = len(self._pending)
+        if self.autostart:
+            self.start()
+        if pending >= self.options['MAX_BATCH']:
+            self._wakeup.set()
+
+    def _take_batch(self):
+        with self._lock:
+            count = min(len(self._pending), self.options['MAX_BATCH'])
+            return [self._pending.popleft() for _ in range(count)]
+
+    def _has_pending(self, ride_id):
+        # Under the lock: submit() appends from request threads meanwhile.
+        with self._lock:
+            return any(row[0] == ride_id for row in self._pending)
+
+    def flush(self, ride_id=None):
+        """Write every pending ping (or, with ``ride_id``, at least that ride's) to the database."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                if ride_id is not None and not self._has_pending(ride_id):
+                    break
+                batch = self._take_batch()
+                if not batch:
+                    break
+                try:
+                    self.write(batch)
+                except Exception:
+                    with self._lock:
+                        self._pending.extendleft(reversed(batch))
+                    raise
+                written += len(batch)
+        return written
+
+    def write(self, rows):
+        # A ride can be deleted while its pings sit in the buffer; drop those
+        # rather than letting one FK violation wedge every later batch.
+        ride_ids = {row[0] for row in rows}
+        existing = set(Ride.objects.filter(pk__in=ride_ids).values_list('pk', flat=True))
+        if len(existing) < len(ride_ids):
+            rows = [row for row in rows if row[0] in existing]
+        if rows:
+            self._write(rows)
+
+    def _write(self, rows):
+        opts = RideLocation._meta
+        table = connection.ops.quote_name(opts.db_table)
+        columns = ', '.join(
+            connection.ops.quote_name(opts.get_field(name).column)
+            for name in ('ride', 'latitude', 'longitude', 'timestamp')
+        )
+        with connection.cursor() as cursor:
+            raw = cursor.cursor
+            if connection.vendor == 'postgresql':
+                sql = f'COPY {table} ({columns}) FROM STDIN'
+                buffer = io.StringIO()
+                for ride_id, lat, lng, timestamp in rows:
+                    buffer.write(f'{ride_id}\t{lat!r}\t{lng!r}\t{timestamp.isoformat()}\n')
+                buffer.seek(0)
+                if hasattr(raw, 'copy_expert'):
+                    raw.copy_expert(sql, buffer)
+                else:
+                    with raw.copy(sql) as copy:
+                        copy.write(buffer.getvalue())
+            else:
+                # Skip model instances and per-batch SQL compilation; a plain
+                # executemany is what bulk_create would end up running anyway.
+                adapt = connection.ops.adapt_datetimefield_value
+                cursor.executemany(
+                    f'INSERT INTO {table} ({columns}) VALUES (%s, %s, %s, %s)',
+                    [(ride_id, lat, lng, adapt(timestamp)) for ride_id, lat, lng, timestamp in rows],
+                )
+
+    def _run(self):
+        interval = self.options['FLUSH_INTERVAL']
+        try:
+            while not self._stop.is_set():
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception('Failed to flush %d buffered GPS pings', len(self._pending))
+                    connection.close()
+        finally:
+            connection.close()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='gps-ingestion', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # Anything that arrived after the worker's last pass.
+        if self._pending:
+            self.flush()
+
+
+location_ingestor = LocationIngestor()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        location_ingestor.stop()
+    except Exception:
+        logger.exception('Dropped %d buffered GPS pings at shutdown', len(location_ingestor))
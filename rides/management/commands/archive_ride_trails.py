@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from rides.models import Ride, RideLocation
+from rides.trails import archive_ride_trail
+
+
+class Command(BaseCommand):
+    help = 'Fold RideLocation rows of finished rides into compact RideTrail blobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Archive at most this many rides')
+
+    def handle(self, *args, **options):
+        ride_ids = (
+            RideLocation.objects.filter(ride__status__in=['completed', 'cancelled'])
+            .values_list('ride_id', flat=True)
+            .distinct()
+            .order_by('ride_id')
+        )
+        if options['limit']:
+            ride_ids = ride_ids[:options['limit']]
+
+        rides = points = blob_bytes = 0
+        for ride in Ride.objects.filter(id__in=list(ride_ids)).iterator():
+            trail = archive_ride_trail(ride)
+            if trail is None:
+                continue
+            rides += 1
+            points += trail.point_count
+            blob_bytes += len(trail.data)
+
+        if not rides:
+            self.stdout.write('Nothing to archive')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {rides} rides: {points} points in {blob_bytes} bytes '
+            f'({blob_bytes / max(points, 1):.1f} bytes/point)'
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rideshare_backend.query_audit import audit
+
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN the queries behind every API list endpoint and the dispatch hot paths, and fail '
+        'if any of them reads a whole table instead of using an index.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plans', action='store_true', help='Print every plan, not just the flagged ones')
+
+    def handle(self, *args, **options):
+        plans = audit()
+        flagged = [plan for plan in plans if plan.seq_scans]
+        for plan in plans:
+            if not (plan.seq_scans or options['plans']):
+                continue
+            status = f'SEQ SCAN {", ".join(plan.seq_scans)}' if plan.seq_scans else 'ok'
+            self.stdout.write(f'{plan.label}: {status}')
+            self.stdout.write(f'  {plan.sql}')
+            for line in plan.plan:
+                self.stdout.write(f'    {line}')
+
+        if flagged:
+            raise CommandError(f'{len(flagged)} of {len(plans)} queries use a sequential scan')
+        self.stdout.write(f'{len(plans)} queries checked, no sequential scans')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from rides.ratings import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Rebuild rating aggregates and profile ratings from the Rating table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_rating_aggregates(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates for {rebuilt} users'))
@@ -0,0 +1,81 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rides.ingestion import LocationIngestor
+from rides.models import Ride, RideLocation
+from users.models import PassengerProfile, User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Load-test GPS ping ingestion: one INSERT per ping versus the buffered batch path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pings', type=int, default=50000)
+        parser.add_argument('--rides', type=int, default=200)
+        parser.add_argument('--unbuffered-pings', type=int, default=5000,
+                            help='The per-row path is slow; it is measured on a smaller sample')
+        parser.add_argument('--batch', type=int, default=2000)
+        parser.add_argument('--keep', action='store_true', help='Commit the synthetic rows instead of rolling back')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options)
+                if not options['keep']:
+                    raise Rollback()
+        except Rollback:
+            self.stdout.write('Synthetic data rolled back')
+
+    def _run(self, options):
+        rng = random.Random(42)
+        user = User.objects.create_user(
+            username=f'bench-gps-{time.time_ns()}', password=None, user_type='passenger',
+            phone_number=f'bench-{time.time_ns()}',
+        )
+        passenger = PassengerProfile.objects.create(user=user)
+        location = {'lat': 0.3476, 'lng': 32.5825}
+        rides = Ride.objects.bulk_create([
+            Ride(
+                passenger=passenger, pickup_location=location, dropoff_location=location, status='started',
+                estimated_distance=1, estimated_duration=1, estimated_fare=1,
+            )
+            for _ in range(options['rides'])
+        ])
+        ride_ids = [ride.id for ride in rides]
+
+        def pings(count):
+            for _ in range(count):
+                yield rng.choice(ride_ids), 0.3476 + rng.uniform(-0.1, 0.1), 32.5825 + rng.uniform(-0.1, 0.1)
+
+        # Before: what update_location used to do for every ping.
+        count = options['unbuffered_pings']
+        started = time.perf_counter()
+        for ride_id, lat, lng in pings(count):
+            ride = Ride.objects.get(id=ride_id)
+            RideLocation.objects.create(ride=ride, latitude=lat, longitude=lng)
+        before = count / (time.perf_counter() - started)
+
+        # After: cached ride check plus an in-memory append, flushed in batches.
+        ingestor = LocationIngestor(options={'MAX_BATCH': options['batch']}, autostart=False)
+        count = options['pings']
+        started = time.perf_counter()
+        for ride_id, lat, lng in pings(count):
+            ingestor.active_ride(ride_id)
+            ingestor.submit(ride_id, lat, lng)
+            if len(ingestor) >= options['batch']:
+                ingestor.flush()
+        ingestor.flush()
+        after = count / (time.perf_counter() - started)
+
+        stored = RideLocation.objects.filter(ride_id__in=ride_ids).count()
+        self.stdout.write(f'rows written: {stored}')
+        self.stdout.write(f'per-ping INSERT: {before:,.0f} pings/s')
+        self.stdout.write(f'buffered batch : {after:,.0f} pings/s')
+        self.stdout.write(self.style.SUCCESS(f'speedup: {after / before:.1f}x'))
@@ -0,0 +1,49 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from rides.matching import solve_assignment
+
+
+class Command(BaseCommand):
+    help = 'Benchmark one batch matching window on synthetic rides and drivers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rides', type=int, default=10000)
+        parser.add_argument('--drivers', type=int, default=12000)
+        parser.add_argument('--span-km', type=float, default=40.0, help='Side of the square city area')
+        parser.add_argument('--max-pickup-km', type=float, default=5.0)
+        parser.add_argument('--candidates', type=int, default=8)
+        parser.add_argument('--windows', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        center = np.array([0.3476, 32.5825])
+        half_span = options['span_km'] / 111.0 / 2
+
+        timings = []
+        for _ in range(options['windows']):
+            rides = center + rng.uniform(-half_span, half_span, size=(options['rides'], 2))
+            drivers = center + rng.uniform(-half_span, half_span, size=(options['drivers'], 2))
+            started = time.perf_counter()
+            ride_idx, driver_idx, km = solve_assignment(
+                rides, drivers,
+                max_pickup_km=options['max_pickup_km'],
+                candidates_per_ride=options['candidates'],
+            )
+            timings.append(time.perf_counter() - started)
+
+            assert len(set(ride_idx.tolist())) == len(ride_idx)
+            assert len(set(driver_idx.tolist())) == len(driver_idx)
+
+        timings.sort()
+        self.stdout.write(
+            f"{options['rides']} rides x {options['drivers']} drivers: "
+            f"matched {len(ride_idx)} (mean pickup {km.mean():.2f} km)"
+        )
+        self.stdout.write(
+            f'solve time: min={timings[0] * 1000:.1f} ms '
+            f'median={timings[len(timings) // 2] * 1000:.1f} ms max={timings[-1] * 1000:.1f} ms'
+        )
@@ -0,0 +1,101 @@
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from rides.models import Ride
+from rideshare_backend.pagination import KeysetPagination
+from users.models import PassengerProfile, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare OFFSET and keyset pagination on a passenger\'s ride history. Seeds bench_pagination '
+        'passengers with synthetic rides until the table holds --rides rows, then times fetching '
+        'pages at increasing depths both ways.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rides', type=int, default=10_000_000, help='Total rides to have in the table')
+        parser.add_argument('--passengers', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--depths', default='1,100,1000,10000,50000', help='Comma-separated page numbers')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        passengers = self.seed(options)
+        passenger = passengers[0]
+        history = Ride.objects.filter(passenger=passenger)
+        total = history.count()
+        size = options['page_size']
+        self.stdout.write(f'{Ride.objects.count()} rides, {total} for the measured passenger')
+
+        paginator = KeysetPagination()
+        paginator.page_size = size
+        paginator.ordering = paginator.default_ordering
+        factory = APIRequestFactory()
+        ordered = history.order_by(*paginator.ordering)
+        depths = sorted(int(depth) for depth in options['depths'].split(',') if int(depth) * size <= total)
+
+        for depth in depths:
+            offset = (depth - 1) * size
+            # A client walking pages would hold the cursor of the row just above this page.
+            cursor = None
+            if offset:
+                row = ordered.values('created_at', 'id')[offset - 1]
+                cursor = paginator.encode_cursor([row['created_at'].isoformat(), row['id']], False)
+            query = {} if cursor is None else {'cursor': cursor}
+
+            offset_ms = self.time(lambda: list(ordered[offset:offset + size]), options['repeat'])
+            keyset_ms = self.time(
+                lambda: paginator.paginate_queryset(history, Request(factory.get('/api/rides/', query))),
+                options['repeat'],
+            )
+            self.stdout.write(f'page {depth:>6}: OFFSET {offset_ms:8.2f} ms   keyset {keyset_ms:8.2f} ms')
+
+    def time(self, fetch, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fetch()
+            timings.append((time.perf_counter() - started) * 1000)
+        return float(np.median(timings))
+
+    def seed(self, options):
+        passengers = []
+        for i in range(options['passengers']):
+            user, _ = User.objects.get_or_create(
+                username=f'bench_pagination_{i}',
+                defaults={'user_type': 'passenger', 'phone_number': f'+000bench_pagination_{i}'},
+            )
+            passengers.append(PassengerProfile.objects.get_or_create(user=user)[0])
+
+        missing = options['rides'] - Ride.objects.count()
+        if missing <= 0:
+            return passengers
+        self.stdout.write(f'Seeding {missing} rides...')
+        batch = options['batch_size']
+        for offset in range(0, missing, batch):
+            Ride.objects.bulk_create([
+                Ride(
+                    passenger=random.choice(passengers),
+                    status='completed',
+                    pickup_location={'lat': 0.3476, 'lng': 32.5825},
+                    dropoff_location={'lat': 0.3136, 'lng': 32.5811},
+                    estimated_distance=4.2,
+                    estimated_duration=15,
+                    estimated_fare='12000.00',
+                )
+                for _ in range(offset, min(offset + batch, missing))
+            ])
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE rides_ride')
+        return passengers
@@ -0,0 +1,101 @@
+import heapq
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+
+from payments.surge import SimulatedClock
+from rides.scheduler import RideScheduler
+
+
+class RecordingScheduler(RideScheduler):
+    """Notes when each ride is released instead of touching the database."""
+
+    def __init__(self, *args, expected=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expected = expected or {}
+        self.lateness = []
+        self.done = threading.Event()
+
+    def release(self, ride_ids):
+        now = time.time()
+        self.lateness.extend((now - self.expected[ride_id]) * 1000 for ride_id in ride_ids)
+        if len(self.lateness) >= len(self.expected):
+            self.done.set()
+        return ride_ids
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the scheduled-ride heap: memory, push/pop rate and release accuracy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rides', type=int, default=1_000_000)
+        parser.add_argument('--timed-rides', type=int, default=500)
+        parser.add_argument('--spread', type=float, default=5.0,
+                            help='Seconds over which the timed rides fall due')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        count = options['rides']
+        clock = SimulatedClock(datetime(2030, 1, 1, tzinfo=dt_timezone.utc).timestamp())
+        start = datetime.fromtimestamp(clock(), tz=dt_timezone.utc)
+        pairs = [(ride_id, start + timedelta(seconds=rng.uniform(0, 7 * 86400))) for ride_id in range(1, count + 1)]
+
+        # Before: the same heap holding (release_time, ride_id) tuples.
+        tracemalloc.start()
+        tuples = [(scheduled_time.timestamp(), ride_id) for ride_id, scheduled_time in pairs]
+        heapq.heapify(tuples)
+        tuple_bytes = tracemalloc.get_traced_memory()[0]
+        del tuples
+        tracemalloc.stop()
+
+        scheduler = RideScheduler({'MAX_BATCH': count}, clock=clock)
+        tracemalloc.start()
+        scheduler.load(pairs)
+        packed_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        self.stdout.write(f'{count:,} pending rides as tuples    : {tuple_bytes / 2**20:,.1f} MiB')
+        self.stdout.write(f'{count:,} pending rides as packed ints: {packed_bytes / 2**20:,.1f} MiB')
+
+        scheduler = RideScheduler({'MAX_BATCH': count}, clock=clock)
+        started = time.perf_counter()
+        for ride_id, scheduled_time in pairs:
+            scheduler.schedule(ride_id, scheduled_time)
+        pushes = count / (time.perf_counter() - started)
+        for ride_id in range(1, count + 1, 10):
+            scheduler.cancel(ride_id)
+        clock.advance(8 * 86400)
+        started = time.perf_counter()
+        popped = len(scheduler.pop_due())
+        pops = count / (time.perf_counter() - started)
+        self.stdout.write(f'schedule: {pushes:,.0f} rides/s')
+        self.stdout.write(f'pop due : {pops:,.0f} rides/s ({popped:,} released, {count - popped:,} cancelled)')
+
+        # Release accuracy on the real clock with the background thread.
+        lead = 600.0
+        now = time.time()
+        expected = {
+            ride_id: now + 0.2 + rng.uniform(0, options['spread'])
+            for ride_id in range(1, options['timed_rides'] + 1)
+        }
+        scheduler = RecordingScheduler({'LEAD_SECONDS': lead}, expected=expected)
+        scheduler.start()
+        for ride_id, release_at in expected.items():
+            scheduler.schedule(ride_id, datetime.fromtimestamp(release_at + lead, tz=dt_timezone.utc))
+        scheduler.done.wait(options['spread'] + 10)
+        scheduler.stop(timeout=5)
+
+        lateness = sorted(scheduler.lateness)
+        if not lateness:
+            self.stdout.write(self.style.ERROR('no rides were released'))
+            return
+        p99 = lateness[min(len(lateness) - 1, int(len(lateness) * 0.99))]
+        self.stdout.write(f'released {len(lateness)}/{len(expected)} timed rides')
+        self.stdout.write(
+            f'lateness ms: median {statistics.median(lateness):.2f}, p99 {p99:.2f}, max {lateness[-1]:.2f}'
+        )
+        self.stdout.write(self.style.SUCCESS(f'memory saved: {1 - packed_bytes / tuple_bytes:.0%}'))
@@ -0,0 +1,137 @@
+import heapq
+import math
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from drivers.spatial import KM_PER_DEGREE
+from rides.eta import EtaService
+from rides.roadgraph import RoadGraph, read_osm, simplify_ways
+
+# km/h for local streets, every 5th line and every 10th line of the grid.
+LOCAL, COLLECTOR, ARTERIAL = 25.0, 40.0, 60.0
+
+
+def synthetic_city(size, rng, block_m=120.0, origin=(0.3476, 32.5825)):
+    """A jittered ``size`` x ``size`` street grid with faster arterials, some one-way and missing blocks."""
+    deg_lat = block_m / 1000 / KM_PER_DEGREE
+    deg_lng = deg_lat / math.cos(math.radians(origin[0]))
+    rows, cols = np.divmod(np.arange(size * size), size)
+    lat = origin[0] + (rows + np.array([rng.uniform(-0.15, 0.15) for _ in rows])) * deg_lat
+    lng = origin[1] + (cols + np.array([rng.uniform(-0.15, 0.15) for _ in cols])) * deg_lng
+    edges = []
+    for row in range(size):
+        for col in range(size):
+            for line, (dr, dc) in ((row, (0, 1)), (col, (1, 0))):
+                if row + dr >= size or col + dc >= size:
+                    continue
+                speed = ARTERIAL if line % 10 == 0 else COLLECTOR if line % 5 == 0 else LOCAL
+                if speed == LOCAL and rng.random() < 0.1:
+                    continue
+                u, v = row * size + col, (row + dr) * size + col + dc
+                metres = block_m * rng.uniform(0.95, 1.1)
+                edges.append((u, v, metres / (speed / 3.6), metres))
+                if speed != LOCAL or rng.random() >= 0.15:
+                    edges.append((v, u, metres / (speed / 3.6), metres))
+    edges = np.array(edges)
+    return lat, lng, edges[:, 0].astype(np.int32), edges[:, 1].astype(np.int32), edges[:, 2], edges[:, 3]
+
+
+def dijkstra(adjacency, source, target):
+    best = {source: 0.0}
+    heap = [(0.0, source)]
+    while heap:
+        cost, node = heapq.heappop(heap)
+        if node == target:
+            return cost
+        if cost > best[node]:
+            continue
+        for nxt, seconds in adjacency[node]:
+            if cost + seconds < best.get(nxt, math.inf):
+                best[nxt] = cost + seconds
+                heapq.heappush(heap, (cost + seconds, nxt))
+    return math.inf
+
+
+class Command(BaseCommand):
+    help = 'Benchmark road ETAs: contraction build, point-to-point and many-to-many queries, and the cell cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=200, help='Synthetic city is size x size junctions')
+        parser.add_argument('--osm', help='Benchmark an OSM XML extract instead of the synthetic city')
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('--baseline-queries', type=int, default=100,
+                            help='Plain Dijkstra is slow; it is measured on a smaller sample')
+        parser.add_argument('--table', type=int, default=200, help='Origins and destinations in the many-to-many run')
+        parser.add_argument('--witness-limit', type=int, default=60)
+        parser.add_argument('--windows', type=int, default=20, help='Quote windows replayed to warm the cache')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        started = time.perf_counter()
+        if options['osm']:
+            lat, lng, src, dst, seconds, metres = simplify_ways(*read_osm(options['osm']))
+        else:
+            lat, lng, src, dst, seconds, metres = synthetic_city(options['size'], rng)
+        graph = RoadGraph.build(lat, lng, src, dst, seconds, metres, max_settled=options['witness_limit'])
+        build = time.perf_counter() - started
+        raw_bytes = lat.nbytes + lng.nbytes + len(src) * (4 + 4 + 4 + 4) + (len(lat) + 1) * 8
+        self.stdout.write(
+            f'graph: {len(graph):,} junctions, {len(src):,} road edges -> {graph.edge_count:,} contracted edges'
+        )
+        self.stdout.write(
+            f'build: {build:.1f} s, arrays {graph.nbytes / 2**20:.1f} MiB (plain CSR {raw_bytes / 2**20:.1f} MiB)'
+        )
+
+        adjacency = [[] for _ in range(len(lat))]
+        for u, v, cost in zip(src.tolist(), dst.tolist(), seconds.tolist()):
+            adjacency[u].append((v, cost))
+        queries = [(rng.randrange(len(lat)), rng.randrange(len(lat))) for _ in range(options['queries'])]
+
+        sample = queries[:options['baseline_queries']]
+        started = time.perf_counter()
+        expected = [dijkstra(adjacency, source, target) for source, target in sample]
+        baseline = (time.perf_counter() - started) / len(sample)
+        started = time.perf_counter()
+        routed = [graph.route(source, target)[0] for source, target in queries]
+        hierarchy = (time.perf_counter() - started) / len(queries)
+        wrong = sum(1 for want, got in zip(expected, routed) if not math.isclose(want, got, rel_tol=1e-4))
+        self.stdout.write(f'point-to-point: Dijkstra {baseline * 1000:.2f} ms, contracted {hierarchy * 1000:.3f} ms '
+                          f'({baseline / hierarchy:.0f}x), {wrong} mismatches in {len(sample)}')
+
+        count = options['table']
+        sources = [rng.randrange(len(lat)) for _ in range(count)]
+        targets = [rng.randrange(len(lat)) for _ in range(count)]
+        started = time.perf_counter()
+        graph.table(sources, targets)
+        table = time.perf_counter() - started
+        self.stdout.write(f'many-to-many {count}x{count}: {table * 1000:.0f} ms '
+                          f'({table / count ** 2 * 1e6:.1f} us per pair)')
+
+        # Quote-like traffic: trips start and end around a few dozen popular
+        # places, so (origin cell, destination cell) pairs repeat over time.
+        service = EtaService(graph=graph)
+        places = [(lat[node], lng[node]) for node in rng.sample(range(len(lat)), 50)]
+
+        def points(n):
+            return np.array([
+                (place[0] + rng.gauss(0, 0.0005), place[1] + rng.gauss(0, 0.0005))
+                for place in (rng.choice(places) for _ in range(n))
+            ])
+
+        origins, destinations = points(options['queries']), points(options['queries'])
+        for label in ('cold', 'warm'):
+            started = time.perf_counter()
+            service.pairs(origins, destinations)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{label} cache: {len(origins)} trips in {elapsed * 1000:.0f} ms '
+                              f'({elapsed / len(origins) * 1e6:.0f} us per trip)')
+
+        for window in range(options['windows']):
+            cached = len(service.cache._entries)
+            service.pairs(points(options['queries']), points(options['queries']))
+        misses = len(service.cache._entries) - cached
+        self.stdout.write(f'cell-pair cache hit rate after {options["windows"]} more windows: '
+                          f'{1 - misses / options["queries"]:.0%}')
@@ -0,0 +1,93 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from rides.models import Ride, RideLocation
+from rides.serializers import RideListSerializer, RideSerializer
+from rideshare_backend.encoding import (
+    MessagePackParser, MessagePackRenderer, ORJSONParser, ORJSONRenderer, msgpack,
+)
+
+
+def sample_ride(rng, ride_id, pings):
+    """An unsaved completed ride with ``pings`` GPS points, shaped like production rows."""
+    started = timezone.now() - datetime.timedelta(minutes=rng.uniform(20, 600))
+    lat, lng = 0.3476 + rng.uniform(-0.05, 0.05), 32.5825 + rng.uniform(-0.05, 0.05)
+    ride = Ride(
+        id=ride_id, passenger_id=rng.randrange(1, 10000), driver_id=rng.randrange(1, 2000),
+        vehicle_id=rng.randrange(1, 2000), status='completed', vehicle_type='economy',
+        pickup_location={'lat': lat, 'lng': lng, 'address': 'Kampala Road'},
+        dropoff_location={'lat': lat - 0.03, 'lng': lng + 0.01, 'address': 'Kabalagala'},
+        estimated_distance=round(rng.uniform(1, 20), 2), estimated_duration=rng.randrange(5, 60),
+        estimated_fare=Decimal(rng.randrange(300000, 5000000)) / 100, surge_multiplier=Decimal('1.25'),
+        actual_fare=Decimal(rng.randrange(300000, 5000000)) / 100,
+        started_at=started, completed_at=started + datetime.timedelta(minutes=18),
+        created_at=started - datetime.timedelta(minutes=4), updated_at=started + datetime.timedelta(minutes=18),
+    )
+    ride._prefetched_objects_cache = {'locations': [
+        RideLocation(
+            id=ride_id * 10000 + i, ride_id=ride_id, latitude=lat - i * 0.00005, longitude=lng + i * 0.00002,
+            timestamp=started + datetime.timedelta(seconds=2 * i),
+        )
+        for i in range(pings)
+    ]}
+    return ride
+
+
+class Command(BaseCommand):
+    help = (
+        'Time DRF stdlib JSON against orjson (and MessagePack when installed) on ride payloads: '
+        'a list page, a ride with its GPS points, and a GPS ping body. No database needed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--pings', type=int, default=600, help='GPS points in the ride detail payload')
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def timed(self, repeat, func):
+        func()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        return (time.perf_counter() - started) / repeat * 1e6, result
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        repeat = options['repeat']
+        rides = [sample_ride(rng, i + 1, 0) for i in range(options['page_size'])]
+        detail = sample_ride(rng, 999, options['pings'])
+
+        # Serializer cost for context: encoding only starts after this.
+        serialize_us, page = self.timed(
+            repeat, lambda: {'next': None, 'previous': None, 'results': RideListSerializer(rides, many=True).data},
+        )
+        detail_us, ride = self.timed(max(1, repeat // 10), lambda: RideSerializer(detail).data)
+        self.stdout.write(
+            f'serializer: list page {serialize_us:,.0f} us, ride with {options["pings"]} points {detail_us:,.0f} us'
+        )
+
+        encoders = [('stdlib json', JSONRenderer(), JSONParser()), ('orjson', ORJSONRenderer(), ORJSONParser())]
+        if msgpack is not None:
+            encoders.append(('msgpack', MessagePackRenderer(), MessagePackParser()))
+        ping = {'ride_id': 123456, 'latitude': 0.347612, 'longitude': 32.582517}
+
+        for label, payload in ((f'list page of {len(rides)}', page), (f'ride with {options["pings"]} points', ride),
+                               ('gps ping', ping)):
+            self.stdout.write(label)
+            baseline = None
+            for name, renderer, parser in encoders:
+                render_us, body = self.timed(repeat, lambda: renderer.render(payload))
+                parse_us, _ = self.timed(repeat, lambda: parser.parse(BytesIO(body), parser.media_type, {}))
+                baseline = baseline or (render_us, parse_us)
+                self.stdout.write(
+                    f'  {name:<12} render {render_us:9,.1f} us ({baseline[0] / render_us:4.1f}x)   '
+                    f'parse {parse_us:9,.1f} us ({baseline[1] / parse_us:4.1f}x)   {len(body):9,} bytes'
+                )
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.eta import routing_settings
+from rides.roadgraph import RoadGraph, read_osm, simplify_ways
+
+
+class Command(BaseCommand):
+    help = 'Build the contracted road graph used for ETAs from an OSM XML extract (convert .pbf with osmium cat)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('osm', help='Path to an .osm XML extract')
+        parser.add_argument('--out', help="Graph file to write; defaults to ROUTING['GRAPH_FILE']")
+        parser.add_argument('--witness-limit', type=int, default=60,
+                            help='Nodes a witness search may settle; higher means fewer shortcuts but a slower build')
+
+    def handle(self, *args, **options):
+        out = options['out'] or routing_settings()['GRAPH_FILE']
+        if not out:
+            raise CommandError("Pass --out or set ROUTING['GRAPH_FILE']")
+
+        started = time.perf_counter()
+        ways, coords = read_osm(options['osm'])
+        lat, lng, src, dst, seconds, metres = simplify_ways(ways, coords)
+        self.stdout.write(
+            f'Read {len(ways)} drivable ways: {len(lat)} junctions, {len(src)} road edges '
+            f'({len(coords)} nodes before simplifying) in {time.perf_counter() - started:.1f} s'
+        )
+
+        started = time.perf_counter()
+        graph = RoadGraph.build(lat, lng, src, dst, seconds, metres, max_settled=options['witness_limit'])
+        graph.save(out)
+        self.stdout.write(
+            f'Contracted to {graph.edge_count} edges ({graph.nbytes / 2**20:.1f} MiB) '
+            f'in {time.perf_counter() - started:.1f} s; wrote {out}'
+        )
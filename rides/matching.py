@@ -0,0 +1,240 @@
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from drivers.presence import driver_presence
+from drivers.spatial import KM_PER_DEGREE, driver_index, location_coords
+from rides.eta import eta_service
+from rides.models import Ride
+from rides.state import RideConflict, transition
+from users.models import Vehicle
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'WINDOW_SECONDS': 2.0,
+    'MAX_PICKUP_KM': 5.0,
+    'CANDIDATES_PER_RIDE': 8,
+    'AVERAGE_SPEED_KMH': 30.0,
+    'MAX_RIDES_PER_WINDOW': 20000,
+    'ROAD_ETA': True,
+}
+
+
+def matching_settings():
+    return {**DEFAULTS, **getattr(settings, 'RIDE_MATCHING', {})}
+
+
+def solve_assignment(ride_points, driver_points, max_pickup_km=5.0, candidates_per_ride=8, edge_cost=None):
+    """
+    Greedy minimum-cost assignment of rides to drivers.
+
+    ``ride_points`` and ``driver_points`` are ``(n, 2)`` arrays of lat/lng.
+    Both sides are bucketed into tiles at least ``max_pickup_km`` wide, so a
+    ride only needs a dense distance block against the drivers in its own
+    and the eight neighbouring tiles. Each ride keeps its nearest
+    ``candidates_per_ride`` drivers and the resulting edges are assigned
+    globally, shortest first. Returns ``(ride_idx, driver_idx, km)`` arrays.
+
+    ``edge_cost(ride_idx, driver_idx, km)`` can re-cost the candidate edges,
+    e.g. with road ETAs; they are then assigned cheapest first and the
+    third array holds that cost instead of km.
+    """
+    ride_points = np.asarray(ride_points, dtype=np.float64).reshape(-1, 2)
+    driver_points = np.asarray(driver_points, dtype=np.float64).reshape(-1, 2)
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+    if not len(ride_points) or not len(driver_points):
+        return empty
+
+    cos_lat = max(math.cos(math.radians(float(np.abs(ride_points[:, 0]).max()))), 1e-6)
+    tile_deg = max_pickup_km / KM_PER_DEGREE / cos_lat
+
+    ride_tiles = np.floor(ride_points / tile_deg).astype(np.int64)
+    driver_tiles = np.floor(driver_points / tile_deg).astype(np.int64)
+
+    driver_order = np.lexsort((driver_tiles[:, 1], driver_tiles[:, 0]))
+    sorted_tiles = driver_tiles[driver_order]
+    unique_tiles, starts, counts = np.unique(sorted_tiles, axis=0, return_index=True, return_counts=True)
+    tile_slices = {
+        (int(row), int(col)): driver_order[start:start + count]
+        for (row, col), start, count in zip(unique_tiles, starts, counts)
+    }
+
+    ride_order = np.lexsort((ride_tiles[:, 1], ride_tiles[:, 0]))
+    ride_groups, ride_starts = np.unique(ride_tiles[ride_order], axis=0, return_index=True)
+    ride_ends = np.append(ride_starts[1:], len(ride_order))
+
+    edge_rides, edge_drivers, edge_km = [], [], []
+    for (row, col), start, end in zip(ride_groups, ride_starts, ride_ends):
+        row, col = int(row), int(col)
+        neighbours = [
+            tile_slices[tile]
+            for tile in ((row + dr, col + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1))
+            if tile in tile_slices
+        ]
+        if not neighbours:
+            continue
+        candidates = np.concatenate(neighbours)
+        rides = ride_order[start:end]
+
+        # Squared equirectangular distances in degrees; the square root is
+        # only taken for the handful of candidates each ride keeps.
+        r = ride_points[rides]
+        d = driver_points[candidates]
+        dy = np.subtract.outer(r[:, 0], d[:, 0]).astype(np.float32)
+        dx = np.subtract.outer(r[:, 1], d[:, 1]).astype(np.float32)
+        dx *= np.cos(np.radians(r[:, 0])).astype(np.float32)[:, None]
+        dx *= dx
+        dy *= dy
+        dx += dy
+        km_sq = dx
+
+        keep = min(candidates_per_ride, len(candidates))
+        if keep < len(candidates):
+            nearest = np.argpartition(km_sq, keep - 1, axis=1)[:, :keep]
+        else:
+            nearest = np.broadcast_to(np.arange(len(candidates)), km_sq.shape)
+        nearest_km = np.sqrt(np.take_along_axis(km_sq, nearest, axis=1).astype(np.float64)) * KM_PER_DEGREE
+        within = nearest_km <= max_pickup_km
+
+        edge_rides.append(np.broadcast_to(rides[:, None], nearest.shape)[within])
+        edge_drivers.append(candidates[nearest][within])
+        edge_km.append(nearest_km[within])
+
+    if not edge_rides:
+        return empty
+    edge_rides = np.concatenate(edge_rides)
+    edge_drivers = np.concatenate(edge_drivers)
+    edge_km = np.concatenate(edge_km)
+    if edge_cost is not None:
+        edge_km = np.asarray(edge_cost(edge_rides, edge_drivers, edge_km), dtype=np.float64)
+
+    order = np.argsort(edge_km, kind='stable')
+    ride_taken = np.zeros(len(ride_points), dtype=bool)
+    driver_taken = np.zeros(len(driver_points), dtype=bool)
+    chosen = []
+    for edge, ride, driver in zip(order.tolist(), edge_rides[order].tolist(), edge_drivers[order].tolist()):
+        if ride_taken[ride] or driver_taken[driver]:
+            continue
+        ride_taken[ride] = driver_taken[driver] = True
+        chosen.append(edge)
+
+    chosen = np.asarray(chosen, dtype=np.int64)
+    return edge_rides[chosen], edge_drivers[chosen], edge_km[chosen]
+
+
+class MatchingEngine:
+    """Collects open rides each window and assigns them to available drivers in one batch."""
+
+    def __init__(self, index=driver_index, options=None, presence=None, eta=eta_service):
+        self.index = index
+        self.presence = presence
+        self.eta = eta
+        self.options = {**matching_settings(), **(options or {})}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def open_rides(self):
+        # Scheduled rides only become requested once the scheduler releases them.
+        return list(
+            Ride.objects.filter(status='requested', driver__isnull=True)
+            .order_by('created_at')
+            .values_list('id', 'pickup_location', 'vehicle_type')[:self.options['MAX_RIDES_PER_WINDOW']]
+        )
+
+    def run_window(self):
+        # A ride is only offered to drivers of its vehicle type, so each
+        # type is assigned on its own.
+        rides = {}
+        for ride_id, pickup, vehicle_type in self.open_rides():
+            coords = location_coords(pickup)
+            if coords is not None:
+                rides.setdefault(vehicle_type, []).append((ride_id, coords))
+        drivers = {}
+        for driver_id, (lat, lng, vehicle_type) in self.index.drivers().items():
+            drivers.setdefault(vehicle_type, []).append((driver_id, (lat, lng)))
+        proposals = []
+        for vehicle_type, waiting in rides.items():
+            if vehicle_type in drivers:
+                proposals.extend(self.assign(waiting, drivers[vehicle_type]))
+        if not proposals:
+            return []
+        return self.commit(proposals)
+
+    def assign(self, rides, drivers):
+        """``(ride_id, driver_id, eta_minutes)`` proposals for ``(id, (lat, lng))`` rides and drivers."""
+        ride_points = np.array([coords for _, coords in rides], dtype=np.float64)
+        driver_points = np.array([coords for _, coords in drivers], dtype=np.float64)
+        speed = self.options['AVERAGE_SPEED_KMH']
+
+        def pickup_minutes(ride_idx, driver_idx, km):
+            # Driver-to-pickup road ETAs; pairs off the road graph keep the straight-line guess.
+            seconds, _ = self.eta.pairs(driver_points[driver_idx], ride_points[ride_idx])
+            return np.where(np.isnan(seconds), km * 60 / speed, seconds / 60)
+
+        by_road = self.options['ROAD_ETA'] and self.eta is not None and self.eta.available
+        ride_idx, driver_idx, cost = solve_assignment(
+            ride_points, driver_points,
+            max_pickup_km=self.options['MAX_PICKUP_KM'],
+            candidates_per_ride=self.options['CANDIDATES_PER_RIDE'],
+            edge_cost=pickup_minutes if by_road else None,
+        )
+        eta_minutes = cost if by_road else cost * 60 / speed
+        return [
+            (rides[r][0], drivers[d][0], minutes)
+            for r, d, minutes in zip(ride_idx.tolist(), driver_idx.tolist(), eta_minutes.tolist())
+        ]
+
+    def commit(self, proposals):
+        vehicles = dict(
+            Vehicle.objects.filter(driver_id__in=[driver_id for _, driver_id, _ in proposals], is_active=True)
+            .values_list('driver_id', 'id')
+        )
+        assigned = []
+        for ride_id, driver_id, eta_minutes in proposals:
+            try:
+                transition(
+                    Ride(id=ride_id, status='requested'), 'accept',
+                    driver_id=driver_id, vehicle_id=vehicles.get(driver_id),
+                )
+            except RideConflict:
+                # Cancelled or taken since this window read it.
+                continue
+            if self.presence is not None:
+                self.presence.set_busy(driver_id, True)
+            else:
+                self.index.remove(driver_id)
+            assigned.append((ride_id, driver_id, eta_minutes))
+        return assigned
+
+    def run_forever(self):
+        window = self.options['WINDOW_SECONDS']
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                assigned = self.run_window()
+                if assigned:
+                    logger.info('Matched %d rides in %.0f ms', len(assigned), (time.monotonic() - started) * 1000)
+            except Exception:
+                logger.exception('Matching window failed')
+            self._stop.wait(max(0.0, window - (time.monotonic() - started)))
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='ride-matching', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+matching_engine = MatchingEngine(index=driver_presence.index, presence=driver_presence)
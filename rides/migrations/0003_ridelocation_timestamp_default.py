@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:42
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ridelocation',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0003_ridelocation_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideTrail',
+            fields=[
+                ('ride', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trail', serialize=False, to='rides.ride')),
+                ('point_count', models.IntegerField(default=0)),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('data', models.BinaryField(help_text='Delta-encoded points, see rides.trails')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
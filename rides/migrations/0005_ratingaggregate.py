@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0004_ridetrail'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingAggregate',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_aggregate', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('rating_sum', models.BigIntegerField(default=0)),
+                ('rating_count', models.IntegerField(default=0)),
+                ('recent', models.JSONField(blank=True, default=list, help_text='Most recent ratings, oldest first')),
+                ('recent_sum', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
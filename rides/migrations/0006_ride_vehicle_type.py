@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0005_ratingaggregate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='vehicle_type',
+            field=models.CharField(choices=[('economy', 'Economy'), ('comfort', 'Comfort'), ('premium', 'Premium')], default='economy', max_length=50),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0006_ride_vehicle_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='surge_multiplier',
+            field=models.FloatField(default=1.0),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0007_ride_surge_multiplier'),
+        ('users', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['-created_at', '-id'], name='rating_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['passenger', '-created_at', '-id'], name='ride_passenger_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['driver', '-created_at', '-id'], name='ride_driver_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ridelocation',
+            index=models.Index(fields=['ride', 'timestamp', 'id'], name='ridelocation_ride_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ridelocation',
+            index=models.Index(fields=['timestamp', 'id'], name='ridelocation_time_idx'),
+        ),
+    ]
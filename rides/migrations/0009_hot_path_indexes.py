@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0008_keyset_pagination_indexes'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(condition=models.Q(('status', 'requested')), fields=['created_at'], name='ride_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(condition=models.Q(('status__in', ['accepted', 'started'])), fields=['driver'], name='ride_active_driver_idx'),
+        ),
+    ]
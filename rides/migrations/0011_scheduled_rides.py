@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:55
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def hold_future_rides(apps, schema_editor):
+    Ride = apps.get_model('rides', 'Ride')
+    # The scheduler loads these at startup and releases any already within the lead time.
+    Ride.objects.filter(status='requested', driver__isnull=True, scheduled_time__gt=timezone.now()).update(
+        status='scheduled',
+    )
+
+
+def requeue_held_rides(apps, schema_editor):
+    Ride = apps.get_model('rides', 'Ride')
+    Ride.objects.filter(status='scheduled').update(status='requested')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0010_ride_updated_index'),
+        ('users', '0002_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ride',
+            name='status',
+            field=models.CharField(choices=[('scheduled', 'Scheduled'), ('requested', 'Requested'), ('accepted', 'Accepted'), ('started', 'Started'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], default='requested', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(condition=models.Q(('status', 'scheduled')), fields=['scheduled_time'], name='ride_scheduled_idx'),
+        ),
+        migrations.RunPython(hold_future_rides, requeue_held_rides),
+    ]
@@ -1,9 +1,11 @@
 from django.db import models
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 from users.models import User, DriverProfile, PassengerProfile, Vehicle
 
 class Ride(models.Model):
     STATUS_CHOICES = (
+        ('scheduled', 'Scheduled'),
         ('requested', 'Requested'),
         ('accepted', 'Accepted'),
         ('started', 'Started'),
@@ -11,6 +13,12 @@ class Ride(models.Model):
         ('cancelled', 'Cancelled'),
     )
     
+    VEHICLE_TYPE_CHOICES = (
+        ('economy', 'Economy'),
+        ('comfort', 'Comfort'),
+        ('premium', 'Premium'),
+    )
+    
     passenger = models.ForeignKey(PassengerProfile, on_delete=models.CASCADE, related_name='rides')
     driver = models.ForeignKey(DriverProfile, on_delete=models.SET_NULL, null=True, blank=True, related_name='rides')
     vehicle = models.ForeignKey(Vehicle, on_delete=models.SET_NULL, null=True, blank=True)
@@ -19,10 +27,12 @@ class Ride(models.Model):
     dropoff_location = models.JSONField()  # {lat, lng, address}
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='requested')
+    vehicle_type = models.CharField(max_length=50, choices=VEHICLE_TYPE_CHOICES, default='economy')
     
     estimated_distance = models.FloatField(help_text="Distance in km")
     estimated_duration = models.IntegerField(help_text="Duration in minutes")
     estimated_fare = models.DecimalField(max_digits=10, decimal_places=2)
+    surge_multiplier = models.FloatField(default=1.0)
     actual_fare = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     
     scheduled_time = models.DateTimeField(null=True, blank=True)
@@ -37,6 +47,20 @@ class Ride(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of a rider's / driver's history.
+            models.Index(fields=['passenger', '-created_at', '-id'], name='ride_passenger_history_idx'),
+            models.Index(fields=['driver', '-created_at', '-id'], name='ride_driver_history_idx'),
+            # Partial: dispatch and surge only ever look at open rides, a small
+            # and fast-changing slice of the table.
+            models.Index(fields=['created_at'], condition=models.Q(status='requested'), name='ride_open_idx'),
+            models.Index(
+                fields=['driver'], condition=models.Q(status__in=['accepted', 'started']), name='ride_active_driver_idx',
+            ),
+            models.Index(fields=['scheduled_time'], condition=models.Q(status='scheduled'), name='ride_scheduled_idx'),
+            # Incremental metrics rollups read rides changed since a high-water mark.
+            models.Index(fields=['updated_at'], name='ride_updated_idx'),
+        ]
     
     def __str__(self):
         return f"Ride #{self.id} - {self.status}"
@@ -46,15 +70,33 @@ class RideLocation(models.Model):
     ride = models.ForeignKey(Ride, on_delete=models.CASCADE, related_name='locations')
     latitude = models.FloatField()
     longitude = models.FloatField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['ride', 'timestamp', 'id'], name='ridelocation_ride_time_idx'),
+            models.Index(fields=['timestamp', 'id'], name='ridelocation_time_idx'),
+        ]
     
     def __str__(self):
         return f"Location for Ride #{self.ride.id}"
 
 
+class RideTrail(models.Model):
+    ride = models.OneToOneField(Ride, on_delete=models.CASCADE, primary_key=True, related_name='trail')
+    point_count = models.IntegerField(default=0)
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    data = models.BinaryField(help_text="Delta-encoded points, see rides.trails")
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Trail for Ride #{self.ride_id} ({self.point_count} points)"
+
+
 class Rating(models.Model):
     ride = models.OneToOneField(Ride, on_delete=models.CASCADE, related_name='rating')
     
@@ -68,6 +110,30 @@ class Rating(models.Model):
     
     class Meta:
         unique_together = ('ride', 'rater')
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='rating_created_idx'),
+        ]
     
     def __str__(self):
         return f"Rating: {self.rating}/5 for Ride #{self.ride.id}"
+
+
+class RatingAggregate(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='rating_aggregate')
+    rating_sum = models.BigIntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    recent = models.JSONField(default=list, blank=True, help_text="Most recent ratings, oldest first")
+    recent_sum = models.IntegerField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    @property
+    def average(self):
+        return self.rating_sum / self.rating_count if self.rating_count else None
+    
+    @property
+    def recent_average(self):
+        return self.recent_sum / len(self.recent) if self.recent else None
+    
+    def __str__(self):
+        return f"Ratings for {self.user_id}: {self.rating_count}"
@@ -0,0 +1,117 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from rides.models import Rating, RatingAggregate
+from users.models import DriverProfile, PassengerProfile
+
+RECENT_WINDOW = 500
+CACHE_TIMEOUT = 60 * 60
+
+
+def cache_key(user_id):
+    return f'rating-summary:{user_id}'
+
+
+def summarize(aggregate):
+    return {
+        'user': aggregate.user_id,
+        'average': round(aggregate.average, 3) if aggregate.rating_count else None,
+        'count': aggregate.rating_count,
+        'recent_average': round(aggregate.recent_average, 3) if aggregate.recent else None,
+        'recent_count': len(aggregate.recent),
+    }
+
+
+def _profile_rating(aggregate):
+    # The public profile rating follows the rolling window so a driver's
+    # recent service matters more than their first month.
+    return round(aggregate.recent_average, 2)
+
+
+def _apply(aggregate, value):
+    aggregate.rating_sum += value
+    aggregate.rating_count += 1
+    aggregate.recent.append(value)
+    aggregate.recent_sum += value
+    overflow = len(aggregate.recent) - RECENT_WINDOW
+    if overflow > 0:
+        aggregate.recent_sum -= sum(aggregate.recent[:overflow])
+        del aggregate.recent[:overflow]
+
+
+def _sync_profiles(aggregate):
+    rating = _profile_rating(aggregate)
+    now = timezone.now()
+    DriverProfile.objects.filter(user_id=aggregate.user_id).update(rating=rating, updated_at=now)
+    PassengerProfile.objects.filter(user_id=aggregate.user_id).update(rating=rating, updated_at=now)
+
+
+def _store(aggregate, fields):
+    aggregate.save(update_fields=fields)
+    _sync_profiles(aggregate)
+    # Drop rather than set: commits can land out of order, and a summary
+    # built before an earlier one committed would stick for CACHE_TIMEOUT.
+    transaction.on_commit(lambda: cache.delete(cache_key(aggregate.user_id)))
+
+
+def record_rating(rating):
+    """
+    Fold a new ``Rating`` into its ratee's aggregate.
+
+    Must run in the same transaction as the ``Rating`` insert; the aggregate
+    row is locked so concurrent ratings of one user apply one after another.
+    """
+    RatingAggregate.objects.get_or_create(user_id=rating.ratee_id)
+    aggregate = RatingAggregate.objects.select_for_update().get(user_id=rating.ratee_id)
+    _apply(aggregate, int(rating.rating))
+    _store(aggregate, ['rating_sum', 'rating_count', 'recent', 'recent_sum', 'updated_at'])
+    return aggregate
+
+
+def get_rating_summary(user_id):
+    """Read-through cached rating summary; never aggregates over ``Rating``."""
+    key = cache_key(user_id)
+    summary = cache.get(key)
+    if summary is None:
+        aggregate = RatingAggregate.objects.filter(user_id=user_id).first()
+        summary = summarize(aggregate or RatingAggregate(user_id=user_id))
+        cache.set(key, summary, CACHE_TIMEOUT)
+    return summary
+
+
+def rebuild_rating_aggregates(batch_size=2000):
+    """Recompute every aggregate from the ``Rating`` table in one ordered pass."""
+    rebuilt = 0
+    ratings = (
+        Rating.objects.order_by('ratee_id', 'created_at', 'id')
+        .values_list('ratee_id', 'rating')
+        .iterator(chunk_size=batch_size)
+    )
+    current = None
+    for ratee_id, value in ratings:
+        if current is None or current.user_id != ratee_id:
+            if current is not None:
+                _save_rebuilt(current)
+                rebuilt += 1
+            current = RatingAggregate(user_id=ratee_id)
+        _apply(current, value)
+    if current is not None:
+        _save_rebuilt(current)
+        rebuilt += 1
+    return rebuilt
+
+
+def _save_rebuilt(aggregate):
+    with transaction.atomic():
+        RatingAggregate.objects.update_or_create(
+            user_id=aggregate.user_id,
+            defaults={
+                'rating_sum': aggregate.rating_sum,
+                'rating_count': aggregate.rating_count,
+                'recent': aggregate.recent,
+                'recent_sum': aggregate.recent_sum,
+            },
+        )
+        _sync_profiles(aggregate)
+    cache.delete(cache_key(aggregate.user_id))
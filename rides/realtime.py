@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def ride_topic(ride_id):
+    return f'ride.{ride_id}'
+
+
+def driver_topic(driver_id):
+    return f'driver.{driver_id}'
+
+
+class InProcessBroker:
+    """
+    Fan-out to WebSocket consumers living in this process.
+
+    ``publish`` may be called from any thread (request handlers, the GPS
+    flusher, the matching engine); delivery is handed to each subscriber's
+    own event loop with ``call_soon_threadsafe``.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    async def subscribe(self, topic, consumer):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._subscribers[topic][consumer] = loop
+
+    async def unsubscribe(self, topic, consumer):
+        with self._lock:
+            subscribers = self._subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.pop(consumer, None)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    def subscriber_count(self, topic):
+        return len(self._subscribers.get(topic, ()))
+
+    def publish(self, topic, message):
+        with self._lock:
+            targets = list(self._subscribers.get(topic, {}).items())
+        for consumer, loop in targets:
+            try:
+                loop.call_soon_threadsafe(consumer.deliver_soon, message)
+            except RuntimeError:
+                # The consumer's loop has shut down under it.
+                with self._lock:
+                    self._subscribers.get(topic, {}).pop(consumer, None)
+
+
+class ChannelLayerBroker:
+    """Fan-out through the configured channels layer, e.g. Redis for several processes."""
+
+    def __init__(self, alias='default'):
+        from channels.layers import get_channel_layer
+
+        self.layer = get_channel_layer(alias)
+
+    async def subscribe(self, topic, consumer):
+        await self.layer.group_add(topic, consumer.channel_name)
+
+    async def unsubscribe(self, topic, consumer):
+        await self.layer.group_discard(topic, consumer.channel_name)
+
+    def publish(self, topic, message):
+        async_to_sync(self.layer.group_send)(topic, {'type': 'realtime.message', 'message': message})
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                path = getattr(settings, 'REALTIME_BROKER', 'rides.realtime.InProcessBroker')
+                _broker = import_string(path)()
+    return _broker
+
+
+def _publish(topic, message):
+    try:
+        get_broker().publish(topic, message)
+    except Exception:
+        # Streaming is best effort; clients can always fall back to the REST API.
+        logger.exception('Failed to publish to %s', topic)
+
+
+def ride_status_payload(ride):
+    return {
+        'type': 'ride.status',
+        'ride': ride.id,
+        'status': ride.status,
+        'driver': ride.driver_id,
+        'vehicle': ride.vehicle_id,
+        'updated_at': ride.updated_at.isoformat() if ride.updated_at else None,
+    }
+
+
+def publish_ride_status(ride):
+    message = ride_status_payload(ride)
+    _publish(ride_topic(ride.id), message)
+    if ride.driver_id:
+        _publish(driver_topic(ride.driver_id), message)
+
+
+def publish_ride_location(ride_id, latitude, longitude, timestamp, driver_id=None):
+    message = {
+        'type': 'ride.location',
+        'ride': ride_id,
+        'lat': latitude,
+        'lng': longitude,
+        'timestamp': timestamp.isoformat(),
+    }
+    _publish(ride_topic(ride_id), message)
+    if driver_id:
+        _publish(driver_topic(driver_id), message)
+
+
+def publish_driver_location(driver_id, latitude, longitude, timestamp):
+    _publish(driver_topic(driver_id), {
+        'type': 'driver.location',
+        'driver': driver_id,
+        'lat': latitude,
+        'lng': longitude,
+        'timestamp': timestamp.isoformat(),
+    })
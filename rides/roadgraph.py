@@ -0,0 +1,344 @@
+import heapq
+import math
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+
+import numpy as np
+
+from drivers.spatial import haversine_km
+
+# km/h for drivable OSM highway classes when a way has no usable maxspeed.
+HIGHWAY_SPEEDS = {
+    'motorway': 90, 'motorway_link': 50,
+    'trunk': 70, 'trunk_link': 40,
+    'primary': 50, 'primary_link': 35,
+    'secondary': 40, 'secondary_link': 30,
+    'tertiary': 35, 'tertiary_link': 25,
+    'unclassified': 25, 'residential': 25, 'road': 25,
+    'living_street': 10, 'service': 15,
+}
+ONEWAY_VALUES = ('yes', 'true', '1')
+INF = math.inf
+
+
+def parse_maxspeed(value):
+    """km/h from an OSM ``maxspeed`` tag such as ``50`` or ``30 mph``; ``None`` if unusable."""
+    number, _, unit = (value or '').strip().partition(' ')
+    try:
+        speed = float(number)
+    except ValueError:
+        return None
+    return speed * 1.609344 if unit.strip() == 'mph' else speed
+
+
+def _way_direction(tags):
+    oneway = tags.get('oneway', '')
+    if oneway == '-1':
+        return -1
+    if oneway in ONEWAY_VALUES or tags.get('junction') == 'roundabout' or tags.get('highway') == 'motorway':
+        return 1
+    return 0
+
+
+def read_osm(path):
+    """
+    Drivable ways and their node positions from an OSM XML extract.
+
+    The file is streamed twice: once for the ways, once for the
+    coordinates of the nodes they use, so nodes of buildings and other
+    features are never held in memory. Returns ``(ways, coords)`` where
+    ``ways`` are ``(node_ids, speed_kmh, direction)`` and ``direction`` is
+    1 for one-way, -1 for one-way against the node order, 0 for two-way.
+    """
+    ways = []
+    used = set()
+    for _, element in ET.iterparse(path):
+        if element.tag == 'way':
+            tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+            highway = tags.get('highway')
+            if highway in HIGHWAY_SPEEDS and tags.get('access') not in ('no', 'private'):
+                refs = [int(nd.get('ref')) for nd in element.iter('nd')]
+                if len(refs) > 1:
+                    speed = parse_maxspeed(tags.get('maxspeed')) or HIGHWAY_SPEEDS[highway]
+                    ways.append((refs, speed, _way_direction(tags)))
+                    used.update(refs)
+        if element.tag in ('node', 'way', 'relation'):
+            element.clear()
+
+    coords = {}
+    for _, element in ET.iterparse(path):
+        if element.tag == 'node':
+            node_id = int(element.get('id'))
+            if node_id in used:
+                coords[node_id] = (float(element.get('lat')), float(element.get('lon')))
+            element.clear()
+        elif element.tag in ('way', 'relation'):
+            element.clear()
+    return ways, coords
+
+
+def simplify_ways(ways, coords):
+    """
+    Edge arrays between road junctions, dropping the shape nodes in between.
+
+    A node is kept if it ends a way or is shared by two ways; every run of
+    shape nodes between kept nodes becomes a single edge whose length and
+    travel time are summed along the shape. Returns ``(lat, lng, src, dst,
+    seconds, metres)``.
+    """
+    uses = defaultdict(int)
+    for refs, _, _ in ways:
+        for ref in refs:
+            uses[ref] += 1
+        uses[refs[0]] += 1
+        uses[refs[-1]] += 1
+
+    index = {}
+    edges = []
+    for refs, speed, direction in ways:
+        refs = [ref for ref in refs if ref in coords]
+        start, length = None, 0.0
+        for position, ref in enumerate(refs):
+            if position:
+                length += haversine_km(*coords[refs[position - 1]], *coords[ref]) * 1000
+            if uses[ref] < 2 and 0 < position < len(refs) - 1:
+                continue
+            node = index.setdefault(ref, len(index))
+            if start is not None and start != node:
+                duration = length / (speed / 3.6)
+                if direction >= 0:
+                    edges.append((start, node, duration, length))
+                if direction <= 0:
+                    edges.append((node, start, duration, length))
+            start, length = node, 0.0
+
+    positions = np.array([coords[ref] for ref in index], dtype=np.float64).reshape(-1, 2)
+    edges = np.array(edges, dtype=np.float64).reshape(-1, 4)
+    return (
+        positions[:, 0], positions[:, 1], edges[:, 0].astype(np.int32), edges[:, 1].astype(np.int32),
+        edges[:, 2], edges[:, 3],
+    )
+
+
+def _witness_distances(out, source, skip, limit, max_settled):
+    # Bounded Dijkstra over the uncontracted graph that avoids ``skip``.
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    settled = 0
+    while heap and settled < max_settled:
+        distance, node = heapq.heappop(heap)
+        if distance > limit:
+            break
+        if distance > dist[node]:
+            continue
+        settled += 1
+        for nxt, (cost, _) in out[node].items():
+            if nxt != skip:
+                candidate = distance + cost
+                if candidate < dist.get(nxt, INF):
+                    dist[nxt] = candidate
+                    heapq.heappush(heap, (candidate, nxt))
+    return dist
+
+
+def contract(count, src, dst, seconds, metres, max_settled=60):
+    """
+    Contraction hierarchy over a directed graph of ``count`` nodes.
+
+    Nodes are contracted cheapest first, by edge difference plus the
+    number of already contracted neighbours, with lazy priority updates.
+    Contracting a node adds a shortcut ``u -> x`` for each path ``u -> v ->
+    x`` unless a bounded witness search finds one at least as fast
+    without ``v``. Returns per-node ``up`` and ``down`` edge lists: ``up``
+    edges lead to higher-ranked nodes and ``down`` edges come from them,
+    stored reversed, each as ``(node, seconds, metres)``.
+    """
+    out = [{} for _ in range(count)]
+    into = [{} for _ in range(count)]
+    for u, v, cost, length in zip(src.tolist(), dst.tolist(), seconds.tolist(), metres.tolist()):
+        if u != v and cost < out[u].get(v, (INF,))[0]:
+            out[u][v] = into[v][u] = (cost, length)
+
+    def shortcuts(v):
+        needed = []
+        if not out[v] or not into[v]:
+            return needed
+        longest = max(cost for cost, _ in out[v].values())
+        for u, (cost_in, length_in) in into[v].items():
+            witness = _witness_distances(out, u, v, cost_in + longest, max_settled)
+            for x, (cost_out, length_out) in out[v].items():
+                if x != u and witness.get(x, INF) > cost_in + cost_out:
+                    needed.append((u, x, cost_in + cost_out, length_in + length_out))
+        return needed
+
+    contracted_neighbours = [0] * count
+    up = [[] for _ in range(count)]
+    down = [[] for _ in range(count)]
+
+    def priority(v, needed):
+        return len(needed) - len(out[v]) - len(into[v]) + contracted_neighbours[v]
+
+    heap = [(priority(v, shortcuts(v)), v) for v in range(count)]
+    heapq.heapify(heap)
+    while heap:
+        _, v = heapq.heappop(heap)
+        needed = shortcuts(v)
+        current = priority(v, needed)
+        if heap and current > heap[0][0]:
+            heapq.heappush(heap, (current, v))
+            continue
+        for x, (cost, length) in out[v].items():
+            up[v].append((x, cost, length))
+            del into[x][v]
+            contracted_neighbours[x] += 1
+        for u, (cost, length) in into[v].items():
+            down[v].append((u, cost, length))
+            del out[u][v]
+            contracted_neighbours[u] += 1
+        out[v], into[v] = {}, {}
+        for u, x, cost, length in needed:
+            if cost < out[u].get(x, (INF,))[0]:
+                out[u][x] = into[x][u] = (cost, length)
+    return up, down
+
+
+def _csr(edges):
+    offsets = np.zeros(len(edges) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(node_edges) for node_edges in edges])
+    flat = [edge for node_edges in edges for edge in node_edges]
+    return (
+        offsets,
+        np.array([edge[0] for edge in flat], dtype=np.int32),
+        np.array([edge[1] for edge in flat], dtype=np.float32),
+        np.array([edge[2] for edge in flat], dtype=np.float32),
+    )
+
+
+HALVES = ('up', 'down')
+ARRAYS = ('offsets', 'targets', 'seconds', 'metres')
+
+
+class RoadGraph:
+    """
+    A contracted road network held in flat CSR arrays.
+
+    ``lat``/``lng`` are node positions. ``up`` and ``down`` are the two
+    halves of a contraction hierarchy as ``(offsets, targets, seconds,
+    metres)`` arrays: a node's ``up`` edges lead to higher-ranked nodes,
+    its ``down`` edges come from them and are stored reversed, so both the
+    forward search from a source and the backward search from a target
+    only ever climb and settle a few hundred nodes. Searches run on list
+    copies of the arrays, which Python indexes several times faster.
+    """
+
+    def __init__(self, lat, lng, up, down):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lng = np.asarray(lng, dtype=np.float64)
+        self.up = tuple(up)
+        self.down = tuple(down)
+        self._lists = {
+            half: tuple(array.tolist() for array in arrays) for half, arrays in zip(HALVES, (self.up, self.down))
+        }
+
+    def __len__(self):
+        return len(self.lat)
+
+    @property
+    def edge_count(self):
+        return len(self.up[1]) + len(self.down[1])
+
+    @property
+    def nbytes(self):
+        return self.lat.nbytes + self.lng.nbytes + sum(array.nbytes for array in self.up + self.down)
+
+    @classmethod
+    def build(cls, lat, lng, src, dst, seconds, metres, max_settled=60):
+        up, down = contract(len(lat), src, dst, seconds, metres, max_settled=max_settled)
+        return cls(lat, lng, _csr(up), _csr(down))
+
+    @classmethod
+    def from_osm(cls, path, max_settled=60):
+        return cls.build(*simplify_ways(*read_osm(path)), max_settled=max_settled)
+
+    def save(self, path):
+        arrays = {f'{half}_{name}': array for half in HALVES for name, array in zip(ARRAYS, getattr(self, half))}
+        with open(path, 'wb') as handle:
+            np.savez(handle, lat=self.lat, lng=self.lng, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            halves = [tuple(data[f'{half}_{name}'] for name in ARRAYS) for half in HALVES]
+            return cls(data['lat'], data['lng'], *halves)
+
+    def search_space(self, node, half):
+        """``{node: (seconds, metres)}`` for every node the upward search from ``node`` on ``half`` settles."""
+        offsets, targets, seconds, metres = self._lists[half]
+        settled = {}
+        heap = [(0.0, 0.0, node)]
+        while heap:
+            cost, length, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled[node] = (cost, length)
+            for edge in range(offsets[node], offsets[node + 1]):
+                nxt = targets[edge]
+                if nxt not in settled:
+                    heapq.heappush(heap, (cost + seconds[edge], length + metres[edge], nxt))
+        return settled
+
+    def route(self, source, target):
+        """Fastest ``(seconds, metres)`` from node ``source`` to node ``target``; ``(inf, inf)`` if unreachable."""
+        seconds, metres = self.pairs([source], [target])
+        return float(seconds[0]), float(metres[0])
+
+    def table(self, sources, targets):
+        """
+        ``(seconds, metres)`` matrices from every source node to every target node.
+
+        One backward search per target fills per-node buckets and one
+        forward search per source scans them, so the cost grows with
+        ``len(sources) + len(targets)`` searches rather than their product.
+        Unreachable pairs are ``inf``.
+        """
+        buckets = defaultdict(list)
+        for column, target in enumerate(targets):
+            for node, (cost, length) in self.search_space(target, 'down').items():
+                buckets[node].append((column, cost, length))
+        seconds = np.full((len(sources), len(targets)), INF)
+        metres = np.full((len(sources), len(targets)), INF)
+        for row, source in enumerate(sources):
+            best_seconds = [INF] * len(targets)
+            best_metres = [INF] * len(targets)
+            for node, (cost, length) in self.search_space(source, 'up').items():
+                for column, rest, rest_length in buckets.get(node, ()):
+                    if cost + rest < best_seconds[column]:
+                        best_seconds[column] = cost + rest
+                        best_metres[column] = length + rest_length
+            seconds[row] = best_seconds
+            metres[row] = best_metres
+        return seconds, metres
+
+    def pairs(self, sources, targets):
+        """``(seconds, metres)`` arrays for each ``sources[i] -> targets[i]``, sharing searches between repeats."""
+        forward, backward = {}, {}
+        seconds = np.full(len(sources), INF)
+        metres = np.full(len(sources), INF)
+        for position, (source, target) in enumerate(zip(sources, targets)):
+            if source == target:
+                seconds[position] = metres[position] = 0.0
+                continue
+            if source not in forward:
+                forward[source] = self.search_space(source, 'up')
+            if target not in backward:
+                backward[target] = self.search_space(target, 'down')
+            ahead, behind = forward[source], backward[target]
+            if len(behind) < len(ahead):
+                ahead, behind = behind, ahead
+            best = (INF, INF)
+            for node, (cost, length) in ahead.items():
+                meet = behind.get(node)
+                if meet is not None and cost + meet[0] < best[0]:
+                    best = (cost + meet[0], length + meet[1])
+            seconds[position], metres[position] = best
+        return seconds, metres
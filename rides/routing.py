@@ -0,0 +1,8 @@
+from django.urls import path
+
+from rides.consumers import DriverConsumer, RideConsumer
+
+websocket_urlpatterns = [
+    path('ws/rides/<int:ride_id>/', RideConsumer.as_asgi()),
+    path('ws/drivers/<int:driver_id>/', DriverConsumer.as_asgi()),
+]
@@ -0,0 +1,201 @@
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+
+from drivers.spatial import location_coords
+from payments.surge import surge_grid
+from rides.models import Ride
+from rides.state import RideConflict, transition
+from rideshare_backend.db_router import pin_primary
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'LEAD_SECONDS': 600.0,
+    'MAX_BATCH': 500,
+    'IDLE_WAIT_SECONDS': 60.0,
+}
+
+# Heap entries are single ints, release time in ms above the ride id, so
+# a million pending rides cost ~42 MiB instead of ~84 MiB as tuples.
+ID_BITS = 40
+ID_MASK = (1 << ID_BITS) - 1
+
+
+def scheduler_settings():
+    return {**DEFAULTS, **getattr(settings, 'RIDE_SCHEDULER', {})}
+
+
+class RideScheduler:
+    """
+    Releases scheduled rides to dispatch ``LEAD_SECONDS`` before pickup.
+
+    Rides booked for later are created as ``scheduled`` and pushed onto an
+    in-memory min-heap keyed by release time. A single thread sleeps until
+    the earliest release, is woken early when an earlier ride is pushed,
+    and moves each due ride to ``requested`` where matching picks it up, so
+    the database is never polled. Cancellations are dropped lazily when
+    they reach the top of the heap, or in bulk once they make up half of
+    it. The heap is only a hint: the release is a conditional transition,
+    so rides cancelled or rescheduled elsewhere are never released early.
+    ``clock`` returns epoch seconds and can be a fake in tests.
+    """
+
+    def __init__(self, options=None, clock=time.time):
+        self.options = {**scheduler_settings(), **(options or {})}
+        self.clock = clock
+        self._heap = []
+        self._cancelled = set()
+        self._condition = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    @property
+    def lead(self):
+        return timedelta(seconds=self.options['LEAD_SECONDS'])
+
+    def now(self):
+        return datetime.fromtimestamp(self.clock(), tz=dt_timezone.utc)
+
+    def release_ms(self, scheduled_time):
+        return round((scheduled_time - self.lead).timestamp() * 1000)
+
+    def is_due(self, scheduled_time):
+        return scheduled_time is None or self.release_ms(scheduled_time) <= round(self.clock() * 1000)
+
+    def __len__(self):
+        with self._condition:
+            return len(self._heap) - len(self._cancelled)
+
+    def schedule(self, ride_id, scheduled_time):
+        key = self.release_ms(scheduled_time) << ID_BITS | ride_id
+        with self._condition:
+            self._cancelled.discard(ride_id)
+            heapq.heappush(self._heap, key)
+            if self._heap[0] == key:
+                self._condition.notify()
+
+    def cancel(self, ride_id):
+        with self._condition:
+            self._cancelled.add(ride_id)
+            if len(self._cancelled) * 2 > len(self._heap):
+                self._heap = [key for key in self._heap if key & ID_MASK not in self._cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled.clear()
+
+    def load(self, rides):
+        """Replace the heap with ``(ride_id, scheduled_time)`` pairs in one O(n) heapify."""
+        heap = [self.release_ms(scheduled_time) << ID_BITS | ride_id for ride_id, scheduled_time in rides]
+        heapq.heapify(heap)
+        with self._condition:
+            self._heap = heap
+            self._cancelled.clear()
+            self._condition.notify()
+
+    def rebuild_from_db(self):
+        with pin_primary():
+            rides = Ride.objects.filter(status='scheduled').values_list('id', 'scheduled_time')
+            self.load(rides.iterator(chunk_size=10000))
+
+    def _pop_due_keys(self):
+        now_key = (round(self.clock() * 1000) + 1) << ID_BITS
+        due = []
+        with self._condition:
+            while self._heap and self._heap[0] < now_key and len(due) < self.options['MAX_BATCH']:
+                key = heapq.heappop(self._heap)
+                if key & ID_MASK in self._cancelled:
+                    self._cancelled.discard(key & ID_MASK)
+                else:
+                    due.append(key)
+        return due
+
+    def pop_due(self):
+        """Take up to ``MAX_BATCH`` ride ids whose release time has come, skipping cancelled ones."""
+        return [key & ID_MASK for key in self._pop_due_keys()]
+
+    def _requeue(self, keys):
+        with self._condition:
+            for key in keys:
+                heapq.heappush(self._heap, key)
+
+    def seconds_to_next(self):
+        with self._condition:
+            if not self._heap:
+                return None
+            return max(0.0, (self._heap[0] >> ID_BITS) / 1000 - self.clock())
+
+    def release(self, ride_ids):
+        deadline = self.now() + self.lead
+        released = []
+        with pin_primary():
+            rides = Ride.objects.filter(pk__in=ride_ids, status='scheduled').filter(
+                Q(scheduled_time__isnull=True) | Q(scheduled_time__lte=deadline)
+            )
+            for ride in rides.only('id', 'status', 'driver_id', 'vehicle_id', 'pickup_location', 'updated_at'):
+                try:
+                    transition(ride, 'release')
+                except RideConflict:
+                    continue
+                coords = location_coords(ride.pickup_location)
+                if coords is not None:
+                    surge_grid.ride_opened(ride.id, *coords)
+                released.append(ride.id)
+        return released
+
+    def run_due(self):
+        """Release every ride that is due; returns their ids."""
+        released = []
+        while True:
+            due = self._pop_due_keys()
+            if not due:
+                return released
+            try:
+                released.extend(self.release([key & ID_MASK for key in due]))
+            except Exception:
+                # Put the batch back for the next pass; rides released
+                # before the failure are no longer 'scheduled' and skipped.
+                self._requeue(due)
+                raise
+
+    def run_forever(self):
+        while True:
+            try:
+                released = self.run_due()
+                if released:
+                    logger.info('Released %d scheduled rides', len(released))
+            except Exception:
+                logger.exception('Releasing scheduled rides failed')
+            finally:
+                close_old_connections()
+            with self._condition:
+                if self._stop:
+                    return
+                wait = self.seconds_to_next()
+                self._condition.wait(self.options['IDLE_WAIT_SECONDS'] if wait is None else wait)
+                if self._stop:
+                    return
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop = False
+            self._thread = threading.Thread(target=self.run_forever, name='ride-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._stop = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+ride_scheduler = RideScheduler()
@@ -1,5 +1,31 @@
+from decimal import Decimal, InvalidOperation
+
 from rest_framework import serializers
-from rides.models import Ride, RideLocation, Rating
+from payments.pricing import pricing_settings
+from rides.models import Ride, RideLocation, RideTrail, Rating
+from rides.trails import decode_trail
+
+
+def validate_point(value):
+    try:
+        lat, lng = float(value['lat']), float(value['lng'])
+    except (KeyError, TypeError, ValueError):
+        raise serializers.ValidationError("Expected an object with numeric 'lat' and 'lng'")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise serializers.ValidationError("Coordinates are out of range")
+    return {**value, 'lat': lat, 'lng': lng}
+
+
+def validate_fare(value, estimated_fare):
+    try:
+        fare = Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise serializers.ValidationError("Expected a numeric fare")
+    limit = (Decimal(str(estimated_fare)) * Decimal(str(pricing_settings()['MAX_FARE_MULTIPLE']))).quantize(Decimal('0.01'))
+    if not fare.is_finite() or not 0 < fare <= limit:
+        raise serializers.ValidationError(f"Fare must be above 0 and at most {limit}")
+    return fare.quantize(Decimal('0.01'))
+
 
 class RideLocationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -7,17 +33,47 @@ class RideLocationSerializer(serializers.ModelSerializer):
         fields = ['id', 'latitude', 'longitude', 'timestamp']
 
 class RideSerializer(serializers.ModelSerializer):
-    locations = RideLocationSerializer(many=True, read_only=True)
+    locations = serializers.SerializerMethodField()
     
     class Meta:
         model = Ride
         fields = [
             'id', 'passenger', 'driver', 'vehicle', 'pickup_location', 
-            'dropoff_location', 'status', 'estimated_distance', 'estimated_duration',
-            'estimated_fare', 'actual_fare', 'scheduled_time', 'started_at',
+            'dropoff_location', 'status', 'vehicle_type', 'estimated_distance', 'estimated_duration',
+            'estimated_fare', 'surge_multiplier', 'actual_fare', 'scheduled_time', 'started_at',
             'completed_at', 'cancelled_at', 'cancellation_reason', 'locations',
             'created_at', 'updated_at'
         ]
+        read_only_fields = ['passenger', 'driver', 'vehicle', 'status', 'estimated_distance', 'estimated_duration', 'estimated_fare', 'surge_multiplier']
+    
+    def validate_pickup_location(self, value):
+        return validate_point(value)
+    
+    def validate_dropoff_location(self, value):
+        return validate_point(value)
+
+    def get_locations(self, ride):
+        # Archived points come first and carry no row id; live rows follow.
+        timestamp = serializers.DateTimeField()
+        try:
+            points = [
+                {'id': None, 'latitude': lat, 'longitude': lng, 'timestamp': timestamp.to_representation(at)}
+                for lat, lng, at in decode_trail(ride.trail.data)
+            ]
+        except RideTrail.DoesNotExist:
+            points = []
+        return points + RideLocationSerializer(ride.locations.all(), many=True).data
+
+class RideListSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Ride
+        fields = [
+            'id', 'passenger', 'driver', 'vehicle', 'pickup_location', 
+            'dropoff_location', 'status', 'vehicle_type', 'estimated_distance', 'estimated_duration',
+            'estimated_fare', 'surge_multiplier', 'actual_fare', 'scheduled_time', 'started_at',
+            'completed_at', 'cancelled_at', 'cancellation_reason',
+            'created_at', 'updated_at'
+        ]
 
 class RatingSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,66 @@
+from django.db import transaction
+from django.utils import timezone
+
+from payments.surge import surge_grid
+from rides.models import Ride
+from rides.realtime import publish_ride_status
+
+# event -> (statuses the ride may be in, status it moves to)
+TRANSITIONS = {
+    'hold': (('requested',), 'scheduled'),
+    'release': (('scheduled',), 'requested'),
+    'accept': (('requested',), 'accepted'),
+    'start': (('accepted',), 'started'),
+    'complete': (('started',), 'completed'),
+    'cancel': (('scheduled', 'requested', 'accepted', 'started'), 'cancelled'),
+}
+
+TIMESTAMP_FIELDS = {
+    'start': 'started_at',
+    'complete': 'completed_at',
+    'cancel': 'cancelled_at',
+}
+
+
+class RideConflict(Exception):
+    def __init__(self, ride_id, event, status):
+        self.ride_id = ride_id
+        self.event = event
+        self.status = status
+        super().__init__(f"Cannot {event} ride #{ride_id} while it is {status or 'missing'}")
+
+
+def transition(ride, event, **fields):
+    """
+    Move ``ride`` to the next status for ``event`` with one conditional UPDATE.
+
+    The UPDATE only matches while the row still has the status this caller
+    read into ``ride.status``, and writes only the status, its timestamp and
+    ``fields``. If another request moved the ride first nothing is written
+    and ``RideConflict`` is raised with the status it found. On success the
+    instance is updated in place; subscribers and the surge grid hear of the
+    change once the enclosing transaction commits.
+    """
+    allowed, target = TRANSITIONS[event]
+    if ride.status not in allowed:
+        raise RideConflict(ride.pk, event, ride.status)
+
+    now = timezone.now()
+    values = {'status': target, 'updated_at': now, **fields}
+    if event in TIMESTAMP_FIELDS:
+        values.setdefault(TIMESTAMP_FIELDS[event], now)
+    filters = {'pk': ride.pk, 'status': ride.status}
+    if event in ('accept', 'hold'):
+        filters['driver__isnull'] = True
+
+    if not Ride.objects.filter(**filters).update(**values):
+        current = Ride.objects.filter(pk=ride.pk).values_list('status', flat=True).first()
+        raise RideConflict(ride.pk, event, current)
+
+    if 'requested' in allowed and ride.status == 'requested':
+        ride_id = ride.pk
+        transaction.on_commit(lambda: surge_grid.ride_closed(ride_id))
+    for field, value in values.items():
+        setattr(ride, field, value)
+    transaction.on_commit(lambda: publish_ride_status(ride))
+    return ride
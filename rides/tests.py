@@ -1,3 +1,900 @@
-from django.test import TestCase
+import datetime
+import heapq
+import json
+import math
+import os
+import random
+import tempfile
+import threading
 
-# Create your tests here.
+from collections import deque
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipIf
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from drivers.spatial import DriverSpatialIndex, haversine_km
+from payments.pricing import route_estimates
+from payments.surge import SimulatedClock
+from rides.eta import EtaService
+from rides.ingestion import IngestionBackpressure, LocationIngestor, location_ingestor
+from rides.matching import MatchingEngine, solve_assignment
+from rides import ratings
+from rides.models import Rating, RatingAggregate, Ride, RideLocation, RideTrail
+from rides.realtime import publish_ride_location, publish_ride_status
+from rides.roadgraph import RoadGraph
+from rides.routing import websocket_urlpatterns
+from rides.scheduler import RideScheduler
+from rides.state import RideConflict, transition
+from rideshare_backend.db_router import pin_primary
+from rideshare_backend.encoding import ORJSONParser, ORJSONRenderer, msgpack
+from rideshare_backend.query_audit import query_plan, seq_scans
+from rides.serializers import RideSerializer
+from rides.trails import archive_ride_trail, decode_trail, encode_polyline, encode_trail, ride_trail_points
+from users.identity import get_identity
+from users.models import DriverProfile, PassengerProfile, User
+
+PICKUP = {'lat': 0.3476, 'lng': 32.5825, 'address': 'Kampala Road'}
+DROPOFF = {'lat': 0.3136, 'lng': 32.5811, 'address': 'Kabalagala'}
+
+
+def create_passenger(username='passenger'):
+    user = User.objects.create_user(
+        username=username, password='secret', user_type='passenger', phone_number=f'+256{username}',
+    )
+    return PassengerProfile.objects.create(user=user)
+
+
+def create_driver(username='driver', **fields):
+    user = User.objects.create_user(
+        username=username, password='secret', user_type='driver', phone_number=f'+256{username}',
+    )
+    fields.setdefault('license_expiry', datetime.date(2030, 1, 1))
+    return DriverProfile.objects.create(user=user, license_number=f'LIC-{username}', **fields)
+
+
+def create_ride(passenger, **fields):
+    values = {
+        'pickup_location': PICKUP,
+        'dropoff_location': DROPOFF,
+        'estimated_distance': 4.2,
+        'estimated_duration': 15,
+        'estimated_fare': '12000.00',
+    }
+    values.update(fields)
+    return Ride.objects.create(passenger=passenger, **values)
+
+
+OSM_EXTRACT = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="0.3476" lon="32.5825"/>
+  <node id="2" lat="0.3476" lon="32.5835"/>
+  <node id="3" lat="0.3476" lon="32.5845"/>
+  <node id="4" lat="0.3486" lon="32.5845"/>
+  <node id="9" lat="0.3500" lon="32.5900"><tag k="building" v="yes"/></node>
+  <way id="10"><nd ref="1"/><nd ref="2"/><nd ref="3"/><tag k="highway" v="residential"/></way>
+  <way id="11"><nd ref="3"/><nd ref="4"/><tag k="highway" v="primary"/><tag k="oneway" v="yes"/></way>
+  <way id="12"><nd ref="1"/><nd ref="4"/><tag k="highway" v="footway"/></way>
+</osm>
+"""
+
+
+def road_graph(points, roads, speed_kmh=36.0):
+    """A contracted graph over ``points`` with two-way ``roads`` given as index pairs."""
+    lat, lng = np.array(points).T
+    edges = []
+    for u, v in roads:
+        metres = haversine_km(*points[u], *points[v]) * 1000
+        edges += [(u, v, metres / (speed_kmh / 3.6), metres), (v, u, metres / (speed_kmh / 3.6), metres)]
+    src, dst, seconds, metres = np.array(edges).T
+    return RoadGraph.build(lat, lng, src.astype(np.int32), dst.astype(np.int32), seconds, metres)
+
+
+def dijkstra_seconds(count, src, dst, seconds, source):
+    adjacency = [[] for _ in range(count)]
+    for u, v, cost in zip(src, dst, seconds):
+        adjacency[u].append((v, cost))
+    best = {source: 0.0}
+    heap = [(0.0, source)]
+    while heap:
+        cost, node = heapq.heappop(heap)
+        if cost > best[node]:
+            continue
+        for nxt, step in adjacency[node]:
+            if cost + step < best.get(nxt, math.inf):
+                best[nxt] = cost + step
+                heapq.heappush(heap, (cost + step, nxt))
+    return best
+
+
+class SolveAssignmentTests(SimpleTestCase):
+    def test_assigns_each_driver_once_preferring_shorter_pickups(self):
+        rides = [(0.3476, 32.5825), (0.3500, 32.5900)]
+        drivers = [(0.3501, 32.5901), (0.3477, 32.5826), (0.9000, 33.0000)]
+        ride_idx, driver_idx, km = solve_assignment(rides, drivers, max_pickup_km=3)
+
+        self.assertEqual(dict(zip(ride_idx.tolist(), driver_idx.tolist())), {0: 1, 1: 0})
+        self.assertTrue((km < 0.1).all())
+
+    def test_leaves_rides_without_a_driver_in_range_unassigned(self):
+        ride_idx, _, _ = solve_assignment([(0.3476, 32.5825)], [(0.5, 32.9)], max_pickup_km=5)
+        self.assertEqual(len(ride_idx), 0)
+
+    def test_matches_contended_rides_to_distinct_drivers(self):
+        rng = np.random.default_rng(3)
+        rides = 0.35 + rng.uniform(-0.05, 0.05, size=(300, 2)) + [0, 32.2]
+        drivers = 0.35 + rng.uniform(-0.05, 0.05, size=(200, 2)) + [0, 32.2]
+        ride_idx, driver_idx, _ = solve_assignment(rides, drivers)
+
+        self.assertGreater(len(ride_idx), 180)
+        self.assertEqual(len(set(ride_idx.tolist())), len(ride_idx))
+        self.assertEqual(len(set(driver_idx.tolist())), len(driver_idx))
+
+
+class MatchingEngineTests(TestCase):
+    def test_run_window_assigns_open_rides_and_takes_drivers_out_of_the_pool(self):
+        passenger = create_passenger()
+        ride = create_ride(passenger)
+        taken = create_ride(passenger, status='cancelled')
+        driver = create_driver(is_online=True)
+        index = DriverSpatialIndex()
+        index.update(driver.id, 0.3480, 32.5830, 'economy')
+
+        assigned = MatchingEngine(index=index).run_window()
+
+        self.assertEqual([(ride_id, driver_id) for ride_id, driver_id, _ in assigned], [(ride.id, driver.id)])
+        ride.refresh_from_db()
+        self.assertEqual((ride.status, ride.driver_id), ('accepted', driver.id))
+        taken.refresh_from_db()
+        self.assertIsNone(taken.driver_id)
+        self.assertNotIn(driver.id, index)
+
+    def test_run_window_prefers_the_driver_with_the_shorter_road_eta(self):
+        ride = create_ride(create_passenger())
+        across_river, down_the_road = create_driver('across'), create_driver('down')
+        # The nearest driver has to go round by a bridge 1 km north.
+        points = [(0.3476, 32.5825), (0.3476, 32.5845), (0.3576, 32.5845), (0.3576, 32.5825), (0.3476, 32.5795)]
+        eta = EtaService(graph=road_graph(points, [(1, 2), (2, 3), (3, 0), (4, 0)]))
+        index = DriverSpatialIndex()
+        index.update(across_river.id, 0.3476, 32.5845, 'economy')
+        index.update(down_the_road.id, 0.3476, 32.5795, 'economy')
+
+        assigned = MatchingEngine(index=index, eta=eta).run_window()
+
+        self.assertEqual([(ride_id, driver_id) for ride_id, driver_id, _ in assigned], [(ride.id, down_the_road.id)])
+        self.assertAlmostEqual(assigned[0][2], 0.56, delta=0.05)  # 334 m at 36 km/h
+
+
+    def test_run_window_only_pairs_rides_with_drivers_of_their_vehicle_type(self):
+        passenger = create_passenger()
+        premium_ride = create_ride(passenger, vehicle_type='premium')
+        economy_ride = create_ride(passenger)
+        economy, premium, untyped = create_driver('economy'), create_driver('premium'), create_driver('untyped')
+        index = DriverSpatialIndex()
+        # The economy driver is the nearest to both pickups.
+        index.update(economy.id, 0.3476, 32.5825, 'economy')
+        index.update(premium.id, 0.3520, 32.5825, 'premium')
+        index.update(untyped.id, 0.3477, 32.5825)
+
+        assigned = MatchingEngine(index=index).run_window()
+
+        self.assertEqual(
+            sorted((ride_id, driver_id) for ride_id, driver_id, _ in assigned),
+            sorted([(premium_ride.id, premium.id), (economy_ride.id, economy.id)]),
+        )
+        self.assertIn(untyped.id, index)
+
+
+class RoadGraphTests(SimpleTestCase):
+    def test_osm_extract_keeps_junctions_and_one_way_streets(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'city.osm')
+            with open(path, 'w') as handle:
+                handle.write(OSM_EXTRACT)
+            graph = RoadGraph.from_osm(path)
+            graph.save(os.path.join(directory, 'graph.npz'))
+            loaded = RoadGraph.load(os.path.join(directory, 'graph.npz'))
+
+        self.assertEqual(len(loaded), 3)  # the shape node and the footway are gone
+        nodes = {(round(lat, 4), round(lng, 4)): node for node, (lat, lng) in enumerate(zip(loaded.lat, loaded.lng))}
+        start, corner, end = nodes[(0.3476, 32.5825)], nodes[(0.3476, 32.5845)], nodes[(0.3486, 32.5845)]
+        seconds, metres = loaded.route(start, end)
+        street = haversine_km(0.3476, 32.5825, 0.3476, 32.5845) * 1000
+        avenue = haversine_km(0.3476, 32.5845, 0.3486, 32.5845) * 1000
+        self.assertAlmostEqual(metres, street + avenue, delta=0.5)
+        self.assertAlmostEqual(seconds, street / (25 / 3.6) + avenue / (50 / 3.6), delta=0.1)
+        self.assertEqual(loaded.route(end, corner), (math.inf, math.inf))
+
+    def test_contracted_queries_match_dijkstra(self):
+        rng = random.Random(7)
+        size = 12
+        points = [(0.3 + row * 0.001, 32.5 + col * 0.001) for row in range(size) for col in range(size)]
+        edges = [
+            (u, v, rng.uniform(5, 60))
+            for node in range(size * size)
+            for nxt in (node + 1, node + size)
+            if nxt < size * size and (nxt != node + 1 or nxt % size) and rng.random() > 0.1
+            for u, v in ((node, nxt), (nxt, node))
+            if rng.random() > 0.2
+        ]
+        src, dst, seconds = zip(*edges)
+        lat, lng = np.array(points).T
+        graph = RoadGraph.build(lat, lng, np.array(src), np.array(dst), np.array(seconds), np.array(seconds))
+
+        sources, targets = rng.sample(range(size * size), 6), rng.sample(range(size * size), 6)
+        table, _ = graph.table(sources, targets)
+        for row, source in enumerate(sources):
+            expected = dijkstra_seconds(size * size, src, dst, seconds, source)
+            for column, target in enumerate(targets):
+                want = expected.get(target, math.inf)
+                self.assertAlmostEqual(graph.route(source, target)[0], want, places=3)
+                self.assertAlmostEqual(table[row, column], want, places=3)
+
+    def test_eta_service_snaps_to_cells_and_caches_cell_pairs(self):
+        points = [(0.3476, 32.5825), (0.3476, 32.5845), (0.3496, 32.5845)]
+        service = EtaService(graph=road_graph(points, [(0, 1), (1, 2)]))
+
+        seconds, metres = service.pairs([(0.34761, 32.58251), (0.3476, 32.5825)], [(0.3496, 32.5845), (0.5, 33.0)])
+        road_km = haversine_km(*points[0], *points[1]) + haversine_km(*points[1], *points[2])
+        self.assertAlmostEqual(metres[0], road_km * 1000, delta=5)
+        self.assertTrue(math.isnan(seconds[1]))  # 50 km from any road
+        self.assertEqual(len(service.cache._entries), 1)
+
+        table, _ = service.table([(0.3476, 32.5825), (0.3476, 32.5845)], [(0.3496, 32.5845)])
+        self.assertAlmostEqual(table[0, 0], seconds[0], delta=1)
+        self.assertLess(table[1, 0], table[0, 0])
+        self.assertEqual(service.eta((0.5, 33.0), (0.3476, 32.5825)), None)
+
+    def test_fare_estimates_follow_the_road_when_a_graph_is_loaded(self):
+        points = [(0.3476, 32.5825), (0.3576, 32.5825), (0.3576, 32.5845), (0.3476, 32.5845)]
+        service = EtaService(graph=road_graph(points, [(0, 1), (1, 2), (2, 3)]))
+        trips = ([points[0], points[0]], [points[3], (0.5, 33.0)])
+
+        with mock.patch('payments.pricing.eta_service', service):
+            distance_km, duration_min = route_estimates(*trips)
+        straight_km, straight_min = route_estimates(*trips)
+
+        self.assertAlmostEqual(distance_km[0], 2.44, delta=0.02)  # round the block, not 0.22 km across
+        self.assertEqual(duration_min[0], 5)
+        self.assertEqual((distance_km[1], duration_min[1]), (straight_km[1], straight_min[1]))
+
+
+class LocationIngestorTests(TestCase):
+    def setUp(self):
+        self.ride = create_ride(create_passenger(), status='started')
+
+    def test_flush_writes_buffered_pings_in_order(self):
+        ingestor = LocationIngestor(options={'MAX_BATCH': 2}, autostart=False)
+        for latitude in (0.30, 0.31, 0.32, 0.33, 0.34):
+            ingestor.submit(self.ride.id, latitude, 32.5)
+        self.assertEqual(RideLocation.objects.count(), 0)
+
+        self.assertEqual(ingestor.flush(), 5)
+        self.assertEqual(len(ingestor), 0)
+        self.assertEqual(
+            list(self.ride.locations.values_list('latitude', flat=True)),
+            [0.3, 0.31, 0.32, 0.33, 0.34],
+        )
+
+    def test_submit_applies_backpressure_when_buffer_is_full(self):
+        ingestor = LocationIngestor(options={'MAX_PENDING': 2}, autostart=False)
+        ingestor.submit(self.ride.id, 0.3, 32.5)
+        ingestor.submit(self.ride.id, 0.3, 32.5)
+        with self.assertRaises(IngestionBackpressure):
+            ingestor.submit(self.ride.id, 0.3, 32.5)
+
+    def test_pings_for_deleted_rides_are_dropped(self):
+        other = create_ride(self.ride.passenger, status='started')
+        ingestor = LocationIngestor(autostart=False)
+        ingestor.submit(self.ride.id, 0.3, 32.5)
+        ingestor.submit(other.id, 0.3, 32.5)
+        other.delete()
+
+        ingestor.flush()
+        self.assertEqual(list(RideLocation.objects.values_list('ride_id', flat=True)), [self.ride.id])
+
+    def test_flush_for_a_ride_scans_the_buffer_under_the_lock(self):
+        # Request threads append while complete_ride flushes one ride; an
+        # unlocked scan fails with "deque mutated during iteration".
+        ingestor = LocationIngestor(autostart=False)
+        test = self
+
+        class LockedDeque(deque):
+            def __iter__(self):
+                test.assertTrue(ingestor._lock.locked())
+                return super().__iter__()
+
+        ingestor._pending = LockedDeque()
+        ingestor.submit(self.ride.id + 1000, 0.3, 32.5)
+        ingestor.submit(self.ride.id, 0.3, 32.5)
+        ingestor.flush(ride_id=self.ride.id)
+        self.assertEqual(self.ride.locations.count(), 1)
+
+    def test_active_ride_lookup_is_cached(self):
+        ingestor = LocationIngestor(autostart=False)
+        self.assertEqual(ingestor.active_ride(self.ride.id), (True, None))
+        with self.assertNumQueries(0):
+            ingestor.active_ride(self.ride.id)
+        self.assertEqual(ingestor.active_ride(self.ride.id + 1000), (False, None))
+
+
+class UpdateLocationTests(APITestCase):
+    def setUp(self):
+        self.passenger = create_passenger()
+        self.ride = create_ride(self.passenger, status='started')
+        self.client.force_authenticate(self.passenger.user)
+        location_ingestor.forget_ride(self.ride.id)
+
+    def post(self, **data):
+        payload = {'ride_id': self.ride.id, 'latitude': 0.35, 'longitude': 32.58}
+        payload.update(data)
+        return self.client.post('/api/locations/update_location/', payload, format='json')
+
+    @mock.patch.object(location_ingestor, 'autostart', False)
+    def test_buffered_ping_is_accepted_then_flushed(self):
+        response = self.post()
+        self.assertEqual(response.status_code, 202)
+        location_ingestor.flush()
+        self.assertEqual(self.ride.locations.count(), 1)
+
+    def test_invalid_and_unknown_rides_are_rejected(self):
+        self.assertEqual(self.post(latitude='north').status_code, 400)
+        self.assertEqual(self.post(ride_id=self.ride.id + 1000).status_code, 404)
+
+    @override_settings(GPS_INGESTION={'BUFFERED': False})
+    def test_unbuffered_mode_inserts_immediately(self):
+        response = self.post()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.ride.locations.count(), 1)
+
+
+
+class RideEncodingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.passenger = create_passenger()
+        self.ride = create_ride(self.passenger, status='started')
+        RideLocation.objects.bulk_create(
+            RideLocation(ride=self.ride, latitude=0.35, longitude=32.58) for _ in range(3)
+        )
+        self.client.force_authenticate(self.passenger.user)
+
+    def test_orjson_renders_the_same_document_as_drf(self):
+        data = dict(RideSerializer(Ride.objects.get()).data)
+        data['raw'] = {
+            'fare': Decimal('12000.50'),
+            'at': datetime.datetime(2026, 10, 1, 8, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            'day': datetime.date(2026, 10, 1),
+            'label': gettext_lazy('Economy'),
+            1: 'int key',
+        }
+        fast, slow = ORJSONRenderer().render(data), JSONRenderer().render(data)
+        self.assertEqual(json.loads(fast), json.loads(slow))
+        self.assertIn(b'"2026-10-01T08:30:15.123456Z"', fast)
+        self.assertEqual(ORJSONParser().parse(BytesIO(fast)), json.loads(slow))
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_is_negotiated_by_accept(self):
+        url = f'/api/rides/{self.ride.id}/'
+        expected = self.client.get(url).json()
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), expected)
+        self.assertLess(len(response.content), len(self.client.get(url).content))
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    @mock.patch.object(location_ingestor, 'autostart', False)
+    def test_pings_parse_from_json_and_msgpack(self):
+        location_ingestor.forget_ride(self.ride.id)
+        ping = {'ride_id': self.ride.id, 'latitude': 0.35, 'longitude': 32.58}
+        url = '/api/locations/update_location/'
+        self.assertEqual(self.client.post(url, json.dumps(ping), content_type='application/json').status_code, 202)
+        self.assertEqual(self.client.post(url, msgpack.packb(ping), content_type='application/msgpack').status_code, 202)
+        response = self.client.post(url, b'{"ride_id": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', response.json()['detail'])
+        self.assertEqual(self.client.post(url, b'\xc1', content_type='application/msgpack').status_code, 400)
+        location_ingestor.flush()
+        self.assertEqual(self.ride.locations.count(), 5)
+
+
+class RideTrailTests(TestCase):
+    def make_points(self, count):
+        rng = random.Random(11)
+        start = datetime.datetime(2025, 11, 7, 8, 0, tzinfo=datetime.timezone.utc)
+        lat, lng, points = 0.3476, 32.5825, []
+        for step in range(count):
+            lat += rng.uniform(-0.0003, 0.0003)
+            lng += rng.uniform(-0.0003, 0.0003)
+            points.append((round(lat, 6), round(lng, 6), start + datetime.timedelta(seconds=4 * step)))
+        return points
+
+    def test_encode_round_trip_is_compact(self):
+        points = self.make_points(1000)
+        data = encode_trail(points)
+        self.assertEqual(decode_trail(data), points)
+        self.assertLess(len(data) / len(points), 8)
+
+    def test_encode_polyline_matches_reference_encoding(self):
+        points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        self.assertEqual(encode_polyline(points), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+
+    def test_archive_folds_rows_into_trail_and_keeps_later_points(self):
+        ride = create_ride(create_passenger(), status='completed')
+        points = self.make_points(50)
+        RideLocation.objects.bulk_create(
+            RideLocation(ride=ride, latitude=lat, longitude=lng, timestamp=ts) for lat, lng, ts in points[:40]
+        )
+        trail = archive_ride_trail(ride)
+        self.assertEqual(trail.point_count, 40)
+        self.assertFalse(RideLocation.objects.filter(ride=ride).exists())
+
+        RideLocation.objects.bulk_create(
+            RideLocation(ride=ride, latitude=lat, longitude=lng, timestamp=ts) for lat, lng, ts in points[40:]
+        )
+        self.assertEqual(ride_trail_points(ride), points)
+        archive_ride_trail(ride)
+        self.assertEqual(RideTrail.objects.get(ride=ride).point_count, 50)
+        self.assertEqual(ride_trail_points(ride), points)
+
+
+class RealtimeTests(TestCase):
+    def setUp(self):
+        self.passenger = create_passenger()
+        self.driver = create_driver()
+        self.ride = create_ride(self.passenger, driver=self.driver, status='accepted')
+
+    async def connect(self, path, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        communicator.scope['user'] = user
+        connected, code = await communicator.connect()
+        return communicator, connected, code
+
+    async def test_ride_channel_streams_status_and_locations(self):
+        communicator, connected, _ = await self.connect(f'/ws/rides/{self.ride.id}/', self.passenger.user)
+        self.assertTrue(connected)
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual((snapshot['type'], snapshot['status']), ('ride.status', 'accepted'))
+
+        self.ride.status = 'started'
+        publish_ride_status(self.ride)
+        publish_ride_location(self.ride.id, 0.35, 32.58, self.ride.created_at, self.driver.id)
+
+        self.assertEqual((await communicator.receive_json_from())['status'], 'started')
+        location = await communicator.receive_json_from()
+        self.assertEqual((location['type'], location['lat'], location['lng']), ('ride.location', 0.35, 32.58))
+        await communicator.disconnect()
+
+    async def test_driver_channel_is_limited_to_the_driver_and_their_passengers(self):
+        communicator, connected, _ = await self.connect(f'/ws/drivers/{self.driver.id}/', self.driver.user)
+        self.assertTrue(connected)
+        publish_ride_status(self.ride)
+        self.assertEqual((await communicator.receive_json_from())['ride'], self.ride.id)
+        await communicator.disconnect()
+
+        stranger = await sync_to_async(create_passenger)('stranger')
+        communicator, connected, code = await self.connect(f'/ws/drivers/{self.driver.id}/', stranger.user)
+        self.assertFalse(connected)
+        self.assertEqual(code, 4403)
+
+
+class RideListQueryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.passenger = create_passenger()
+        self.client.force_authenticate(self.passenger.user)
+        get_identity(self.passenger.user.pk)  # warm, as after any earlier request
+
+    def add_rides(self, count, pings=3):
+        for _ in range(count):
+            ride = create_ride(self.passenger)
+            RideLocation.objects.bulk_create(
+                RideLocation(ride=ride, latitude=0.35, longitude=32.58) for _ in range(pings)
+            )
+
+    def test_list_query_count_does_not_grow_with_page_size(self):
+        self.add_rides(2)
+        with self.assertNumQueries(1):  # one keyset page, no COUNT
+            response = self.client.get('/api/rides/')
+        self.assertNotIn('locations', response.data['results'][0])
+
+        self.add_rides(18)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/rides/')
+        self.assertEqual(len(response.data['results']), 20)
+
+    def test_include_locations_is_a_single_prefetch(self):
+        self.add_rides(2)
+        with self.assertNumQueries(2):  # page + locations
+            self.client.get('/api/rides/?include=locations')
+
+        self.add_rides(18)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/rides/?include=locations')
+        self.assertEqual(len(response.data['results'][0]['locations']), 3)
+
+    def test_retrieve_embeds_locations(self):
+        self.add_rides(1, pings=4)
+        ride = Ride.objects.get()
+        with self.assertNumQueries(3):  # version check + ride + locations
+            response = self.client.get(f'/api/rides/{ride.id}/')
+        self.assertEqual(len(response.data['locations']), 4)
+        self.assertNotIn('ETag', response)  # still live, never cached
+
+    def test_archived_rides_still_embed_their_points(self):
+        self.add_rides(1, pings=4)
+        ride = Ride.objects.get()
+        Ride.objects.filter(pk=ride.pk).update(status='completed')
+        archive_ride_trail(ride)
+        RideLocation.objects.create(ride=ride, latitude=0.36, longitude=32.59)
+
+        with self.assertNumQueries(3):  # version check + ride with trail + live rows
+            locations = self.client.get(f'/api/rides/{ride.id}/').data['locations']
+        self.assertEqual(len(locations), 5)
+        self.assertEqual((locations[0]['id'], locations[0]['latitude'], locations[0]['longitude']), (None, 0.35, 32.58))
+        self.assertIsNotNone(locations[-1]['id'])
+
+    def test_finished_rides_are_cached_by_etag(self):
+        self.add_rides(1, pings=2)
+        ride = Ride.objects.get()
+        Ride.objects.filter(pk=ride.pk).update(status='completed', updated_at=timezone.now())
+        response = self.client.get(f'/api/rides/{ride.id}/')
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(f'/api/rides/{ride.id}/').data, response.data)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(f'/api/rides/{ride.id}/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotEqual(self.client.get(f'/api/rides/{ride.id}/', HTTP_ACCEPT='text/html')['ETag'], etag)
+
+    def test_drivers_only_see_their_own_rides(self):
+        driver = create_driver()
+        self.add_rides(2)
+        Ride.objects.filter(pk=Ride.objects.first().pk).update(driver=driver)
+        self.client.force_authenticate(driver.user)
+        self.assertEqual(len(self.client.get('/api/rides/').data['results']), 1)
+
+    def test_keyset_pages_cover_every_ride_once(self):
+        self.add_rides(7, pings=0)
+        # Ties on created_at are broken by id, so no row is skipped or repeated.
+        Ride.objects.filter(pk__in=list(Ride.objects.values_list('pk', flat=True)[:4])).update(
+            created_at=Ride.objects.earliest('created_at').created_at,
+        )
+        expected = list(Ride.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+        seen, url, pages = [], '/api/rides/?page_size=3', []
+        while url:
+            response = self.client.get(url)
+            pages.append(response.data)
+            seen += [ride['id'] for ride in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(pages), 3)
+        self.assertNotIn('count', pages[0])
+        self.assertIsNone(pages[0]['previous'])
+
+        response = self.client.get(pages[2]['previous'])
+        self.assertEqual([ride['id'] for ride in response.data['results']], expected[3:6])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([ride['id'] for ride in response.data['results']], expected[:3])
+        self.assertIsNone(response.data['previous'])
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get('/api/rides/?cursor=not-a-cursor').status_code, 404)
+
+
+class QueryPlanAuditTests(TestCase):
+    def test_list_endpoints_and_hot_paths_use_indexes(self):
+        out = StringIO()
+        call_command('audit_query_plans', stdout=out)
+        self.assertIn('no sequential scans', out.getvalue())
+
+    def test_audit_leaves_the_data_alone(self):
+        ride = create_ride(
+            create_passenger(), id=1, status='scheduled', scheduled_time=timezone.now() - datetime.timedelta(minutes=1),
+        )
+        call_command('audit_query_plans', stdout=StringIO())
+        ride.refresh_from_db()
+        self.assertEqual(ride.status, 'scheduled')
+
+    def test_full_table_reads_are_flagged(self):
+        unindexed = Ride.objects.filter(cancellation_reason='weather').query.sql_with_params()
+        self.assertEqual(seq_scans(query_plan(*unindexed)), ['rides_ride'])
+        indexed = Ride.objects.filter(passenger_id=1).query.sql_with_params()
+        self.assertEqual(seq_scans(query_plan(*indexed)), [])
+        self.assertEqual(
+            seq_scans(['Seq Scan on rides_ride  (cost=0.00..1.01 rows=1 width=8)'], 'postgresql'), ['rides_ride'],
+        )
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(APITransactionTestCase):
+    # 'replica' mirrors default under test, so rows must be committed for it
+    # to see them, and a TestCase's wrapping transaction would pin every read.
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.passenger = create_passenger()
+        create_ride(self.passenger)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.passenger.user)}')
+
+    def test_reads_go_to_replica_unless_pinned_or_in_a_transaction(self):
+        self.assertEqual(Ride.objects.all().db, 'replica')
+        with pin_primary():
+            self.assertEqual(Ride.objects.all().db, 'default')
+        with transaction.atomic():
+            self.assertEqual(Ride.objects.all().db, 'default')
+        self.assertEqual(Ride.objects.all().db, 'replica')
+
+    def test_history_is_read_from_replica(self):
+        with self.assertNumQueries(0, using='default'), self.assertNumQueries(2, using='replica'):
+            response = self.client.get('/api/rides/')  # user + page
+        self.assertEqual(response.status_code, 200)
+
+    def test_writer_reads_own_writes_from_primary_for_a_while(self):
+        response = self.client.post('/api/rides/request_ride/', {
+            'pickup_location': PICKUP,
+            'dropoff_location': DROPOFF,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        with self.assertNumQueries(0, using='replica'):
+            self.client.get('/api/rides/')
+
+        cache.clear()  # the pin window has passed
+        with self.assertNumQueries(0, using='default'):
+            self.client.get('/api/rides/')
+
+
+class RideStateMachineTests(TestCase):
+    def setUp(self):
+        self.passenger = create_passenger()
+        self.driver = create_driver()
+        self.ride = create_ride(self.passenger)
+
+    def test_transitions_update_only_changed_fields(self):
+        transition(self.ride, 'accept', driver_id=self.driver.id)
+        Ride.objects.filter(pk=self.ride.pk).update(estimated_fare='99.00')
+        transition(self.ride, 'start')
+
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.status, 'started')
+        self.assertIsNotNone(self.ride.started_at)
+        self.assertEqual(str(self.ride.estimated_fare), '99.00')
+
+    def test_stale_status_raises_conflict_without_writing(self):
+        stale = Ride.objects.get(pk=self.ride.pk)
+        transition(self.ride, 'cancel', cancellation_reason='changed plans')
+
+        with self.assertRaises(RideConflict) as caught:
+            transition(stale, 'accept', driver_id=self.driver.id)
+        self.assertEqual(caught.exception.status, 'cancelled')
+        self.assertIsNone(Ride.objects.get(pk=self.ride.pk).driver_id)
+
+    def test_invalid_event_for_status_is_a_conflict(self):
+        with self.assertRaises(RideConflict):
+            transition(self.ride, 'complete')
+
+
+class RideTransitionApiTests(APITestCase):
+    def test_second_driver_to_accept_gets_conflict(self):
+        ride = create_ride(create_passenger())
+        first, second = create_driver('first'), create_driver('second')
+
+        def taken_meanwhile(ride, event, **fields):
+            # The first driver wins between the second one's read and update.
+            transition(Ride.objects.get(pk=ride.pk), event, driver_id=first.id)
+            return transition(ride, event, **fields)
+
+        self.client.force_authenticate(second.user)
+        with mock.patch('rides.views.transition', side_effect=taken_meanwhile):
+            response = self.client.post(f'/api/rides/{ride.id}/accept_ride/')
+
+        self.assertEqual((response.status_code, response.data['status']), (409, 'accepted'))
+        self.assertEqual(Ride.objects.get(pk=ride.pk).driver_id, first.id)
+
+    def test_rides_of_other_drivers_are_not_found(self):
+        ride = create_ride(create_passenger())
+        first, second = create_driver('first'), create_driver('second')
+
+        self.client.force_authenticate(first.user)
+        self.assertEqual(self.client.post(f'/api/rides/{ride.id}/accept_ride/').status_code, 200)
+        self.client.force_authenticate(second.user)
+        response = self.client.post(f'/api/rides/{ride.id}/accept_ride/')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('status', response.data)
+        self.assertEqual(self.client.post(f'/api/rides/{ride.id + 1000}/accept_ride/').status_code, 404)
+
+    def test_passenger_cancel_after_completion_conflicts(self):
+        passenger = create_passenger()
+        ride = create_ride(passenger, status='completed')
+        self.client.force_authenticate(passenger.user)
+        response = self.client.post(f'/api/rides/{ride.id}/cancel_ride/')
+        self.assertEqual((response.status_code, response.data['status']), (409, 'completed'))
+
+
+class RideSchedulerTests(APITestCase):
+    def setUp(self):
+        self.passenger = create_passenger()
+        self.clock = SimulatedClock(datetime.datetime(2030, 1, 1, 8, tzinfo=datetime.timezone.utc).timestamp())
+        self.scheduler = RideScheduler({'LEAD_SECONDS': 600.0, 'MAX_BATCH': 2}, clock=self.clock)
+
+    def at(self, minutes):
+        return self.scheduler.now() + datetime.timedelta(minutes=minutes)
+
+    def test_heap_releases_in_time_order_and_skips_cancelled(self):
+        for ride_id, minutes in ((1, 40), (2, 20), (3, 30), (4, 25)):
+            self.scheduler.schedule(ride_id, self.at(minutes))
+        self.scheduler.cancel(4)
+        self.assertEqual(len(self.scheduler), 3)
+        self.assertEqual(self.scheduler.seconds_to_next(), 600.0)
+
+        self.clock.advance(10 * 60)
+        self.assertEqual(self.scheduler.pop_due(), [2])
+        self.clock.advance(30 * 60)
+        self.assertEqual(self.scheduler.pop_due(), [3, 1])
+        self.assertIsNone(self.scheduler.seconds_to_next())
+
+    def test_future_request_is_held_until_lead_time(self):
+        self.client.force_authenticate(self.passenger.user)
+        with mock.patch('rides.views.ride_scheduler', self.scheduler), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/rides/request_ride/', {
+                'pickup_location': PICKUP, 'dropoff_location': DROPOFF, 'scheduled_time': self.at(60).isoformat(),
+            }, format='json')
+        self.assertEqual(response.data['status'], 'scheduled')
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertEqual(MatchingEngine().open_rides(), [])
+
+        self.clock.advance(49 * 60)
+        self.assertEqual(self.scheduler.run_due(), [])
+        self.clock.advance(60)
+        self.assertEqual(self.scheduler.run_due(), [response.data['id']])
+        self.assertEqual(Ride.objects.get(pk=response.data['id']).status, 'requested')
+
+    def test_cancelled_and_rescheduled_rides_are_not_released(self):
+        cancelled = create_ride(self.passenger, status='scheduled', scheduled_time=self.at(30))
+        moved = create_ride(self.passenger, status='scheduled', scheduled_time=self.at(30))
+        self.scheduler.rebuild_from_db()
+        self.assertEqual(len(self.scheduler), 2)
+
+        self.client.force_authenticate(self.passenger.user)
+        with mock.patch('rides.views.ride_scheduler', self.scheduler), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/rides/{cancelled.id}/cancel_ride/')
+            self.client.patch(f'/api/rides/{moved.id}/', {'scheduled_time': self.at(90).isoformat()}, format='json')
+
+        self.clock.advance(30 * 60)
+        self.assertEqual(self.scheduler.run_due(), [])
+        self.assertEqual(Ride.objects.get(pk=cancelled.id).status, 'cancelled')
+        self.clock.advance(60 * 60)
+        self.assertEqual(self.scheduler.run_due(), [moved.id])
+
+    def test_failed_release_keeps_rides_on_the_heap(self):
+        ride = create_ride(self.passenger, status='scheduled', scheduled_time=self.at(30))
+        self.scheduler.rebuild_from_db()
+        self.clock.advance(20 * 60)
+
+        with mock.patch('rides.scheduler.transition', side_effect=OperationalError('connection lost')):
+            with self.assertRaises(OperationalError):
+                self.scheduler.run_due()
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertEqual(self.scheduler.run_due(), [ride.id])
+        self.assertEqual(Ride.objects.get(pk=ride.id).status, 'requested')
+
+    def test_bringing_a_requested_ride_forward_releases_it(self):
+        ride = create_ride(self.passenger)
+        self.client.force_authenticate(self.passenger.user)
+        with mock.patch('rides.views.ride_scheduler', self.scheduler), self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/rides/{ride.id}/', {'scheduled_time': self.at(120).isoformat()}, format='json')
+            self.assertEqual(Ride.objects.get(pk=ride.id).status, 'scheduled')
+            self.client.patch(f'/api/rides/{ride.id}/', {'scheduled_time': self.at(5).isoformat()}, format='json')
+        self.assertEqual(Ride.objects.get(pk=ride.id).status, 'requested')
+
+
+class RideStateConcurrencyTests(TransactionTestCase):
+    def test_many_threads_accepting_one_ride_have_exactly_one_winner(self):
+        ride = create_ride(create_passenger())
+        drivers = [create_driver(f'driver{n}') for n in range(16)]
+        barrier = threading.Barrier(len(drivers))
+        winners, conflicts, errors = [], [], []
+
+        def accept(driver):
+            try:
+                barrier.wait()
+                transition(Ride.objects.get(pk=ride.pk), 'accept', driver_id=driver.id)
+                winners.append(driver.id)
+            except RideConflict:
+                conflicts.append(driver.id)
+            except Exception as exc:  # pragma: no cover - surfaced below
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=accept, args=(driver,)) for driver in drivers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(len(conflicts), len(drivers) - 1)
+        self.assertEqual(Ride.objects.get(pk=ride.pk).driver_id, winners[0])
+
+
+class RatingAggregateTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.passenger = create_passenger()
+        self.driver = create_driver()
+        self.client.force_authenticate(self.passenger.user)
+
+    def rate(self, value):
+        ride = create_ride(self.passenger, driver=self.driver, status='completed')
+        return self.client.post('/api/ratings/rate_ride/', {'ride_id': ride.id, 'rating': value}, format='json')
+
+    def test_rate_ride_updates_aggregate_profile_and_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for value in (5, 4, 3):
+                self.assertEqual(self.rate(value).status_code, 201)
+
+        self.driver.refresh_from_db()
+        self.assertEqual(self.driver.rating, 4.0)
+        with self.assertNumQueries(1):
+            ratings.get_rating_summary(self.driver.user_id)
+        with self.assertNumQueries(0):
+            summary = ratings.get_rating_summary(self.driver.user_id)
+        self.assertEqual((summary['average'], summary['count']), (4.0, 3))
+
+    def test_invalid_and_duplicate_ratings_are_rejected(self):
+        for value in (6, 4.7, '4.7', True, None, [5]):
+            self.assertEqual(self.rate(value).status_code, 400)
+        self.assertEqual(self.rate('4').status_code, 201)
+        ride = create_ride(self.passenger, driver=self.driver, status='completed')
+        payload = {'ride_id': ride.id, 'rating': 5}
+        self.assertEqual(self.client.post('/api/ratings/rate_ride/', payload, format='json').status_code, 201)
+        self.assertEqual(self.client.post('/api/ratings/rate_ride/', payload, format='json').status_code, 400)
+        self.assertEqual(RatingAggregate.objects.get(user=self.driver.user).rating_count, 2)
+
+    def test_ratings_cannot_be_written_around_the_aggregate(self):
+        ride = create_ride(self.passenger, driver=self.driver, status='completed')
+        payload = {'ride': ride.id, 'rater': self.passenger.user_id, 'ratee': self.driver.user_id, 'rating': 1}
+        self.assertEqual(self.client.post('/api/ratings/', payload, format='json').status_code, 405)
+        self.rate(5)
+        rating = Rating.objects.get()
+        self.assertEqual(self.client.patch(f'/api/ratings/{rating.id}/', {'rating': 1}).status_code, 405)
+        self.assertEqual(self.client.delete(f'/api/ratings/{rating.id}/').status_code, 405)
+        self.assertEqual(self.client.get(f'/api/ratings/{rating.id}/').data['rating'], 5)
+
+    def test_driver_rates_the_passenger(self):
+        ride = create_ride(self.passenger, driver=self.driver, status='completed')
+        self.client.force_authenticate(self.driver.user)
+        self.client.post('/api/ratings/rate_ride/', {'ride_id': ride.id, 'rating': 2}, format='json')
+        self.passenger.refresh_from_db()
+        self.assertEqual(self.passenger.rating, 2.0)
+
+    @mock.patch.object(ratings, 'RECENT_WINDOW', 3)
+    def test_recent_window_rolls_and_backfill_matches(self):
+        for value in (1, 1, 5, 5, 5):
+            self.rate(value)
+        aggregate = RatingAggregate.objects.get(user=self.driver.user)
+        self.assertEqual((aggregate.rating_count, aggregate.recent, aggregate.recent_average), (5, [5, 5, 5], 5.0))
+
+        RatingAggregate.objects.all().delete()
+        call_command('backfill_rating_aggregates', stdout=mock.Mock())
+        rebuilt = RatingAggregate.objects.get(user=self.driver.user)
+        self.assertEqual((rebuilt.rating_sum, rebuilt.recent), (17, [5, 5, 5]))
+        self.assertEqual(Rating.objects.count(), 5)
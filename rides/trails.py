@@ -0,0 +1,147 @@
+import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from rides.models import Ride, RideLocation, RideTrail
+
+FORMAT_VERSION = 1
+COORD_SCALE = 10 ** 6  # ~0.1 m at the equator
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_trail(points):
+    """
+    Pack ``(latitude, longitude, timestamp)`` points into a compact blob.
+
+    Coordinates are fixed-point micro-degrees and timestamps are epoch
+    milliseconds; every value after the first point is stored as a zigzag
+    varint delta from its predecessor, so a typical ping costs 4-7 bytes.
+    """
+    out = bytearray([FORMAT_VERSION])
+    _write_varint(out, len(points))
+    prev_lat = prev_lng = prev_ms = 0
+    for latitude, longitude, timestamp in points:
+        lat = round(latitude * COORD_SCALE)
+        lng = round(longitude * COORD_SCALE)
+        ms = round(timestamp.timestamp() * 1000)
+        _write_varint(out, _zigzag(lat - prev_lat))
+        _write_varint(out, _zigzag(lng - prev_lng))
+        _write_varint(out, _zigzag(ms - prev_ms))
+        prev_lat, prev_lng, prev_ms = lat, lng, ms
+    return bytes(out)
+
+
+def decode_trail(data):
+    data = bytes(data)
+    if not data:
+        return []
+    if data[0] != FORMAT_VERSION:
+        raise ValueError(f'Unsupported trail format {data[0]}')
+    count, pos = _read_varint(data, 1)
+    points = []
+    lat = lng = ms = 0
+    for _ in range(count):
+        delta, pos = _read_varint(data, pos)
+        lat += _unzigzag(delta)
+        delta, pos = _read_varint(data, pos)
+        lng += _unzigzag(delta)
+        delta, pos = _read_varint(data, pos)
+        ms += _unzigzag(delta)
+        points.append((
+            lat / COORD_SCALE,
+            lng / COORD_SCALE,
+            datetime.datetime.fromtimestamp(ms / 1000, tz=datetime.timezone.utc),
+        ))
+    return points
+
+
+def encode_polyline(points, precision=5):
+    """Google encoded polyline for ``(latitude, longitude, ...)`` points."""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lng = 0
+    for point in points:
+        lat = round(point[0] * factor)
+        lng = round(point[1] * factor)
+        for delta in (lat - prev_lat, lng - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lng = lat, lng
+    return ''.join(out)
+
+
+def ride_trail_points(ride):
+    """All points for a ride: the archived trail followed by any live rows."""
+    points = []
+    trail = RideTrail.objects.filter(ride=ride).only('data').first()
+    if trail is not None:
+        points.extend(decode_trail(trail.data))
+    points.extend(
+        RideLocation.objects.filter(ride=ride)
+        .order_by('timestamp', 'id')
+        .values_list('latitude', 'longitude', 'timestamp')
+    )
+    return points
+
+
+def archive_ride_trail(ride):
+    """Fold a ride's ``RideLocation`` rows into its ``RideTrail`` and delete them."""
+    with transaction.atomic():
+        rows = list(
+            RideLocation.objects.select_for_update()
+            .filter(ride=ride)
+            .order_by('timestamp', 'id')
+            .values_list('id', 'latitude', 'longitude', 'timestamp')
+        )
+        if not rows:
+            return None
+        trail = RideTrail.objects.select_for_update().filter(ride=ride).first()
+        points = decode_trail(trail.data) if trail is not None else []
+        points.extend(row[1:] for row in rows)
+        points.sort(key=lambda point: point[2])
+
+        values = {
+            'data': encode_trail(points),
+            'point_count': len(points),
+            'started_at': points[0][2],
+            'ended_at': points[-1][2],
+        }
+        if trail is None:
+            trail = RideTrail.objects.create(ride=ride, **values)
+        else:
+            for field, value in values.items():
+                setattr(trail, field, value)
+            trail.save(update_fields=list(values))
+        RideLocation.objects.filter(id__in=[row[0] for row in rows]).delete()
+        # The live points leave the ride's payload, so it is a new version.
+        Ride.objects.filter(pk=ride.pk).update(updated_at=timezone.now())
+    return trail
@@ -1,127 +1,341 @@
-from rest_framework import viewsets, status
+from rest_framework import serializers, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, Q
 from django.utils import timezone
 from rides.models import Ride, RideLocation, Rating
-from rides.serializers import RideSerializer, RideLocationSerializer, RatingSerializer
-from users.models import PassengerProfile, DriverProfile
+from rides.serializers import (
+    RideSerializer, RideListSerializer, RideLocationSerializer, RatingSerializer, validate_fare, validate_point,
+)
+from users.identity import request_identity
+from drivers.earnings import record_completed_ride
+from drivers.presence import driver_presence
+from payments.pricing import quote, quote_batch, quote_rows, vehicle_types
+from payments.settlement import enqueue_ride_payment
+from payments.surge import surge_grid
+from rides.ingestion import IngestionBackpressure, ingestion_settings, location_ingestor
+from rides.matching import matching_settings
+from rides.ratings import get_rating_summary, record_rating
+from rides.scheduler import ride_scheduler
+from rides.realtime import publish_ride_location
+from rides.state import RideConflict, transition
+from rides.trails import archive_ride_trail, encode_polyline, ride_trail_points
+from rideshare_backend.conditional import ConditionalMixin
+from rideshare_backend.pagination import KeysetPagination
 
-class RideViewSet(viewsets.ModelViewSet):
+MAX_QUOTES_PER_REQUEST = 5000
+
+class RideViewSet(ConditionalMixin, viewsets.ModelViewSet):
     queryset = Ride.objects.all()
     serializer_class = RideSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    version_fields = ('updated_at', 'status')
+    
+    def cacheable(self, row):
+        # Only finished rides stop changing; live ones are re-serialized.
+        return row[2] in ('completed', 'cancelled')
     
     def get_queryset(self):
-        user = self.request.user
-        if hasattr(user, 'passenger_profile'):
-            return Ride.objects.filter(passenger__user=user)
-        elif hasattr(user, 'driver_profile'):
-            return Ride.objects.filter(driver__user=user)
-        return Ride.objects.none()
+        # Profile ids come from the identity cache, so picking the filter
+        # costs no profile lookup and the filter needs no join.
+        identity = request_identity(self.request)
+        if identity.user_type == 'passenger' and identity.passenger_profile_id:
+            queryset = Ride.objects.filter(passenger_id=identity.passenger_profile_id)
+        elif identity.user_type == 'driver' and identity.driver_profile_id:
+            driver_id = identity.driver_profile_id
+            if self.action == 'accept_ride':
+                # Open rides are not the driver's yet; any other ride is a
+                # 404, so its status is not given away. One taken between
+                # this read and the conditional transition is still a 409.
+                queryset = Ride.objects.filter(Q(status='requested') | Q(driver_id=driver_id))
+            else:
+                queryset = Ride.objects.filter(driver_id=driver_id)
+        else:
+            return Ride.objects.none()
+        if self.action == 'list' and not self.include_locations():
+            return queryset
+        return queryset.select_related('trail').prefetch_related(
+            Prefetch('locations', queryset=RideLocation.objects.only('id', 'ride_id', 'latitude', 'longitude', 'timestamp'))
+        )
+    
+    def get_serializer_class(self):
+        if self.action == 'list' and not self.include_locations():
+            return RideListSerializer
+        return RideSerializer
+    
+    def include_locations(self):
+        include = self.request.query_params.get('include', '')
+        return 'locations' in include.split(',')
     
     @action(detail=False, methods=['post'])
     def request_ride(self, request):
-        try:
-            passenger = PassengerProfile.objects.get(user=request.user)
-        except PassengerProfile.DoesNotExist:
+        passenger_id = request_identity(request).passenger_profile_id
+        if passenger_id is None:
             return Response({'error': 'Passenger profile not found'}, status=status.HTTP_404_NOT_FOUND)
         
         serializer = RideSerializer(data=request.data)
         if serializer.is_valid():
-            ride = serializer.save(passenger=passenger, status='requested')
+            ride = self._save_priced(serializer, passenger_id=passenger_id, status='requested')
             return Response(RideSerializer(ride).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    def perform_create(self, serializer):
+        passenger_id = request_identity(self.request).passenger_profile_id
+        if passenger_id is None:
+            raise PermissionDenied('Passenger profile not found')
+        self._save_priced(serializer, passenger_id=passenger_id)
+    
+    def _save_priced(self, serializer, **extra):
+        # Estimates come from the pricing engine, never from the client.
+        data = serializer.validated_data
+        pickup = data['pickup_location']
+        surge = surge_grid.multiplier_at(pickup['lat'], pickup['lng'])
+        fare = quote(pickup, data['dropoff_location'], data.get('vehicle_type', 'economy'), surge=surge)
+        if not ride_scheduler.is_due(data.get('scheduled_time')):
+            # Held back from matching until the scheduler releases it.
+            extra['status'] = 'scheduled'
+        ride = serializer.save(
+            estimated_distance=fare['distance_km'],
+            estimated_duration=fare['duration_min'],
+            estimated_fare=fare['total_amount'],
+            surge_multiplier=fare['surge_multiplier'],
+            **extra
+        )
+        if ride.status == 'requested':
+            surge_grid.ride_opened(ride.id, pickup['lat'], pickup['lng'])
+        elif ride.status == 'scheduled':
+            transaction.on_commit(lambda: ride_scheduler.schedule(ride.id, ride.scheduled_time))
+        return ride
+    
+    def perform_update(self, serializer):
+        ride = serializer.save()
+        if 'scheduled_time' not in serializer.validated_data:
+            return
+        due = ride_scheduler.is_due(ride.scheduled_time)
+        if ride.status == 'requested' and not due:
+            try:
+                transition(ride, 'hold')
+            except RideConflict:
+                return
+        if ride.status == 'scheduled':
+            # A superseded heap entry is harmless: release re-checks the stored time.
+            if due:
+                transaction.on_commit(lambda: ride_scheduler.release([ride.id]))
+            else:
+                transaction.on_commit(lambda: ride_scheduler.schedule(ride.id, ride.scheduled_time))
+    
+    @action(detail=False, methods=['post'])
+    def estimate_fares(self, request):
+        trips = request.data.get('trips')
+        if not isinstance(trips, list) or not 0 < len(trips) <= MAX_QUOTES_PER_REQUEST:
+            return Response(
+                {'error': f'trips must be a list of 1 to {MAX_QUOTES_PER_REQUEST} items'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        known_types = set(vehicle_types())
+        try:
+            points = [(validate_point(trip['pickup']), validate_point(trip['dropoff'])) for trip in trips]
+            types = [trip.get('vehicle_type', 'economy') for trip in trips]
+        except (KeyError, TypeError, AttributeError, serializers.ValidationError):
+            return Response(
+                {'error': 'Each trip needs pickup and dropoff objects with lat and lng in range'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not all(isinstance(vehicle_type, str) for vehicle_type in types):
+            return Response({'error': 'vehicle_type must be a string'}, status=status.HTTP_400_BAD_REQUEST)
+        pickups = [(pickup['lat'], pickup['lng']) for pickup, _ in points]
+        dropoffs = [(dropoff['lat'], dropoff['lng']) for _, dropoff in points]
+        unknown = set(types) - known_types
+        if unknown:
+            return Response({'error': f'Unknown vehicle types: {sorted(unknown)}'}, status=status.HTTP_400_BAD_REQUEST)
+        surge = surge_grid.multipliers_for(pickups)
+        return Response({'quotes': quote_rows(quote_batch(pickups, dropoffs, types, surge=surge))})
+    
     @action(detail=True, methods=['post'])
     def accept_ride(self, request, pk=None):
-        ride = self.get_object()
-        try:
-            driver = DriverProfile.objects.get(user=request.user)
-        except DriverProfile.DoesNotExist:
-            return Response({'error': 'Driver profile not found'}, status=status.HTTP_404_NOT_FOUND)
+        if matching_settings()['ENABLED']:
+            return Response({'error': 'Rides are assigned by dispatch'}, status=status.HTTP_400_BAD_REQUEST)
         
-        if ride.status != 'requested':
-            return Response({'error': 'Ride is not available'}, status=status.HTTP_400_BAD_REQUEST)
+        driver_id = request_identity(request).driver_profile_id
+        if driver_id is None:
+            return Response({'error': 'Driver profile not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        ride.driver = driver
-        ride.status = 'accepted'
-        ride.save()
+        ride = self.get_object()
+        try:
+            transition(ride, 'accept', driver_id=driver_id)
+        except RideConflict as exc:
+            return self._conflict(exc, 'Ride is not available')
+        driver_presence.set_busy(driver_id, True)
         return Response(RideSerializer(ride).data)
     
     @action(detail=True, methods=['post'])
     def start_ride(self, request, pk=None):
         ride = self.get_object()
-        if ride.status != 'accepted':
-            return Response({'error': 'Ride cannot be started'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        ride.status = 'started'
-        ride.started_at = timezone.now()
-        ride.save()
+        try:
+            transition(ride, 'start')
+        except RideConflict as exc:
+            return self._conflict(exc, 'Ride cannot be started')
         return Response(RideSerializer(ride).data)
     
     @action(detail=True, methods=['post'])
     def complete_ride(self, request, pk=None):
         ride = self.get_object()
-        if ride.status != 'started':
-            return Response({'error': 'Ride cannot be completed'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        ride.status = 'completed'
-        ride.completed_at = timezone.now()
-        ride.actual_fare = request.data.get('actual_fare', ride.estimated_fare)
-        ride.save()
+        try:
+            actual_fare = validate_fare(request.data.get('actual_fare', ride.estimated_fare), ride.estimated_fare)
+        except serializers.ValidationError as exc:
+            return Response({'actual_fare': exc.detail}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with transaction.atomic():
+                transition(ride, 'complete', actual_fare=actual_fare)
+                record_completed_ride(ride)
+                # Committed with the completion, so no completed ride is left
+                # without a payment; the processor is called in the background.
+                enqueue_ride_payment(ride)
+        except RideConflict as exc:
+            return self._conflict(exc, 'Ride cannot be completed')
+        location_ingestor.forget_ride(ride.id)
+        location_ingestor.flush(ride_id=ride.id)
+        archive_ride_trail(ride)
+        self._release_driver(ride)
         return Response(RideSerializer(ride).data)
     
     @action(detail=True, methods=['post'])
     def cancel_ride(self, request, pk=None):
         ride = self.get_object()
-        if ride.status in ['completed', 'cancelled']:
-            return Response({'error': 'Ride cannot be cancelled'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        ride.status = 'cancelled'
-        ride.cancelled_at = timezone.now()
-        ride.cancellation_reason = request.data.get('reason', '')
-        ride.save()
+        was_scheduled = ride.status == 'scheduled'
+        try:
+            transition(ride, 'cancel', cancellation_reason=request.data.get('reason', ''))
+        except RideConflict as exc:
+            return self._conflict(exc, 'Ride cannot be cancelled')
+        if was_scheduled:
+            ride_scheduler.cancel(ride.id)
+        location_ingestor.forget_ride(ride.id)
+        self._release_driver(ride)
         return Response(RideSerializer(ride).data)
+    
+    def _conflict(self, exc, message):
+        return Response({'error': message, 'status': exc.status}, status=status.HTTP_409_CONFLICT)
+    
+    @action(detail=True, methods=['get'])
+    def trail(self, request, pk=None):
+        ride = self.get_object()
+        points = ride_trail_points(ride)
+        data = {
+            'ride': ride.id,
+            'points': len(points),
+            'polyline': encode_polyline(points),
+            'started_at': points[0][2] if points else None,
+            'ended_at': points[-1][2] if points else None,
+        }
+        if request.query_params.get('timestamps') in ('1', 'true'):
+            data['timestamps'] = [point[2] for point in points]
+        return Response(data)
+    
+    def _release_driver(self, ride):
+        # Put the driver back into the dispatch pool once the trip is over.
+        if ride.driver_id is None or not driver_presence.is_online(ride.driver_id):
+            return
+        points = ride_trail_points(ride)
+        location = {'lat': points[-1][0], 'lng': points[-1][1]} if points else None
+        driver_presence.set_busy(ride.driver_id, False, location)
 
 class RideLocationViewSet(viewsets.ModelViewSet):
     queryset = RideLocation.objects.all()
     serializer_class = RideLocationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('timestamp', 'id')
     
     @action(detail=False, methods=['post'])
     def update_location(self, request):
-        ride_id = request.data.get('ride_id')
         try:
-            ride = Ride.objects.get(id=ride_id)
-        except Ride.DoesNotExist:
+            ride_id = int(request.data.get('ride_id'))
+            latitude = float(request.data.get('latitude'))
+            longitude = float(request.data.get('longitude'))
+        except (TypeError, ValueError):
+            return Response({'error': 'ride_id, latitude and longitude are required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not ingestion_settings()['BUFFERED']:
+            try:
+                ride = Ride.objects.get(id=ride_id)
+            except Ride.DoesNotExist:
+                return Response({'error': 'Ride not found'}, status=status.HTTP_404_NOT_FOUND)
+            location = RideLocation.objects.create(ride=ride, latitude=latitude, longitude=longitude)
+            if ride.driver_id is not None:
+                driver_presence.heartbeat(ride.driver_id, {'lat': latitude, 'lng': longitude})
+            publish_ride_location(ride_id, latitude, longitude, location.timestamp, ride.driver_id)
+            return Response(RideLocationSerializer(location).data, status=status.HTTP_201_CREATED)
+        
+        exists, driver_id = location_ingestor.active_ride(ride_id)
+        if not exists:
             return Response({'error': 'Ride not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        location = RideLocation.objects.create(
-            ride=ride,
-            latitude=request.data.get('latitude'),
-            longitude=request.data.get('longitude')
+        timestamp = timezone.now()
+        try:
+            location_ingestor.submit(ride_id, latitude, longitude, timestamp)
+        except IngestionBackpressure:
+            return Response(
+                {'error': 'Location updates are backing up, retry shortly'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '1'},
+            )
+        if driver_id is not None:
+            driver_presence.heartbeat(driver_id, {'lat': latitude, 'lng': longitude})
+        publish_ride_location(ride_id, latitude, longitude, timestamp, driver_id)
+        return Response(
+            {'ride_id': ride_id, 'latitude': latitude, 'longitude': longitude, 'timestamp': timestamp},
+            status=status.HTTP_202_ACCEPTED,
         )
-        return Response(RideLocationSerializer(location).data, status=status.HTTP_201_CREATED)
 
-class RatingViewSet(viewsets.ModelViewSet):
+class RatingViewSet(viewsets.ReadOnlyModelViewSet):
+    # Ratings are only written through rate_ride, which keeps the
+    # aggregates and profile ratings in step with the table.
     queryset = Rating.objects.all()
     serializer_class = RatingSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
     
     @action(detail=False, methods=['post'])
     def rate_ride(self, request):
         ride_id = request.data.get('ride_id')
         try:
-            ride = Ride.objects.get(id=ride_id)
-        except Ride.DoesNotExist:
+            ride = Ride.objects.select_related('passenger', 'driver').get(id=ride_id)
+        except (Ride.DoesNotExist, ValueError, TypeError):
             return Response({'error': 'Ride not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        rating = Rating.objects.create(
-            ride=ride,
-            rater=request.user,
-            ratee=ride.driver.user if ride.driver else ride.passenger.user,
-            rating=request.data.get('rating'),
-            comment=request.data.get('comment', '')
-        )
+        value = request.data.get('rating')
+        if isinstance(value, str) and value.strip().isdigit():
+            value = int(value)
+        if type(value) is not int or not 1 <= value <= 5:
+            return Response({'error': 'rating must be an integer from 1 to 5'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if ride.driver and request.user.id == ride.driver.user_id:
+            ratee_id = ride.passenger.user_id
+        else:
+            ratee_id = ride.driver.user_id if ride.driver else ride.passenger.user_id
+        
+        try:
+            with transaction.atomic():
+                rating = Rating.objects.create(
+                    ride=ride,
+                    rater=request.user,
+                    ratee_id=ratee_id,
+                    rating=value,
+                    comment=request.data.get('comment', '')
+                )
+                record_rating(rating)
+        except IntegrityError:
+            return Response({'error': 'Ride has already been rated'}, status=status.HTTP_400_BAD_REQUEST)
         return Response(RatingSerializer(rating).data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        try:
+            user_id = int(request.query_params.get('user', request.user.id))
+        except (TypeError, ValueError):
+            return Response({'error': 'user must be an id'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(get_rating_summary(user_id))
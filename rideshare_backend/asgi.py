@@ -7,10 +7,46 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
+import logging
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rideshare_backend.settings')
 
-application = get_asgi_application()
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.security.websocket import AllowedHostsOriginValidator  # noqa: E402
+
+from drivers.presence import driver_presence  # noqa: E402
+from payments.settlement import settlement_worker  # noqa: E402
+from payments.surge import surge_grid  # noqa: E402
+from rides.matching import matching_engine  # noqa: E402
+from rides.routing import websocket_urlpatterns  # noqa: E402
+from rides.scheduler import ride_scheduler  # noqa: E402
+from users.authentication import JWTAuthMiddleware  # noqa: E402
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(JWTAuthMiddleware(URLRouter(websocket_urlpatterns))),
+})
+
+driver_presence.rebuild_from_db()
+driver_presence.start()
+
+# Picks up payments left pending by a previous run.
+if settlement_worker.configured:
+    settlement_worker.start()
+else:
+    logging.getLogger(__name__).warning('SETTLEMENT["PROCESSOR"] is not set; ride payments will stay pending')
+
+if matching_engine.options['ENABLED']:
+    matching_engine.start()
+
+if surge_grid.options['ENABLED']:
+    surge_grid.rebuild_from_db()
+
+if ride_scheduler.options['ENABLED']:
+    ride_scheduler.rebuild_from_db()
+    ride_scheduler.start()
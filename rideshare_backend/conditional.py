@@ -0,0 +1,122 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+DEFAULTS = {
+    'ENABLED': True,
+    'PAYLOAD_TTL': 300,
+}
+
+
+def response_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'RESPONSE_CACHE', {})}
+
+
+def payload_key(model, key):
+    return f'payload:{model._meta.label_lower}:{key}'
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def conditional_response(request, etag, last_modified, key, build):
+    """
+    Answer with ``build()``'s payload for version ``etag`` as cheaply as possible.
+
+    A client that already holds ``etag`` (or a copy newer than
+    ``last_modified``) gets a bodiless 304. Otherwise the payload comes
+    from the shared cache under ``key`` if it was stored for the same
+    ETag, and only then is ``build`` called to serialize it. Stored
+    payloads are the serializer's data, so one entry serves every
+    renderer; the ETag itself names the negotiated format.
+    """
+    options = response_cache_settings()
+    if not options['ENABLED']:
+        return Response(build())
+    timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        entry = cache.get(key)
+        if entry is not None and entry[0] == etag:
+            data = entry[1]
+        else:
+            data = build()
+            cache.set(key, (etag, data), options['PAYLOAD_TTL'])
+        response = Response(data)
+    response['ETag'] = etag
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ('Accept', 'Authorization'))
+    return response
+
+
+class ConditionalMixin:
+    """
+    ETag/Last-Modified validators and a payload cache for read endpoints.
+
+    Before anything is serialized, ``version_fields`` (``updated_at``
+    columns of the object and of the related rows in its payload) are read
+    for the requested rows in one query and hashed, with ``version_extra``
+    for anything the serializer takes from outside the database, into the
+    ETag. A repeat fetch then costs that query and either a 304 or a cache
+    read. Every write to a versioned row must bump its ``updated_at``.
+
+    ``retrieve`` is always covered; ``cached_list`` also covers ``list``,
+    meant for querysets scoped to the requesting user that hold a row or
+    two. ``cacheable(row)`` can opt rows out, e.g. rides still in
+    progress; those are served as before.
+    """
+
+    version_fields = ('updated_at',)
+    cached_list = False
+
+    def version_extra(self, pk):
+        return ()
+
+    def cacheable(self, row):
+        return True
+
+    def _versions(self, queryset):
+        return list(queryset.prefetch_related(None).order_by('pk').values_list('pk', *self.version_fields))
+
+    def _etag(self, request, rows):
+        parts = [request.accepted_renderer.format, request.get_full_path()]
+        for row in rows:
+            parts.append((row, self.version_extra(row[0])))
+        stamps = [value for row in rows for value in row[1:] if hasattr(value, 'timestamp')]
+        return make_etag(self.queryset.model._meta.label_lower, *parts), max(stamps, default=None)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not response_cache_settings()['ENABLED']:
+            return super().retrieve(request, *args, **kwargs)
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup]})
+        rows = self._versions(queryset)
+        if not rows:
+            raise Http404
+        if not self.cacheable(rows[0]):
+            return super().retrieve(request, *args, **kwargs)
+        etag, last_modified = self._etag(request, rows)
+        return conditional_response(
+            request, etag, last_modified, payload_key(self.queryset.model, rows[0][0]),
+            lambda: self.get_serializer(self.get_object()).data,
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not self.cached_list or not response_cache_settings()['ENABLED']:
+            return super().list(request, *args, **kwargs)
+        rows = self._versions(self.filter_queryset(self.get_queryset()))
+        if not all(self.cacheable(row) for row in rows):
+            return super().list(request, *args, **kwargs)
+        etag, last_modified = self._etag(request, rows)
+        return conditional_response(
+            request, etag, last_modified, payload_key(self.queryset.model, f'list:{request.user.pk}'),
+            lambda: super(ConditionalMixin, self).list(request, *args, **kwargs).data,
+        )
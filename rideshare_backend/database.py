@@ -0,0 +1,76 @@
+import importlib.util
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+POOL_MODES = ('off', 'persistent', 'psycopg', 'pgbouncer')
+
+
+def _env_int(env, name, default):
+    return int(env.get(name, default))
+
+
+def psycopg3_available():
+    return importlib.util.find_spec('psycopg') is not None
+
+
+def connection_settings(mode, env=os.environ):
+    """
+    Connection reuse keys for a PostgreSQL ``DATABASES`` entry.
+
+    ``off`` opens a connection per request. ``persistent`` keeps one per
+    worker thread for ``DB_CONN_MAX_AGE`` seconds and health-checks it
+    before reuse. ``psycopg`` hands connections out of a psycopg 3 pool
+    (``DB_POOL_MIN_SIZE``/``DB_POOL_MAX_SIZE``, with at most
+    ``DB_POOL_MAX_WAITING`` requests queued for one), which is what ASGI
+    needs since its threads do not keep persistent connections warm.
+    ``pgbouncer`` assumes a pgbouncer in transaction mode in front of the
+    database, so server-side cursors and prepared statements are disabled.
+    """
+    if mode not in POOL_MODES:
+        raise ImproperlyConfigured(f'DB_POOL must be one of {", ".join(POOL_MODES)}, not {mode!r}')
+
+    if mode == 'off':
+        return {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'OPTIONS': {}}
+
+    if mode == 'persistent':
+        return {
+            'CONN_MAX_AGE': _env_int(env, 'DB_CONN_MAX_AGE', 60),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+
+    if mode == 'psycopg':
+        if not psycopg3_available():
+            raise ImproperlyConfigured('DB_POOL=psycopg needs psycopg 3: pip install "psycopg[binary,pool]"')
+        from psycopg_pool import ConnectionPool
+
+        # Django refuses a persistent connection on top of a pool; the pool
+        # itself keeps connections open and checks them on checkout.
+        return {
+            'CONN_MAX_AGE': 0,
+            'CONN_HEALTH_CHECKS': False,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': _env_int(env, 'DB_POOL_MIN_SIZE', 2),
+                    'max_size': _env_int(env, 'DB_POOL_MAX_SIZE', 10),
+                    'max_waiting': _env_int(env, 'DB_POOL_MAX_WAITING', 50),
+                    'timeout': float(env.get('DB_POOL_TIMEOUT', 10)),
+                    'max_idle': float(env.get('DB_POOL_MAX_IDLE', 300)),
+                    'max_lifetime': float(env.get('DB_POOL_MAX_LIFETIME', 1800)),
+                    'check': ConnectionPool.check_connection,
+                },
+            },
+        }
+
+    options = {}
+    if psycopg3_available():
+        # Transaction pooling hands each transaction to any server
+        # connection, so statements prepared on one are missing on the next.
+        options['prepare_threshold'] = None
+    return {
+        'CONN_MAX_AGE': _env_int(env, 'DB_CONN_MAX_AGE', 0),
+        'CONN_HEALTH_CHECKS': True,
+        'DISABLE_SERVER_SIDE_CURSORS': True,
+        'OPTIONS': options,
+    }
@@ -0,0 +1,110 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_pinned = ContextVar('db_pinned_to_primary', default=False)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_cache_key(user_id):
+    return f'db-primary-pin:{user_id}'
+
+
+def pin_user(user_id):
+    """Send ``user_id``'s reads to the primary until replicas have caught up with their write."""
+    cache.set(pin_cache_key(user_id), True, getattr(settings, 'DATABASE_PRIMARY_PIN_SECONDS', 5))
+
+
+def user_is_pinned(user_id):
+    return user_id is not None and cache.get(pin_cache_key(user_id)) is not None
+
+
+@contextmanager
+def pin_primary():
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Send reads to a ``DATABASE_REPLICAS`` alias and everything else to default.
+
+    Reads stay on the primary while pinned (see ``ReplicaPinMiddleware``),
+    inside a transaction on the primary, and when they follow an instance
+    that was itself loaded from a particular database.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        aliases = replicas()
+        if not aliases or _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinMiddleware:
+    """
+    Keep each user on the primary for a short window after they write.
+
+    Unsafe requests run entirely against the primary and, if they succeed,
+    pin their user for ``DATABASE_PRIMARY_PIN_SECONDS``. Safe requests from a
+    pinned user read from the primary too. The user is taken from the JWT
+    claim, since DRF authenticates only after middleware has run; with more
+    than one worker the pins need a shared cache backend.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replicas():
+            return self.get_response(request)
+
+        user_id = self.user_id(request)
+        if request.method not in SAFE_METHODS:
+            with pin_primary():
+                response = self.get_response(request)
+            if user_id is not None and response.status_code < 400:
+                pin_user(user_id)
+            return response
+
+        if user_is_pinned(user_id):
+            with pin_primary():
+                return self.get_response(request)
+        return self.get_response(request)
+
+    def user_id(self, request):
+        header = request.headers.get('Authorization', '')
+        parts = header.split()
+        if len(parts) != 2 or parts[0] not in api_settings.AUTH_HEADER_TYPES:
+            return None
+        try:
+            return AccessToken(parts[1]).get(api_settings.USER_ID_CLAIM)
+        except TokenError:
+            return None
@@ -0,0 +1,126 @@
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on a unique ``(created_at, id)``-style key.
+
+    Each page is one ``WHERE key < cursor ORDER BY key LIMIT n + 1`` query
+    that a matching composite index serves directly, so page 10,000 costs
+    the same as page 1 and no ``COUNT(*)`` is run. Views pick the key with
+    ``keyset_ordering`` (default ``('-created_at', '-id')``); the last field
+    must be unique. Cursors are opaque and carry the boundary row's key.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 100
+    default_ordering = ('-created_at', '-id')
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, 'keyset_ordering', self.default_ordering))
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, values, reverse):
+        payload = json.dumps({'k': values, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        raw = request.query_params.get(self.cursor_query_param)
+        if not raw:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(raw + '=' * (-len(raw) % 4)))
+            values, reverse = payload['k'], bool(payload['r'])
+        except (binascii.Error, ValueError, KeyError, TypeError):
+            raise NotFound('Invalid cursor')
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+        return values, reverse
+
+    def seek(self, values, reverse):
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y), per field direction.
+        condition = Q()
+        for position in range(len(self.ordering) - 1, -1, -1):
+            field = self.ordering[position].lstrip('-')
+            descending = self.ordering[position].startswith('-') != reverse
+            step = Q(**{f'{field}__{"lt" if descending else "gt"}': values[position]})
+            if position < len(self.ordering) - 1:
+                step |= Q(**{field: values[position]}) & condition
+            condition = step
+        # The redundant bound on the leading field gives the planner an index range to start from.
+        field = self.ordering[0].lstrip('-')
+        descending = self.ordering[0].startswith('-') != reverse
+        return Q(**{f'{field}__{"lte" if descending else "gte"}': values[0]}) & condition
+
+    def key(self, obj):
+        values = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return values
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(view)
+        size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self.seek(values, reverse))
+
+        rows = list(queryset[:size + 1])
+        more = len(rows) > size
+        rows = rows[:size]
+        if reverse:
+            rows.reverse()
+
+        self.next_cursor = self.previous_cursor = None
+        if rows:
+            if more or reverse:
+                self.next_cursor = self.encode_cursor(self.key(rows[-1]), False)
+            if values is not None and (more or not reverse):
+                self.previous_cursor = self.encode_cursor(self.key(rows[0]), True)
+        return rows
+
+    def link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.link(self.next_cursor),
+            'previous': self.link(self.previous_cursor),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
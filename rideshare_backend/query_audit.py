@@ -0,0 +1,150 @@
+import re
+import warnings
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from rideshare_backend.db_router import pin_primary
+from rideshare_backend.pagination import KeysetPagination
+
+QueryPlan = namedtuple('QueryPlan', ('label', 'sql', 'plan', 'seq_scans'))
+
+SEQ_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    # "SCAN t USING [COVERING] INDEX i" walks an index; a bare "SCAN t" reads the table.
+    'sqlite': re.compile(r'^SCAN (\w+)$'),
+}
+
+
+def audit_identities():
+    from users.identity import Identity
+
+    # Ids only need to be truthy; nothing is read for these users.
+    base = {'username': 'audit', 'is_active': True, 'is_staff': False, 'is_superuser': False}
+    return {
+        'passenger': Identity(1, user_type='passenger', passenger_profile_id=1, driver_profile_id=None, **base),
+        'driver': Identity(1, user_type='driver', passenger_profile_id=None, driver_profile_id=1, **base),
+    }
+
+
+def hot_queries():
+    """Queries outside the viewsets that run on every dispatch window or at startup."""
+    from admin_panel.metrics import dashboard, event_counts, sample_gauges
+    from drivers.earnings import earnings_history, earnings_summary
+    from drivers.presence import DriverPresence
+    from drivers.spatial import DriverSpatialIndex
+    from payments.settlement import SettlementWorker
+    from payments.surge import SurgeGrid
+    from rides.matching import MatchingEngine
+    from rides.models import Ride
+    from rides.scheduler import RideScheduler
+
+    mark = timezone.now() - timedelta(minutes=1)
+
+    return {
+        'matching open rides': lambda: MatchingEngine(index=DriverSpatialIndex()).open_rides(),
+        'presence rebuild': lambda: DriverPresence(DriverSpatialIndex(), autostart=False).rebuild_from_db(),
+        'surge rebuild': lambda: SurgeGrid().rebuild_from_db(index=DriverSpatialIndex()),
+        'settlement claim': lambda: list(SettlementWorker(autostart=False).due(timezone.now())[:100]),
+        'earnings dashboard': lambda: (earnings_summary(1), earnings_history(1, 'day')),
+        'metrics rollup': lambda: (
+            event_counts(Ride.objects.filter(updated_at__gt=mark), mark, timezone.now()), sample_gauges(),
+        ),
+        'metrics dashboard': dashboard,
+        'scheduler rebuild': lambda: RideScheduler().rebuild_from_db(),
+        'scheduler release': lambda: RideScheduler().release([1, 2, 3]),
+    }
+
+
+def seq_scans(plan, vendor=None):
+    pattern = SEQ_SCAN_PATTERNS.get(vendor or connection.vendor)
+    if pattern is None:
+        return []
+    return [match.group(1) for line in plan for match in [pattern.search(line.strip())] if match]
+
+
+def query_plan(sql, params=None):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN {sql}', params)
+        return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+
+
+@contextmanager
+def prefer_indexes():
+    # On small tables PostgreSQL rightly prefers a seq scan; with it priced
+    # out, one that remains means no usable index.
+    if connection.vendor != 'postgresql':
+        yield
+        return
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        yield
+
+
+def keyset_cursor(viewset, queryset):
+    paginator = viewset.pagination_class()
+    paginator.ordering = paginator.get_ordering(viewset)
+    values = []
+    for field in paginator.ordering:
+        model_field = queryset.model._meta.get_field(field.lstrip('-'))
+        values.append(timezone.now().isoformat() if model_field.get_internal_type() == 'DateTimeField' else 0)
+    return paginator.encode_cursor(values, False)
+
+
+def viewset_requests():
+    """``(label, callable)`` for every routed viewset's list, once per role and per page kind."""
+    from rideshare_backend.urls import router
+    from users.identity import identity_user
+
+    factory = APIRequestFactory()
+    requests = []
+    for prefix, viewset, _ in router.registry:
+        view = viewset.as_view({'get': 'list'})
+        for role, identity in audit_identities().items():
+            pages = {'first page': {}}
+            if issubclass(viewset.pagination_class or object, KeysetPagination):
+                pages['next page'] = {'cursor': keyset_cursor(viewset, viewset.queryset)}
+            for page, query in pages.items():
+                def run(view=view, prefix=prefix, query=query, identity=identity):
+                    request = factory.get(f'/api/{prefix}/', query)
+                    force_authenticate(request, user=identity_user(identity))
+                    return view(request)
+                requests.append((f'{prefix} list ({role}, {page})', run))
+    return requests
+
+
+def audit():
+    """
+    EXPLAIN every SELECT the viewset lists and hot paths issue; returns ``QueryPlan``s.
+
+    Some hot paths write (the scheduler releases rides), so everything runs
+    in one transaction that is always rolled back.
+    """
+    targets = viewset_requests() + list(hot_queries().items())
+    plans = []
+    with pin_primary(), transaction.atomic():
+        try:
+            with prefer_indexes():
+                for label, run in targets:
+                    with CaptureQueriesContext(connection) as captured, warnings.catch_warnings():
+                        warnings.simplefilter('ignore', UnorderedObjectListWarning)
+                        run()
+                    for query in captured.captured_queries:
+                        sql = query['sql']
+                        if not sql.lstrip().upper().startswith('SELECT'):
+                            continue
+                        plan = query_plan(sql)
+                        plans.append(QueryPlan(label, sql, plan, seq_scans(plan)))
+        finally:
+            transaction.set_rollback(True)
+    return plans
@@ -1,6 +1,9 @@
+import importlib.util
 import os
 from pathlib import Path
 
+from rideshare_backend.database import connection_settings
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = 'django-insecure-your-secret-key-change-in-production'
@@ -19,6 +22,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'corsheaders',
+    'channels',
     'users',
     'rides',
     'drivers',
@@ -33,6 +37,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'rideshare_backend.db_router.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -58,17 +63,36 @@ TEMPLATES = [
 WSGI_APPLICATION = 'rideshare_backend.wsgi.application'
 ASGI_APPLICATION = 'rideshare_backend.asgi.application'
 
+# DB_POOL picks how connections are reused: off, persistent, psycopg (a
+# psycopg 3 pool, recommended under daphne) or pgbouncer (transaction mode).
+# See rideshare_backend/database.py for the tuning variables of each.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'rideshare_db',
+        'NAME': os.getenv('PGDATABASE', 'rideshare_db'),
         'USER': os.getenv('PGUSER', 'postgres'),
         'PASSWORD': os.getenv('PGPASSWORD', 'postgres'),
-        'HOST': 'localhost',
-        'PORT': '5432',
+        'HOST': os.getenv('PGHOST', 'localhost'),
+        'PORT': os.getenv('PGPORT', '5432'),
+        **connection_settings(os.getenv('DB_POOL', 'persistent')),
     }
 }
 
+# Read replicas, as a comma-separated PGREPLICA_HOSTS. Safe reads are spread
+# over them unless the user wrote within DATABASE_PRIMARY_PIN_SECONDS. The
+# 'replica' alias always exists (pointing at the primary when no replica is
+# configured) and mirrors default under test.
+REPLICA_HOSTS = [host for host in os.getenv('PGREPLICA_HOSTS', '').split(',') if host]
+for position, host in enumerate(REPLICA_HOSTS or [DATABASES['default']['HOST']]):
+    DATABASES['replica' if position == 0 else f'replica_{position + 1}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default'] if REPLICA_HOSTS else []
+DATABASE_ROUTERS = ['rideshare_backend.db_router.PrimaryReplicaRouter']
+DATABASE_PRIMARY_PIN_SECONDS = 5
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -93,21 +117,167 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    'DEFAULT_RENDERER_CLASSES': [
+        'rideshare_backend.encoding.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rideshare_backend.encoding.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# JSON goes through orjson (stdlib json if it is missing). With msgpack
+# installed, clients can also send and ask for application/msgpack.
+if importlib.util.find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].insert(1, 'rideshare_backend.encoding.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].insert(1, 'rideshare_backend.encoding.MessagePackParser')
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://localhost:8000",
     "http://127.0.0.1:3000",
 ]
 
+RIDE_MATCHING = {
+    'ENABLED': os.getenv('RIDE_MATCHING_ENABLED', 'false').lower() == 'true',
+    'WINDOW_SECONDS': 2.0,
+    'MAX_PICKUP_KM': 5.0,
+    'CANDIDATES_PER_RIDE': 8,
+    'AVERAGE_SPEED_KMH': 30.0,
+    'ROAD_ETA': True,
+}
+
+# Pub/sub behind the ride and driver WebSockets. InProcessBroker serves a
+# single daphne process; use rides.realtime.ChannelLayerBroker with a
+# shared layer such as channels_redis when running several.
+REALTIME_BROKER = 'rides.realtime.InProcessBroker'
+
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+
+# Fare engine (payments.pricing). Rates per vehicle type can be overridden
+# without a restart by pointing PRICING_TABLE_FILE at a JSON file with the
+# same keys; it is re-read when its mtime changes. A driver's final fare
+# may be at most MAX_FARE_MULTIPLE times the ride's estimate.
+PRICING = {
+    'TAX_RATE': float(os.getenv('PRICING_TAX_RATE', '0')),
+    'ROAD_FACTOR': 1.3,
+    'AVERAGE_SPEED_KMH': 28.0,
+    'TABLE_FILE': os.getenv('PRICING_TABLE_FILE'),
+    'RELOAD_INTERVAL': 5.0,
+    'MAX_FARE_MULTIPLE': 3.0,
+}
+
+# Road distances and ETAs for pricing and matching come from a graph
+# built by build_road_graph; without GRAPH_FILE both use straight lines.
+ROUTING = {
+    'GRAPH_FILE': os.getenv('ROAD_GRAPH_FILE'),
+    'CELL_SIZE_DEG': 0.001,
+    'MAX_SNAP_KM': 0.5,
+    'ACCESS_SPEED_KMH': 15.0,
+    'CACHE_SIZE': 200000,
+}
+
+# Surge multipliers per ~2 km cell from open requests vs available drivers,
+# recomputed every TICK_SECONDS and rounded to STEP.
+SURGE = {
+    'ENABLED': os.getenv('SURGE_ENABLED', 'true').lower() == 'true',
+    'CELL_SIZE_DEG': 0.02,
+    'TICK_SECONDS': 10.0,
+    'DEMAND_RATIO_THRESHOLD': 1.0,
+    'SENSITIVITY': 0.5,
+    'SMOOTHING': 0.5,
+    'STEP': 0.1,
+    'MAX_MULTIPLIER': 3.0,
+}
+
+# Drivers silent for HEARTBEAT_TTL seconds go offline; online flags and
+# positions are written back to DriverProfile every FLUSH_INTERVAL.
+# Presence is kept per process and heartbeats are stamped in CACHES, so
+# that one process doesn't expire a driver whose heartbeats reach another;
+# the default local-memory cache serves a single daphne process, so
+# configure a shared backend such as Redis when running several.
+DRIVER_PRESENCE = {
+    'HEARTBEAT_TTL': 90.0,
+    'FLUSH_INTERVAL': 5.0,
+    'WRITE_BATCH_SIZE': 500,
+}
+
+# User id -> user_type and profile ids, cached per process and in CACHES.
+IDENTITY_CACHE = {
+    'LOCAL_TTL': 30.0,
+    'LOCAL_MAX_SIZE': 10000,
+    'SHARED_TTL': 300,
+}
+
+# Profile and finished-ride reads answer with ETags; serialized payloads
+# are kept in CACHES for PAYLOAD_TTL seconds, keyed by their ETag.
+RESPONSE_CACHE = {
+    'ENABLED': True,
+    'PAYLOAD_TTL': 300,
+}
+
+# Wallet balances are a running total of the Transaction ledger; snapshots
+# only cover entries older than SNAPSHOT_LAG_SECONDS.
+WALLET_LEDGER = {
+    'SNAPSHOT_LAG_SECONDS': 60.0,
+}
+
+# Ride fares are settled in the background through PROCESSOR, an
+# import path to a payments.processors.PaymentProcessor adapter for the
+# payment gateway. Until one is set the worker does not start and card
+# payments stay pending. FakeProcessor charges nothing and is only for
+# tests and benchmarks.
+SETTLEMENT = {
+    'PROCESSOR': os.getenv('PAYMENT_PROCESSOR'),
+    'PROCESSOR_OPTIONS': {},
+    'BATCH_SIZE': 100,
+    'CONCURRENCY': 20,
+    'CALL_TIMEOUT': 10.0,
+    'MAX_ATTEMPTS': 6,
+    'BACKOFF_BASE': 2.0,
+    'BACKOFF_MAX': 300.0,
+    'LEASE_SECONDS': 120.0,
+    'POLL_INTERVAL': 2.0,
+}
+
+# Ops dashboards read per-minute/per-hour buckets filled by the
+# rollup_metrics command; minute buckets are kept MINUTE_RETENTION_DAYS.
+ADMIN_METRICS = {
+    'LAG_SECONDS': 5.0,
+    'INTERVAL': 60.0,
+    'MINUTE_RETENTION_DAYS': 7,
+    'MAX_POINTS': 1440,
+}
+
+# Rides booked for later wait as 'scheduled' and are released to
+# matching LEAD_SECONDS before their scheduled_time.
+RIDE_SCHEDULER = {
+    'ENABLED': True,
+    'LEAD_SECONDS': 600.0,
+    'MAX_BATCH': 500,
+    'IDLE_WAIT_SECONDS': 60.0,
+}
+
+GPS_INGESTION = {
+    'BUFFERED': True,
+    'MAX_BATCH': 2000,
+    'FLUSH_INTERVAL': 0.5,
+    'MAX_PENDING': 100000,
+}
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': __import__('datetime').timedelta(hours=1),
     'REFRESH_TOKEN_LIFETIME': __import__('datetime').timedelta(days=7),
@@ -0,0 +1,31 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+
+async def _iterate_async(parts):
+    # Each part is produced in the sync thread, where the ORM may run.
+    parts = iter(parts)
+    step = sync_to_async(next)
+    while True:
+        part = await step(parts, None)
+        if part is None:
+            return
+        yield part
+
+
+def streaming_response(request, parts, content_type, filename=None):
+    """
+    Stream ``parts`` (an iterator of str or bytes) as the response body.
+
+    Under ASGI, Django reads a synchronous iterator into a list before
+    sending anything, which defeats streaming; there the iterator is
+    advanced one part at a time through ``sync_to_async`` instead.
+    """
+    request = getattr(request, '_request', request)
+    if isinstance(request, ASGIRequest):
+        parts = _iterate_async(parts)
+    response = StreamingHttpResponse(parts, content_type=content_type)
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,42 @@
+from django.db import connections, router
+
+
+def upsert(model, unique_fields, rows, increment=(), assign=(), batch_size=500):
+    """
+    Insert ``rows`` into ``model``'s table, folding each into the row it collides with.
+
+    ``rows`` are tuples ordered as ``unique_fields + increment + assign``.
+    On a conflict on ``unique_fields`` (which must match a unique
+    constraint) the ``increment`` columns are added to the stored values
+    and the ``assign`` columns overwritten, all in one ``INSERT ... ON
+    CONFLICT DO UPDATE`` per batch, so concurrent writers neither race on
+    the first insert nor read the row back. Rows go in key order, so two
+    batches touching the same keys lock them in the same order.
+    """
+    rows = sorted(rows, key=lambda row: row[:len(unique_fields)])
+    if not rows:
+        return
+    connection = connections[router.db_for_write(model)]
+    opts = model._meta
+    fields = [opts.get_field(name) for name in (*unique_fields, *increment, *assign)]
+    quote = connection.ops.quote_name
+    table = quote(opts.db_table)
+    columns = [quote(field.column) for field in fields]
+    keys = len(unique_fields)
+    counters = keys + len(increment)
+    updates = [f'{column} = {table}.{column} + EXCLUDED.{column}' for column in columns[keys:counters]]
+    updates.extend(f'{column} = EXCLUDED.{column}' for column in columns[counters:])
+    placeholder = f'({", ".join(["%s"] * len(columns))})'
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            params = [
+                field.get_db_prep_save(value, connection)
+                for row in batch for field, value in zip(fields, row)
+            ]
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES {", ".join([placeholder] * len(batch))} '
+                f'ON CONFLICT ({", ".join(columns[:keys])}) DO UPDATE SET {", ".join(updates)}',
+                params,
+            )
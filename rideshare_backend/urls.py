@@ -4,6 +4,8 @@ from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
 from users.views import UserViewSet, PassengerProfileViewSet, DriverProfileViewSet
 from rides.views import RideViewSet, RideLocationViewSet, RatingViewSet
+from payments.views import InvoiceViewSet
+from admin_panel.views import MetricsViewSet
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
@@ -12,6 +14,8 @@ router.register(r'drivers', DriverProfileViewSet, basename='driver')
 router.register(r'rides', RideViewSet, basename='ride')
 router.register(r'locations', RideLocationViewSet, basename='location')
 router.register(r'ratings', RatingViewSet, basename='rating')
+router.register(r'invoices', InvoiceViewSet, basename='invoice')
+router.register(r'metrics', MetricsViewSet, basename='metrics')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from users import identity  # noqa: F401  (connects the invalidation signals)
+        from users import payloads  # noqa: F401  (bumps driver payload versions)
@@ -0,0 +1,71 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from users.identity import get_identity, identity_user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    ``JWTAuthentication`` that resolves the user from the identity cache.
+
+    The returned user only has the identity columns loaded (see
+    ``identity_user``); views needing the full row fetch it themselves.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Revocation compares against the password hash, which is not cached.
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as exc:
+            raise InvalidToken('Token contained no recognizable user identification') from exc
+
+        identity = get_identity(user_id)
+        if identity is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if api_settings.CHECK_USER_IS_ACTIVE and not identity.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return identity_user(identity)
+
+
+class JWTAuthMiddleware:
+    """
+    ASGI middleware that resolves ``scope['user']`` from a SimpleJWT access token.
+
+    Browsers cannot set headers on a WebSocket handshake, so the token is read
+    from ``?token=`` as well as from an ``Authorization: Bearer`` header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.authentication = CachedJWTAuthentication()
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        scope['user'] = await self.resolve_user(scope)
+        return await self.app(scope, receive, send)
+
+    def raw_token(self, scope):
+        for name, value in scope.get('headers', ()):
+            if name == b'authorization':
+                return self.authentication.get_raw_token(value)
+        query = parse_qs(scope.get('query_string', b'').decode())
+        token = query.get('token')
+        return token[0].encode() if token else None
+
+    async def resolve_user(self, scope):
+        raw = self.raw_token(scope)
+        if raw is None:
+            return AnonymousUser()
+        try:
+            validated = self.authentication.get_validated_token(raw)
+            return await database_sync_to_async(self.authentication.get_user)(validated)
+        except (InvalidToken, TokenError, AuthenticationFailed):
+            return AnonymousUser()
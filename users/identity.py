@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from users.models import DriverProfile, PassengerProfile, User
+
+DEFAULTS = {
+    'LOCAL_TTL': 30.0,
+    'LOCAL_MAX_SIZE': 10000,
+    'SHARED_TTL': 300,
+}
+
+USER_FIELDS = ('username', 'user_type', 'is_active', 'is_staff', 'is_superuser')
+
+Identity = namedtuple('Identity', ('user_id',) + USER_FIELDS + ('passenger_profile_id', 'driver_profile_id'))
+
+
+def identity_settings():
+    return {**DEFAULTS, **getattr(settings, 'IDENTITY_CACHE', {})}
+
+
+def identity_user(identity):
+    """
+    A ``User`` built from ``identity`` without touching the database.
+
+    Only the cached columns are loaded; any other field is deferred and
+    fetched on first access, exactly as with ``.only()``.
+    """
+    user = User.from_db(
+        DEFAULT_DB_ALIAS,
+        ('id',) + USER_FIELDS,
+        (identity.user_id,) + tuple(getattr(identity, field) for field in USER_FIELDS),
+    )
+    user.identity = identity
+    return user
+
+
+class LocalLRU:
+    """A small thread-safe LRU with a per-entry TTL, kept per process."""
+
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_options = identity_settings()
+local_identities = LocalLRU(_options['LOCAL_MAX_SIZE'], _options['LOCAL_TTL'])
+
+
+def cache_key(user_id):
+    return f'identity:{user_id}'
+
+
+def load_identity(user_id):
+    row = (
+        User.objects.filter(pk=user_id).order_by()
+        .values_list(*USER_FIELDS, 'passenger_profile__id', 'driver_profile__id')
+        .first()
+    )
+    return None if row is None else Identity(user_id, *row)
+
+
+def get_identity(user_id):
+    """
+    Identity for ``user_id`` from the process LRU, then the shared cache,
+    then a single query. Returns ``None`` for unknown users.
+
+    Saves invalidate both layers in this process but only the shared cache
+    for other processes, whose LRU entries live out ``LOCAL_TTL``.
+    """
+    # JWT claims carry the id as a string; key everything on the real pk.
+    user_id = User._meta.pk.to_python(user_id)
+    identity = local_identities.get(user_id)
+    if identity is not None:
+        return identity
+    identity = cache.get(cache_key(user_id))
+    if identity is None:
+        identity = load_identity(user_id)
+        if identity is None:
+            return None
+        cache.set(cache_key(user_id), identity, identity_settings()['SHARED_TTL'])
+    local_identities.set(user_id, identity)
+    return identity
+
+
+def request_identity(request):
+    """The identity behind ``request.user``, reusing the one authentication resolved."""
+    identity = getattr(request.user, 'identity', None)
+    return identity if identity is not None else get_identity(request.user.pk)
+
+
+def invalidate_identity(user_id):
+    local_identities.delete(user_id)
+    cache.delete(cache_key(user_id))
+
+
+def _invalidate(user_id):
+    invalidate_identity(user_id)
+    # A request that reads between the write and its commit may cache the
+    # old row again, so drop it once more after commit.
+    transaction.on_commit(lambda: invalidate_identity(user_id))
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    _invalidate(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=PassengerProfile)
+@receiver([post_save, post_delete], sender=DriverProfile)
+def profile_changed(sender, instance, **kwargs):
+    _invalidate(instance.user_id)
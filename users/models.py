@@ -20,6 +20,9 @@ class User(AbstractUser):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='user_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_full_name()} ({self.user_type})"
@@ -33,6 +36,8 @@ class PassengerProfile(models.Model):
     emergency_contact = models.CharField(max_length=20, blank=True)
     rating = models.FloatField(default=5.0, validators=[MinValueValidator(0), MaxValueValidator(5)])
     total_rides = models.IntegerField(default=0)
+    # Versions cached responses; bulk writes must set it themselves.
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"Passenger: {self.user.get_full_name()}"
@@ -56,6 +61,14 @@ class DriverProfile(models.Model):
     total_rides = models.IntegerField(default=0)
     total_earnings = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     bank_account = models.CharField(max_length=50, blank=True)
+    # Versions cached responses, vehicles included; bulk writes must set it themselves.
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # Partial: only online drivers, keyed by status so "online and approved" is a seek.
+            models.Index(fields=['status'], condition=models.Q(is_online=True), name='driver_online_idx'),
+        ]
     
     def __str__(self):
         return f"Driver: {self.user.get_full_name()}"
@@ -75,6 +88,11 @@ class Vehicle(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['driver', 'vehicle_type'], condition=models.Q(is_active=True), name='vehicle_active_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.year} {self.make} {self.model} ({self.license_plate})"
 
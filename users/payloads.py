@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import DriverProfile, Vehicle
+
+
+@receiver([post_save, post_delete], sender=Vehicle)
+def vehicle_changed(sender, instance, **kwargs):
+    # Vehicles are nested in the driver's payload, whose ETag only reads
+    # the profile's updated_at.
+    DriverProfile.objects.filter(pk=instance.driver_id).update(updated_at=timezone.now())
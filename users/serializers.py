@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from users.models import User, PassengerProfile, DriverProfile, Vehicle, AdminProfile
+from drivers.presence import driver_presence
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -22,10 +23,15 @@ class VehicleSerializer(serializers.ModelSerializer):
 class DriverProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     vehicles = VehicleSerializer(many=True, read_only=True)
+    is_online = serializers.SerializerMethodField()
     
     class Meta:
         model = DriverProfile
         fields = ['id', 'user', 'license_number', 'license_expiry', 'status', 'is_online', 'current_location', 'rating', 'total_rides', 'total_earnings', 'bank_account', 'vehicles']
+    
+    def get_is_online(self, obj):
+        # Presence is authoritative; the column trails it by up to one flush.
+        return driver_presence.is_online(obj.id)
 
 class AdminProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
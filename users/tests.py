@@ -1,3 +1,157 @@
-from django.test import TestCase
+import datetime
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from drivers.presence import driver_presence
+from rideshare_backend.database import connection_settings, psycopg3_available
+from users.identity import LocalLRU, get_identity, local_identities
+from users.models import DriverProfile, User, Vehicle
+from users.serializers import DriverProfileSerializer
+
+
+class ConnectionSettingsTests(SimpleTestCase):
+    def test_persistent_connections_are_health_checked(self):
+        config = connection_settings('persistent', {'DB_CONN_MAX_AGE': '120'})
+        self.assertEqual(config['CONN_MAX_AGE'], 120)
+        self.assertTrue(config['CONN_HEALTH_CHECKS'])
+        self.assertEqual(connection_settings('off', {})['CONN_MAX_AGE'], 0)
+
+    def test_pgbouncer_mode_avoids_session_state(self):
+        config = connection_settings('pgbouncer', {})
+        self.assertTrue(config['DISABLE_SERVER_SIDE_CURSORS'])
+        if psycopg3_available():
+            self.assertIsNone(config['OPTIONS']['prepare_threshold'])
+
+    def test_unknown_mode_is_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            connection_settings('bouncy', {})
+
+    @skipIf(not psycopg3_available(), 'psycopg 3 is not installed')
+    def test_psycopg_pool_limits_come_from_env(self):
+        config = connection_settings('psycopg', {'DB_POOL_MAX_SIZE': '32', 'DB_POOL_MAX_WAITING': '5'})
+        self.assertEqual(config['CONN_MAX_AGE'], 0)
+        self.assertEqual(config['OPTIONS']['pool']['max_size'], 32)
+        self.assertEqual(config['OPTIONS']['pool']['max_waiting'], 5)
+
+    @skipIf(psycopg3_available(), 'psycopg 3 is installed')
+    def test_psycopg_pool_needs_psycopg3(self):
+        with self.assertRaises(ImproperlyConfigured):
+            connection_settings('psycopg', {})
+
+
+class LocalLRUTests(SimpleTestCase):
+    def test_entries_expire_and_least_recent_is_evicted(self):
+        now = [0.0]
+        lru = LocalLRU(max_size=2, ttl=10, clock=lambda: now[0])
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), 1)
+
+        now[0] = 10
+        self.assertIsNone(lru.get('a'))
+
+
+class IdentityCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        local_identities.clear()
+        self.user = User.objects.create_user(
+            username='driver', password='secret', user_type='driver', phone_number='+256700000001',
+        )
+        self.driver = DriverProfile.objects.create(
+            user=self.user, license_number='LIC-1', license_expiry=datetime.date(2030, 1, 1),
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_hot_driver_endpoints_skip_the_database_once_cached(self):
+        self.client.post('/api/drivers/go_offline/')
+        with self.assertNumQueries(0):  # the write is batched by driver presence
+            response = self.client.post('/api/drivers/go_offline/')
+        self.assertEqual(response.status_code, 200)
+
+        local_identities.clear()  # another process: served from the shared cache
+        with self.assertNumQueries(0):
+            self.client.post('/api/drivers/update_location/', {'lat': 0.31, 'lng': 32.58}, format='json')
+
+    def test_saves_invalidate_the_identity(self):
+        self.assertEqual(get_identity(self.user.pk).driver_profile_id, self.driver.pk)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(get_identity(self.user.pk).is_active)
+        self.assertEqual(self.client.post('/api/drivers/go_offline/').status_code, 401)
+
+        self.driver.delete()
+        self.assertIsNone(get_identity(self.user.pk).driver_profile_id)
+
+
+class ConditionalResponseTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        local_identities.clear()
+        driver_presence.reset()
+        self.addCleanup(driver_presence.reset)
+        self.user = User.objects.create_user(
+            username='driver', password='secret', user_type='driver', phone_number='+256700000001',
+        )
+        self.driver = DriverProfile.objects.create(
+            user=self.user, license_number='LIC-1', license_expiry=datetime.date(2030, 1, 1),
+        )
+        self.url = f'/api/drivers/{self.driver.pk}/'
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def add_vehicle(self, plate):
+        return Vehicle.objects.create(
+            driver=self.driver, make='Toyota', model='Premio', year=2015, license_plate=plate, color='white',
+            vehicle_type='economy', registration_number=f'REG-{plate}', insurance_expiry=datetime.date(2030, 1, 1),
+        )
+
+    def test_revalidation_answers_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.client.get('/api/users/profile/', HTTP_IF_NONE_MATCH=self.client.get(
+            '/api/users/profile/')['ETag']).status_code, 304)
+
+    def test_payload_is_served_from_the_cache(self):
+        first = self.client.get(self.url)
+        with mock.patch.object(DriverProfileSerializer, 'to_representation') as serialize:
+            second = self.client.get(self.url)
+        serialize.assert_not_called()
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_nested_and_bulk_writes_change_the_etag(self):
+        etags = [self.client.get(self.url)['ETag']]
+        self.add_vehicle('UAA 001A')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etags[-1])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['vehicles'][0]['license_plate'], 'UAA 001A')
+        etags.append(response['ETag'])
+
+        self.client.post('/api/drivers/go_online/')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etags[-1])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_online'])
+        etags.append(response['ETag'])
+
+        User.objects.filter(pk=self.user.pk).update(first_name='Ann', updated_at=timezone.now())
+        response = self.client.get('/api/drivers/', HTTP_IF_NONE_MATCH=etags[-1])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['user']['first_name'], 'Ann')
+        self.assertEqual(len(set(etags)), len(etags))
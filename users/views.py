@@ -1,14 +1,21 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
-from users.models import User, PassengerProfile, DriverProfile
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from rideshare_backend.conditional import ConditionalMixin, conditional_response, make_etag, payload_key
+from users.identity import request_identity
+from users.models import User, PassengerProfile, DriverProfile, Vehicle
 from users.serializers import (
     UserSerializer, UserRegistrationSerializer, 
     PassengerProfileSerializer, DriverProfileSerializer
 )
+from drivers.earnings import PERIODS, earnings_history, earnings_summary
+from drivers.presence import driver_presence
+from rides.realtime import publish_driver_location
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
@@ -51,41 +58,116 @@ class UserViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def profile(self, request):
-        serializer = UserSerializer(request.user)
-        return Response(serializer.data)
+        # request.user only carries the cached identity columns.
+        users = User.objects.filter(pk=request.user.pk)
+        updated_at = users.values_list('updated_at', flat=True).get()
+        etag = make_etag('users.user', request.accepted_renderer.format, request.user.pk, updated_at)
+        return conditional_response(
+            request, etag, updated_at, payload_key(User, request.user.pk),
+            lambda: UserSerializer(users.get()).data,
+        )
 
-class PassengerProfileViewSet(viewsets.ModelViewSet):
+class PassengerProfileViewSet(ConditionalMixin, viewsets.ModelViewSet):
     queryset = PassengerProfile.objects.all()
     serializer_class = PassengerProfileSerializer
     permission_classes = [IsAuthenticated]
+    version_fields = ('updated_at', 'user__updated_at')
+    cached_list = True
     
     def get_queryset(self):
-        return PassengerProfile.objects.filter(user=self.request.user)
+        return PassengerProfile.objects.filter(user=self.request.user).select_related('user').order_by('pk')
 
-class DriverProfileViewSet(viewsets.ModelViewSet):
+class DriverProfileViewSet(ConditionalMixin, viewsets.ModelViewSet):
     queryset = DriverProfile.objects.all()
     serializer_class = DriverProfileSerializer
     permission_classes = [IsAuthenticated]
+    version_fields = ('updated_at', 'user__updated_at')
+    cached_list = True
     
     def get_queryset(self):
-        return DriverProfile.objects.filter(user=self.request.user)
+        return DriverProfile.objects.filter(user=self.request.user).select_related('user').prefetch_related('vehicles').order_by('pk')
+    
+    def version_extra(self, pk):
+        # is_online comes from presence, not the row.
+        return (driver_presence.is_online(pk),)
     
     @action(detail=False, methods=['post'])
     def go_online(self, request):
-        try:
-            driver = DriverProfile.objects.get(user=request.user)
-            driver.is_online = True
-            driver.save()
-            return Response({'status': 'Driver is now online'})
-        except DriverProfile.DoesNotExist:
+        driver_id = request_identity(request).driver_profile_id
+        if driver_id is None:
             return Response({'error': 'Driver profile not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        if driver_presence.knows(driver_id):
+            driver_presence.go_online(driver_id)
+        else:
+            location, vehicle_type = DriverProfile.objects.filter(pk=driver_id).annotate(
+                active_vehicle_type=Subquery(
+                    Vehicle.objects.filter(driver=OuterRef('pk'), is_active=True).values('vehicle_type')[:1]
+                )
+            ).values_list('current_location', 'active_vehicle_type').get()
+            driver_presence.go_online(driver_id, location or None, vehicle_type)
+        return Response({'status': 'Driver is now online'})
     
     @action(detail=False, methods=['post'])
     def go_offline(self, request):
+        driver_id = request_identity(request).driver_profile_id
+        if driver_id is None:
+            return Response({'error': 'Driver profile not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        driver_presence.go_offline(driver_id)
+        return Response({'status': 'Driver is now offline'})
+    
+    @action(detail=False, methods=['post'])
+    def heartbeat(self, request):
+        driver_id = request_identity(request).driver_profile_id
+        if driver_id is None:
+            return Response({'error': 'Driver profile not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'is_online': driver_presence.heartbeat(driver_id)})
+    
+    @action(detail=False, methods=['get'])
+    def earnings(self, request):
+        driver_id = request_identity(request).driver_profile_id
+        if driver_id is None:
+            return Response({'error': 'Driver profile not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        # Served from the incremental rollups; never sums over rides or payments.
+        summary = earnings_summary(driver_id)
+        period = request.query_params.get('period')
+        if period is not None:
+            if period not in PERIODS:
+                return Response({'error': f"period must be one of {', '.join(PERIODS)}"}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                limit = max(1, min(int(request.query_params.get('limit', 30)), 366))
+            except ValueError:
+                return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+            summary['history'] = earnings_history(driver_id, period, limit)
+        return Response(summary)
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def online(self, request):
+        drivers = driver_presence.snapshot()
+        return Response({
+            'count': len(drivers),
+            'available': sum(not entry['busy'] for entry in drivers.values()),
+            'drivers': [{'id': driver_id, **entry} for driver_id, entry in drivers.items()],
+        })
+    
+    @action(detail=False, methods=['post'])
+    def update_location(self, request):
         try:
-            driver = DriverProfile.objects.get(user=request.user)
-            driver.is_online = False
-            driver.save()
-            return Response({'status': 'Driver is now offline'})
-        except DriverProfile.DoesNotExist:
+            lat = float(request.data.get('lat'))
+            lng = float(request.data.get('lng'))
+        except (TypeError, ValueError):
+            return Response({'error': 'lat and lng are required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        driver_id = request_identity(request).driver_profile_id
+        if driver_id is None:
             return Response({'error': 'Driver profile not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        location = {'lat': lat, 'lng': lng}
+        if request.data.get('address'):
+            location['address'] = request.data.get('address')
+        # Counts as a heartbeat; the position is written back in the next batch.
+        driver_presence.heartbeat(driver_id, location)
+        publish_driver_location(driver_id, lat, lng, timezone.now())
+        return Response({'current_location': location})